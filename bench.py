@@ -0,0 +1,361 @@
+"""
+Benchmarks for McGee Metropolis. Times the rules engine and rendering
+call by call, then plays a complete scripted game through the terminal
+game loop against in-memory storage, counting its storage round trips.
+Results are written as JSON and can be compared with a saved baseline,
+failing if anything got slower by more than the threshold.
+
+Usage: python bench.py --output bench.json --baseline bench_baseline.json
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+
+# The game must use in-memory storage and no files, and print at once
+os.environ.update({
+    'STORAGE_BACKEND': 'memory', 'TEXT_PACING': 'instant', 'JOURNAL_DIR': '',
+    'SNAPSHOT_DIR': '', 'MAP_SIZE': '10'
+})
+
+import numpy as np  # noqa: E402, the environment must be set first
+import run  # noqa: E402
+from engine import (  # noqa: E402
+    EMPTY, GAME_DAYS, INITIAL_METRICS, GameState, apply_random_event,
+    default_resources, initialize_random_grid, parse_events, parse_zone_data,
+    place_zone, place_zones, regenerate_resources, update_metrics
+)
+from events import EventEngine  # noqa: E402
+from journal import Journal  # noqa: E402
+from render import Renderer  # noqa: E402
+from simulate import balanced_policy  # noqa: E402
+from snapshot import SnapshotStore  # noqa: E402
+from storage import MemoryStorage, SEED_ROWS, TABLE_COLUMNS  # noqa: E402
+
+SEED = 2024  # Seeds every benchmark, so runs play the same games
+REPEATS = 5  # Timed runs of each benchmark, the median is reported
+GAME_REPEATS = 3  # Scripted games played
+DEFAULT_THRESHOLD = 0.25  # Slowdown allowed before a benchmark regresses
+
+ZONE_LETTERS = {
+    'Residential': 'R', 'Commercial': 'C', 'Industrial': 'I', 'School': 'S',
+    'Hospital': 'H'
+}
+
+
+class NullStream(io.TextIOBase):
+    """
+    Discards everything written, standing in for the terminal.
+    """
+
+    def write(self, text):
+        return len(text)
+
+
+class ScriptedInput(io.TextIOBase):
+    """
+    Types the lines of a script into the game, one per prompt.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+
+    def readline(self, size=-1):
+        return next(self.lines, '')
+
+    def close(self):
+        pass  # exit() closes sys.stdin
+
+
+def catalog():
+    """
+    The zones and events the benchmarks play with, as seeded in storage.
+    Returns: tuple: The compiled zones and events.
+    """
+    zones = [TABLE_COLUMNS['zones']]
+    zones += [list(row) for row in SEED_ROWS['zones']]
+    events = [
+        dict(zip(TABLE_COLUMNS['events'], row)) for row in SEED_ROWS['events']
+    ]
+    return parse_zone_data(zones), parse_events(events)
+
+
+def time_calls(function, repeats=REPEATS):
+    """
+    Time a function, calling it enough times for each run to take about
+    0.2 seconds.
+    Args:
+        function (function): Called with no arguments.
+        repeats (int): Timed runs.
+    Returns: dict: The median and min time of a call in microseconds and
+        the calls timed in each run.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    runs = [
+        seconds / number * 1e6 for seconds in timer.repeat(repeats, number)
+    ]
+    return {
+        'us': statistics.median(runs),
+        'min_us': min(runs),
+        'calls': number
+    }
+
+
+def engine_benchmarks(repeats=REPEATS):
+    """
+    Time the rules engine and rendering call by call.
+    Args: repeats (int): Timed runs of each benchmark.
+    Returns: dict: The timings of each benchmark, by name.
+    """
+    zone_data, events = catalog()
+    rng = random.Random(SEED)
+    resources = default_resources()
+    resources['Money']['Current Value'] = 1e12  # Never runs out
+    metrics = dict(INITIAL_METRICS)
+    grid = np.full((10, 10), EMPTY, dtype=np.int8)
+    cells = [(x, y) for x in range(10) for y in range(10)]
+    next_cell = iter(cells * 10 ** 6).__next__
+
+    def build():
+        x, y = next_cell()
+        place_zone(grid, 'Residential', x, y, resources, metrics)
+        grid[x, y] = EMPTY  # Free the cell for the next build
+
+    area = np.array([(0, y) for y in range(10)])
+
+    def build_area():
+        place_zones(grid, 'Residential', area, resources, metrics)
+        grid[0] = EMPTY  # Free the row for the next build
+
+    engine = EventEngine(events, random.Random(SEED))
+    event_resources = default_resources()
+    state = Journal(SEED).new_game(zone_data, events, default_resources())
+    large_state = GameState(
+        zone_data, events, default_resources(), size=1000, verbose=False,
+        rng=random.Random(SEED)
+    )
+    null = NullStream()
+    renderer = Renderer(null)
+
+    def print_grid():
+        stdout, sys.stdout = sys.stdout, null
+        try:
+            run.print_grid(state.grid)
+        finally:
+            sys.stdout = stdout
+
+    def draw_frame():
+        renderer.invalidate()  # Time a full draw, not an unchanged frame
+        renderer.draw(state)
+
+    benchmarks = {
+        'initialize_random_grid': lambda: initialize_random_grid(
+            10, zone_data, rng
+        ),
+        'initialize_random_grid_1000': lambda: initialize_random_grid(
+            1000, zone_data, rng
+        ),
+        'place_zone': build,
+        'place_zones_10': build_area,
+        'update_metrics': lambda: update_metrics(
+            metrics, resources, 'Industrial', 1
+        ),
+        'apply_random_event': lambda: apply_random_event(
+            engine, event_resources
+        ),
+        'regenerate_resources': lambda: regenerate_resources(resources, 0.0),
+        'fork_state': state.copy,
+        'fork_state_1000': large_state.copy,
+        'deepcopy_state': lambda: copy.deepcopy(state),
+        'print_grid': print_grid,
+        'render_frame': draw_frame
+    }
+    return {
+        name: time_calls(function, repeats)
+        for name, function in benchmarks.items()
+    }
+
+
+def game_script(zone_data, events):
+    """
+    Choose the moves of a complete game with the balanced policy of the
+    simulator, and type them as the player would.
+    Args:
+        zone_data (ZoneCatalog): The compiled zones.
+        events (EventCatalog): The compiled events.
+    Returns: tuple: The lines typed, and the days and status of the game.
+    """
+    # The same inputs and seed as the game played through run.py
+    state = Journal(SEED).new_game(
+        zone_data, events, default_resources(), dict(INITIAL_METRICS)
+    )
+    policy_rng = random.Random(SEED)
+    lines = ['play\n']
+    while not state.is_over:
+        action = balanced_policy(state, policy_rng)
+        if action[0] == 'build':
+            _, x, y, zone_type = action
+            lines += ['zone\n', f'{x}\n', f'{y}\n',
+                      f'{ZONE_LETTERS[zone_type]}\n']
+        else:
+            lines.append('next\n')
+        state.step(action)
+    lines += ['exit\n', 'yes\n', 'no\n']  # Leave without playing again
+    return lines, state.day, state.status
+
+
+def play_scripted_game(lines):
+    """
+    Play a scripted game through the terminal game loop, from the intro to
+    leaving the game.
+    Args: lines (list): The lines the player types.
+    Returns: tuple: The seconds taken, the game played and the storage
+        round trips by kind.
+    """
+    backend = MemoryStorage()
+    run.STORAGE.backend = backend
+    run.SESSION.journal = Journal(SEED)
+    run.SESSION.snapshots = SnapshotStore(None)
+    run.SESSION.renderer = Renderer()
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin, sys.stdout = ScriptedInput(lines), NullStream()
+    start = time.perf_counter()
+    try:
+        run.play_session()
+    except SystemExit:
+        pass  # The player left
+    finally:
+        sys.stdin, sys.stdout = stdin, stdout
+    seconds = time.perf_counter() - start
+    run.STORAGE.drain()
+    return seconds, run.SESSION.journal.state, dict(backend.calls)
+
+
+def game_benchmark(repeats=GAME_REPEATS):
+    """
+    Time complete scripted games and count their storage round trips.
+    Args: repeats (int): Games played.
+    Returns: dict: The median game time, the game played, and the round
+        trips of the game by kind and per day. Writes are queued and sent
+        in batches, so how many are sent depends on timing.
+    """
+    zone_data, events = catalog()
+    lines, days, status = game_script(zone_data, events)
+    results = [play_scripted_game(lines) for _ in range(repeats)]
+    seconds = [result[0] for result in results]
+    _, state, calls = results[-1]
+    if (state.day, state.status) != (days, status):
+        raise RuntimeError(
+            f"The scripted game ended on day {state.day}, {state.status}, "
+            f"not day {days}, {status}."
+        )
+    reads = sum(
+        count for kind, count in calls.items() if kind != 'write_resources'
+    )
+    return {
+        'ms': statistics.median(seconds) * 1000,
+        'min_ms': min(seconds) * 1000,
+        'days': state.day,
+        'status': state.status,
+        'turns': sum(line == 'zone\n' or line == 'next\n' for line in lines),
+        'round_trips': calls,
+        'reads_per_day': reads / state.day,
+        'writes_per_day': calls.get('write_resources', 0) / state.day
+    }
+
+
+def run_benchmarks(repeats=REPEATS, game_repeats=GAME_REPEATS):
+    """
+    Run every benchmark.
+    Args:
+        repeats (int): Timed runs of each engine benchmark.
+        game_repeats (int): Scripted games played.
+    Returns: dict: The results, with the machine they ran on.
+    """
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'seed': SEED,
+            'game_days': GAME_DAYS
+        },
+        'engine': engine_benchmarks(repeats),
+        'game': game_benchmark(game_repeats)
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare results with a baseline and print the change of each.
+    Args:
+        results (dict): Results of run_benchmarks().
+        baseline (dict): Saved results to compare with.
+        threshold (float): Slowdown allowed, 0.25 for 25%.
+    Returns: list: Names of the benchmarks that regressed.
+    """
+    # The fastest run is the least disturbed by the rest of the machine
+    rows = [
+        (name, baseline['engine'][name]['min_us'], timing['min_us'], 'us')
+        for name, timing in results['engine'].items()
+        if name in baseline.get('engine', {})
+    ]
+    if 'game' in baseline:
+        rows.append(('game', baseline['game']['min_ms'],
+                     results['game']['min_ms'], 'ms'))
+        rows.append(('game reads per day', baseline['game']['reads_per_day'],
+                     results['game']['reads_per_day'], ''))
+    regressions = []
+    print(f"{'Benchmark':<30}{'Baseline':>12}{'Now':>12}{'Change':>9}")
+    for name, before, now, unit in rows:
+        change = now / before - 1 if before else 0.0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<30}{before:>10.3f}{unit:<2}{now:>10.3f}{unit:<2}"
+              f"{change:>+8.1%}{'  slower' if regressed else ''}")
+    return regressions
+
+
+def main():
+    """
+    Parse the command line, run the benchmarks and compare them.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help="Write the results to this file")
+    parser.add_argument('--baseline', help="Compare with saved results")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Slowdown allowed before failing, 0.25 for 25%%")
+    parser.add_argument('--quick', action='store_true',
+                        help="Fewer runs, for a rough check")
+    args = parser.parse_args()
+    if args.quick:
+        results = run_benchmarks(repeats=2, game_repeats=1)
+    else:
+        results = run_benchmarks()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+    if not args.baseline:
+        print(json.dumps(results, indent=2))
+        return
+    with open(args.baseline, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,119 @@
 const Pty = require('node-pty');
 const fs = require('fs');
+const net = require('net');
+
+// One game server hosts every session, unless GAME_SERVER is 'off', which
+// spawns a game process per websocket as before
+const SERVER = process.env.GAME_SERVER !== 'off';
+const SERVER_PORT = parseInt(process.env.GAME_SERVER_PORT || '8765', 10);
+const RETRY_DELAY = 250;
+const RETRIES = 40;
 
 exports.install = function () {
 
     ROUTE('/');
-    WEBSOCKET('/', socket, ['raw']);
+    WEBSOCKET('/', SERVER ? serverSocket : socket, ['raw']);
+    SERVER && startServer();
 
 };
 
+function startServer() {
+
+    var server = Pty.spawn('python3', ['server.py', '--port', String(SERVER_PORT)], {
+        name: 'xterm-color',
+        cols: 80,
+        rows: 24,
+        cwd: process.env.PWD,
+        env: process.env
+    });
+
+    server.on('data', function (data) {
+        process.stdout.write(data);
+    });
+
+    server.on('exit', function (code, signal) {
+        console.log("Game server stopped, restarting");
+        setTimeout(startServer, RETRY_DELAY * 4);
+    });
+}
+
+function sessionOf(client) {
+    // The browser's session ID lets a reconnecting player resume
+    return String((client.query && client.query.session) || '')
+        .replace(/[^A-Za-z0-9-]/g, '').substring(0, 64);
+}
+
+function serverSocket() {
+
+    this.encodedecode = false;
+    this.autodestroy();
+
+    this.on('open', function (client) {
+
+        var session = sessionOf(client);
+        var retries = RETRIES;
+        // Keys typed before the connection is up, sent once it is
+        client.pending = [];
+
+        // The server may still be starting, so retry for a few seconds
+        (function connect() {
+            if (client.closed) {
+                return;
+            }
+            var conn = net.connect(SERVER_PORT, '127.0.0.1');
+            client.conn = conn;
+            conn.setEncoding('utf8');
+
+            conn.on('connect', function () {
+                retries = 0;
+                conn.write(session + '\n');
+                client.pending.forEach(function (msg) {
+                    conn.write(msg);
+                });
+                client.pending = [];
+            });
+
+            conn.on('data', function (data) {
+                client.send(data);
+            });
+
+            conn.on('error', function (err) {
+                if (retries-- > 0 && client.conn === conn) {
+                    client.conn = null;
+                    setTimeout(connect, RETRY_DELAY);
+                } else {
+                    console.log('Game server error: ', err.message);
+                }
+            });
+
+            conn.on('close', function () {
+                if (client.conn === conn) {
+                    client.conn = null;
+                    client.close();
+                }
+            });
+        })();
+
+    });
+
+    this.on('close', function (client) {
+        client.closed = true;
+        if (client.conn) {
+            var conn = client.conn;
+            client.conn = null;
+            conn.destroy();
+        }
+    });
+
+    this.on('message', function (client, msg) {
+        if (client.conn && !client.conn.connecting) {
+            client.conn.write(msg);
+        } else if (client.pending) {
+            client.pending.push(msg);
+        }
+    });
+}
+
 function socket() {
 
     this.encodedecode = false;
@@ -15,13 +121,15 @@ function socket() {
 
     this.on('open', function (client) {
 
+        var session = sessionOf(client);
+
         // Spawn terminal
         client.tty = Pty.spawn('python3', ['run.py'], {
             name: 'xterm-color',
             cols: 80,
             rows: 24,
             cwd: process.env.PWD,
-            env: process.env
+            env: Object.assign({}, process.env, { SESSION_ID: session })
         });
 
         client.tty.on('exit', function (code, signal) {
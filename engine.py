@@ -0,0 +1,1059 @@
+"""
+Game rules for McGee Metropolis. This module holds the city grid, resources,
+metrics and events of a game and applies the rules to them with no terminal
+input or output, so a game can be driven quickly from code. Messages for
+the player are collected in a log instead of being printed.
+The grid is an int8 NumPy array of zone codes, the index of each zone type
+in ZONE_TYPES, with 0 for an empty cell. Maps larger than DENSE_GRID_LIMIT
+use a SparseGrid of the occupied cells instead. The costs, incomes and
+metric effects of the zone types are compiled into a ZoneCatalog.
+"""
+import functools
+import random
+from operator import methodcaller
+import numpy as np
+from events import EventCatalog, EventEngine
+from profiling import timed
+from zones import (
+    DEFAULT_ZONES, EMPTY, RESIDENTIAL, SERVICE_EFFECTS, SERVICE_RADIUS,
+    ZONE_CODES, ZONE_TYPES, ZoneCatalog
+)
+
+GRID_SIZE = 10
+MAX_GRID_SIZE = 1000  # Largest map that can be played
+DENSE_GRID_LIMIT = 100  # Larger maps store only their occupied cells
+MAX_ZONES_PER_DAY = 3  # Zones that can be built in a day, by default
+ZONES_PER_DAY_LIMIT = 65535  # Largest daily limit a snapshot can store
+GAME_DAYS = 30  # Number of days in a game
+MONETARY_GOAL = 2000000  # Money needed by the end of the game to win
+
+# Default resources as (current value, regeneration rate)
+DEFAULT_RESOURCES = {
+    'Money': (10000, 0.0),
+    'Electricity': (500, 5.0),  # Set regeneration rate for Electricity
+    'Water': (500, 5.0)  # Set regeneration rate for Water
+}
+
+# Initial metrics for a new game
+INITIAL_METRICS = {
+    'Employment Rate': 70,
+    'Crime Rate': 5,
+    'Happiness Index': 75,
+    'Health': 80
+}
+
+# Critical metric levels, Crime Rate is a maximum and the others minimums
+METRIC_LIMITS = {
+    'Employment Rate': 50,
+    'Crime Rate': 30,
+    'Happiness Index': 50,
+    'Health': 50
+}
+
+# Whether each zone code is a service, which covers the Residential zones
+# near it, to find the services of an array of codes with one lookup
+IS_SERVICE = np.array(
+    [zone_type in SERVICE_EFFECTS for zone_type in ZONE_TYPES]
+)
+
+
+def parse_zone_data(data, log=None):
+    """
+    Compile the rows of the zones table once, for every game.
+    Args: data (list): Rows of cell strings, including the header row.
+        log (list): Messages about invalid values are appended here.
+    Returns: ZoneCatalog: The compiled zones.
+    """
+    return ZoneCatalog.compile(data, log)
+
+
+def parse_player_resources(data, log=None):
+    """
+    Convert the records of the resources table into player resources.
+    Args: data (list): A list of dictionaries, one per resource.
+        log (list): Messages about invalid values are appended here.
+    Returns: dict: A dictionary containing player resources.
+    """
+    player_resources = {}
+    for res in data:
+        resource_type = res['Resource Type']
+        current_value = res['Current Value']
+        regeneration_rate = res.get('Regeneration Rate', 0)
+        # Convert current_value to float, handling strings with commas
+        try:
+            current_value = float(str(current_value).replace(',', ''))
+        except ValueError:
+            if log is not None:
+                log.append(
+                    f"Invalid value for {resource_type}: {current_value}"
+                )
+            current_value = 0.0
+        # Convert to float or default to 0.0 if empty
+        try:
+            regeneration_rate = float(regeneration_rate)
+        except ValueError:
+            if log is not None:
+                log.append(
+                    f"Invalid rate for {resource_type}: {regeneration_rate}"
+                )
+            regeneration_rate = 0.0
+        player_resources[resource_type] = {
+            'Current Value': current_value,
+            'Regeneration Rate': regeneration_rate
+        }
+    return player_resources
+
+
+def parse_events(events, log=None):
+    """
+    Compile the records of the events table once, for every game.
+    Args: events (list): A list of dictionaries containing event data.
+        log (list): Messages about invalid values are appended here.
+    Returns: EventCatalog: The compiled events.
+    """
+    return EventCatalog.compile(events, log)
+
+
+def default_resources():
+    """
+    Build a new set of player resources at their default values.
+    Returns: dict: A dictionary containing player resources.
+    """
+    return {
+        resource_type: {
+            'Current Value': float(current_value),
+            'Regeneration Rate': regeneration_rate
+        }
+        for resource_type, (current_value, regeneration_rate)
+        in DEFAULT_RESOURCES.items()
+    }
+
+
+def copy_resources(player_resources):
+    """
+    Copy player resources, so the copy can change independently.
+    Args: player_resources (dict): A dictionary containing the resources.
+    Returns: dict: The copy.
+    """
+    return {
+        resource_type: dict(values)
+        for resource_type, values in player_resources.items()
+    }
+
+
+# The parts of a game its steps change in place, which forks of the game
+# share until one of them changes it, and how each is copied
+SHARED_PARTS = {
+    'grid': methodcaller('copy'),
+    'ledger': methodcaller('copy'),
+    'coverage': methodcaller('copy'),
+    'player_resources': copy_resources,
+    'metrics': dict
+}
+
+
+def initialize_grid(size):
+    """
+    Initialise an empty game grid with the specified size.
+    Args: size (int): The size of the grid.
+    Returns: numpy.ndarray: A size x size int8 array of empty cells, or a
+        SparseGrid for maps larger than DENSE_GRID_LIMIT.
+    """
+    if size > DENSE_GRID_LIMIT:
+        return SparseGrid(size)
+    return np.full((size, size), EMPTY, dtype=np.int8)
+
+
+class SparseGrid:
+    """
+    A large game grid that stores only its occupied cells, as zone codes in
+    a dict keyed by (x, y), so memory and the cost of counting zones grow
+    with the zones built rather than the size of the map. It supports the
+    parts of the NumPy array interface the game uses: reading and writing
+    a cell with grid[x, y], and reading a block of cells with
+    grid[x0:x1, y0:y1] as a dense int8 array.
+    """
+
+    def __init__(self, size, cells=None):
+        """
+        Args:
+            size (int): The size of the grid.
+            cells (dict): Zone codes of the occupied cells keyed by (x, y).
+        """
+        self.shape = (size, size)
+        self.cells = {} if cells is None else cells
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        x, y = key
+        if isinstance(x, slice) or isinstance(y, slice):
+            return self.block(x, y)
+        self.check(x, y)
+        return self.cells.get((x, y), EMPTY)
+
+    def __setitem__(self, key, code):
+        x, y = key
+        self.check(x, y)
+        if code == EMPTY:
+            self.cells.pop((x, y), None)
+        else:
+            self.cells[(x, y)] = int(code)
+
+    def check(self, x, y):
+        """
+        Check a cell is on the grid.
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+        Raises: IndexError: If the cell is off the grid.
+        """
+        if not (0 <= x < self.shape[0] and 0 <= y < self.shape[1]):
+            raise IndexError(f"Cell {x}, {y} is off the grid.")
+
+    def block(self, rows, columns):
+        """
+        Copy a block of cells into a dense array, visiting whichever is
+        fewer, the cells of the block or the occupied cells.
+        Args:
+            rows (slice): The x-coordinates of the block.
+            columns (slice): The y-coordinates of the block.
+        Returns: numpy.ndarray: The block as an int8 array.
+        """
+        if not isinstance(rows, slice):
+            rows = slice(rows, rows + 1)
+        if not isinstance(columns, slice):
+            columns = slice(columns, columns + 1)
+        x0, x1, _ = rows.indices(self.shape[0])
+        y0, y1, _ = columns.indices(self.shape[1])
+        block = np.full(
+            (max(x1 - x0, 0), max(y1 - y0, 0)), EMPTY, dtype=np.int8
+        )
+        if block.size < len(self.cells):
+            for x in range(x0, x1):
+                for y in range(y0, y1):
+                    block[x - x0, y - y0] = self.cells.get((x, y), EMPTY)
+        else:
+            for (x, y), code in self.cells.items():
+                if x0 <= x < x1 and y0 <= y < y1:
+                    block[x - x0, y - y0] = code
+        return block
+
+    def copy(self):
+        """
+        Returns: SparseGrid: An independent copy of the grid.
+        """
+        return SparseGrid(self.shape[0], dict(self.cells))
+
+    def take(self, xs, ys):
+        """
+        Read many cells at once, as grid[xs, ys] does for an array.
+        Args:
+            xs (numpy.ndarray): The x-coordinates.
+            ys (numpy.ndarray): The y-coordinates.
+        Returns: numpy.ndarray: The zone code of each cell.
+        """
+        get = self.cells.get
+        return np.fromiter(
+            (get(cell, EMPTY) for cell in zip(xs.tolist(), ys.tolist())),
+            np.int8, len(xs)
+        )
+
+    def put(self, xs, ys, code):
+        """
+        Place one zone code on many empty cells at once.
+        Args:
+            xs (numpy.ndarray): The x-coordinates.
+            ys (numpy.ndarray): The y-coordinates.
+            code (int): The zone code.
+        """
+        self.cells.update(
+            (cell, code) for cell in zip(xs.tolist(), ys.tolist())
+        )
+
+
+def zone_counts(grid):
+    """
+    Count the cells holding each zone code.
+    Args: grid (numpy.ndarray or SparseGrid): The game grid.
+    Returns: numpy.ndarray: The number of cells of each zone code.
+    """
+    if isinstance(grid, SparseGrid):
+        # Only the occupied cells are visited, the rest are empty
+        counts = np.bincount(
+            np.fromiter(grid.cells.values(), np.int64, len(grid.cells)),
+            minlength=len(ZONE_TYPES)
+        )
+        counts[EMPTY] = len(grid) * len(grid) - len(grid.cells)
+        return counts
+    return np.bincount(grid.ravel(), minlength=len(ZONE_TYPES))
+
+
+def daily_income(grid, incomes):
+    """
+    Total the daily income of every zone on the grid.
+    Args:
+        grid (numpy.ndarray): The game grid.
+        incomes (numpy.ndarray): The income of each zone code.
+    Returns: float: The total daily income.
+    """
+    return float(zone_counts(grid) @ incomes)
+
+
+class IncomeLedger:
+    """
+    Running count of the zones of each type on the grid and the total daily
+    income they earn, updated in O(1) whenever a zone is placed or removed
+    so the grid never has to be rescanned.
+    """
+
+    def __init__(self, grid, incomes):
+        """
+        Start the ledger from a full count of the grid.
+        Args:
+            grid (numpy.ndarray): The game grid.
+            incomes (numpy.ndarray): The income of each zone code.
+        """
+        counts = zone_counts(grid)
+        self.incomes = incomes.tolist()
+        self.counts = counts.tolist()
+        self.total = float(counts @ incomes)  # As daily_income() totals it
+
+    def add(self, code, count=1):
+        """
+        Record zones placed on empty cells of the grid.
+        Args:
+            code (int): The zone code.
+            count (int): The number of zones placed.
+        """
+        self.counts[EMPTY] -= count
+        self.counts[code] += count
+        self.total += self.incomes[code] * count
+
+    def remove(self, code):
+        """
+        Record a zone removed from the grid, leaving an empty cell.
+        Args: code (int): The zone code.
+        """
+        self.counts[EMPTY] += 1
+        self.counts[code] -= 1
+        self.total -= self.incomes[code]
+
+    def matches(self, grid):
+        """
+        Check the ledger against a full recount of the grid.
+        Args: grid (numpy.ndarray): The game grid.
+        Returns: bool: True if the counts and total income agree.
+        """
+        return (
+            self.counts == zone_counts(grid).tolist() and
+            abs(self.total - daily_income(grid, np.array(self.incomes))) <
+            1e-6
+        )
+
+    def copy(self):
+        """
+        Returns: IncomeLedger: An independent copy of the ledger.
+        """
+        ledger = IncomeLedger.__new__(IncomeLedger)
+        ledger.incomes = self.incomes  # Never changed, so shared
+        ledger.counts = list(self.counts)
+        ledger.total = self.total
+        return ledger
+
+
+@functools.lru_cache()
+def reach_offsets(radius):
+    """
+    List the steps from a service to the cells it reaches, a diamond of
+    cells around it.
+    Args: radius (int): How many steps a service reaches.
+    Returns: tuple: The (dx, dy) of each cell, shared by every field.
+    """
+    return tuple(
+        (dx, dy)
+        for dx in range(-radius, radius + 1)
+        for dy in range(-radius, radius + 1)
+        if abs(dx) + abs(dy) <= radius
+    )
+
+
+class CoverageField:
+    """
+    How many services of each type reach each cell, and how many
+    Residential zones each type of service covers. A service reaches the
+    cells within SERVICE_RADIUS steps of it, a diamond of cells around it.
+    Counts are kept only for cells a service reaches, and each placement
+    updates them in O(radius²) without rescanning the grid.
+    """
+
+    def __init__(self, grid, radius=SERVICE_RADIUS):
+        """
+        Start the field from the services already on the grid.
+        Args:
+            grid (numpy.ndarray or SparseGrid): The game grid.
+            radius (int): How many steps a service reaches.
+        """
+        self.size = len(grid)
+        self.radius = radius
+        self.offsets = reach_offsets(radius)
+        # Services reaching each cell, by service type and (x, y)
+        self.reach = {service: {} for service in SERVICE_EFFECTS}
+        self.covered = {service: 0 for service in SERVICE_EFFECTS}
+        if isinstance(grid, SparseGrid):
+            cells = [
+                (x, y, code) for (x, y), code in grid.cells.items()
+                if ZONE_TYPES[code] in SERVICE_EFFECTS
+            ]
+        else:
+            # Find the services with one pass over the array
+            xs, ys = np.nonzero(IS_SERVICE[grid])
+            cells = zip(xs.tolist(), ys.tolist(), grid[xs, ys].tolist())
+        for x, y, code in cells:
+            self.add(grid, x, y, code)
+
+    def add(self, grid, x, y, code):
+        """
+        Record a zone placed on the grid.
+        Args:
+            grid (numpy.ndarray or SparseGrid): The game grid, with the zone.
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+            code (int): The zone code.
+        Returns: dict: The Residential zones newly covered by each type of
+            service, for the services with any.
+        """
+        zone_type = ZONE_TYPES[code]
+        newly_covered = {}
+        if zone_type in SERVICE_EFFECTS:
+            reach = self.reach[zone_type]
+            radius = self.radius
+            x0, y0 = max(x - radius, 0), max(y - radius, 0)
+            # Read the cells in reach at once, as reading them one at a time
+            # from the array is much slower
+            block = grid[x0:x + radius + 1, y0:y + radius + 1].tolist()
+            count = 0
+            for dx, dy in self.offsets:
+                cell = (x + dx, y + dy)
+                if not (0 <= cell[0] < self.size and 0 <= cell[1] < self.size):
+                    continue
+                services = reach.get(cell, 0)
+                if (services == 0 and
+                        block[cell[0] - x0][cell[1] - y0] == RESIDENTIAL):
+                    count += 1
+                reach[cell] = services + 1
+            if count:
+                newly_covered[zone_type] = count
+        elif code == RESIDENTIAL:
+            for service, reach in self.reach.items():
+                if reach.get((x, y), 0):
+                    newly_covered[service] = 1
+        for service, count in newly_covered.items():
+            self.covered[service] += count
+        return newly_covered
+
+    def copy(self):
+        """
+        Returns: CoverageField: An independent copy of the field.
+        """
+        field = CoverageField.__new__(CoverageField)
+        field.size = self.size
+        field.radius = self.radius
+        field.offsets = self.offsets  # Never changed, so shared
+        field.reach = {
+            service: dict(reach) for service, reach in self.reach.items()
+        }
+        field.covered = dict(self.covered)
+        return field
+
+
+def initialize_random_grid(size, zones, rng=None):
+    """
+    Initialise the game grid with random zones based on fetched counts.
+    Args: size (int): The size of the grid.
+        zones (ZoneCatalog): The zones and how many of each to place.
+        rng (random.Random): Seeds the NumPy generator that draws the zone
+            positions, the random module if None.
+    Returns: tuple: A tuple containing the initialied grid and the total daily
+        income.
+    """
+    generator = np.random.default_rng((rng or random).getrandbits(64))
+    grid = initialize_grid(size)
+    # In the order of the zones table, so a seed always draws the same grid
+    codes = [ZONE_CODES[zone_type] for zone_type in zones.zone_data]
+    counts = [zones.counts[code] for code in codes]
+    placed = np.repeat(np.array(codes, dtype=np.int8), counts)[:size * size]
+    if isinstance(grid, SparseGrid):
+        # Draw distinct cells without visiting the whole map
+        cells = generator.choice(size * size, len(placed), replace=False)
+        grid.cells = {
+            divmod(int(cell), size): int(code)
+            for cell, code in zip(cells, placed)
+        }
+    else:
+        # Scatter the zones over distinct random cells in one assignment
+        grid.flat[generator.permutation(size * size)[:len(placed)]] = placed
+    return grid, daily_income(grid, zones.incomes)
+
+
+@timed('rules.place_zone')
+def place_zone(grid, zone_type, x, y, player_resources, metrics, log=None,
+               ledger=None, coverage=None, zones=DEFAULT_ZONES):
+    """
+    Place a zone on the grid at the specified coordinates if enough resources
+    are available.
+    Args:
+        grid (numpy.ndarray): The game grid.
+        zone_type (str): The type of zone to place.
+        x (int): The x-coordinate.
+        y (int): The y-coordinate.
+        player_resources (dict): A dictionary containing the player's
+        resources.
+        metrics (dict): A dictionary containing the current metrics.
+        log (list): Messages for the player are appended here, if given.
+        ledger (IncomeLedger): Updated with the new zone, if given.
+        coverage (CoverageField): Updated with the new zone, if given.
+            Hospitals and Schools only change metrics through it.
+        zones (ZoneCatalog): The costs and effects of the zones.
+    Returns: bool: True if the zone was placed.
+    """
+    money = player_resources['Money']
+    code = ZONE_CODES[zone_type]
+    cost = zones.costs[code]
+    if money['Current Value'] < cost:
+        if log is not None:
+            log.append(
+                "Sorry, you do not enough money to build this zone right now."
+            )
+        return False
+    if grid[x, y] != EMPTY:
+        if log is not None:
+            log.append(
+                "This plot is already occupied, please choose another plot"
+            )
+        return False
+    grid[x, y] = code
+    if ledger is not None:
+        ledger.add(code)
+    # Deduct the cost of zone from resources
+    money['Current Value'] -= cost
+    if log is not None:
+        log.append(
+            f"Congratulations, you built a {zone_type} & placed it at "
+            f"{x}, {y}."
+        )
+        log.append(f"Remaining Money: {money['Current Value']:.2f}")
+    newly_covered = {}
+    if coverage is not None:
+        newly_covered = coverage.add(grid, x, y, code)
+        if log is not None:
+            log_coverage(log, zone_type, newly_covered)
+    update_metrics(metrics, player_resources, zone_type, 1, newly_covered,
+                   zones)
+    return True
+
+
+def area_cells(cells):
+    """
+    Turn the cells of an area into an array, without copying an array.
+    Args: cells: (x, y) pairs, as a list or an N x 2 array.
+    Returns: numpy.ndarray: An N x 2 int64 array of the cells.
+    """
+    return np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+
+
+@timed('rules.place_zones')
+def place_zones(grid, zone_type, cells, player_resources, metrics, log=None,
+                ledger=None, coverage=None, zones=DEFAULT_ZONES):
+    """
+    Place one type of zone on many cells as a single build, all of them or
+    none. Every cell is checked to be on the grid, listed once and empty,
+    and the total cost to be affordable, with array operations rather
+    than a check per cell. The cost of every zone is deducted before the
+    effects of the zones are applied, once for the whole area.
+    Args:
+        grid (numpy.ndarray or SparseGrid): The game grid.
+        zone_type (str): The type of zone to place.
+        cells: (x, y) pairs of the cells, as a list or an N x 2 array.
+        player_resources (dict): A dictionary containing the player's
+        resources.
+        metrics (dict): A dictionary containing the current metrics.
+        log (list): Messages for the player are appended here, if given.
+        ledger (IncomeLedger): Updated with the new zones, if given.
+        coverage (CoverageField): Updated with the new zones, if given.
+        zones (ZoneCatalog): The costs and effects of the zones.
+    Returns: int: The number of zones placed, 0 if the build was refused.
+    """
+    cells = area_cells(cells)
+    xs, ys = cells[:, 0], cells[:, 1]
+    amount = len(cells)
+    size = len(grid)
+    money = player_resources['Money']
+    code = ZONE_CODES[zone_type]
+    cost = zones.costs[code] * amount
+    if amount == 0:
+        refusal = "The area has no plots to build on."
+    elif cells.min() < 0 or cells.max() >= size:
+        refusal = (
+            f"Invalid coordinates. Please enter values between 0 and "
+            f"{size - 1}."
+        )
+    elif len(set((xs * size + ys).tolist())) != amount:
+        refusal = "The area lists the same plot more than once."
+    elif money['Current Value'] < cost:
+        refusal = (
+            f"Sorry, you do not have the {cost:.2f} needed to build "
+            f"{amount} zones right now."
+        )
+    else:
+        codes = grid.take(xs, ys) if isinstance(grid, SparseGrid) else (
+            grid[xs, ys]
+        )
+        occupied = int(np.count_nonzero(codes != EMPTY))
+        refusal = None
+        if occupied:
+            refusal = (
+                f"{occupied} of the plots are already occupied, please "
+                f"choose another area."
+            )
+    if refusal:
+        if log is not None:
+            log.append(refusal)
+        return 0
+    if isinstance(grid, SparseGrid):
+        grid.put(xs, ys, code)
+    else:
+        grid[xs, ys] = code
+    if ledger is not None:
+        ledger.add(code, amount)
+    money['Current Value'] -= cost
+    if log is not None:
+        log.append(
+            f"Congratulations, you built {amount} {zone_type} zones for "
+            f"{cost:.2f}."
+        )
+        log.append(f"Remaining Money: {money['Current Value']:.2f}")
+    newly_covered = {}
+    if coverage is not None:
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            for service, count in coverage.add(grid, x, y, code).items():
+                newly_covered[service] = newly_covered.get(service, 0) + count
+        if log is not None:
+            log_coverage(log, zone_type, newly_covered)
+    update_metrics(metrics, player_resources, zone_type, amount,
+                   newly_covered, zones)
+    return amount
+
+
+def log_coverage(log, zone_type, newly_covered):
+    """
+    Tell the player which Residential zones a new zone brought into reach
+    of services.
+    Args:
+        log (list): Messages for the player are appended here.
+        zone_type (str): The type of zone placed.
+        newly_covered (dict): Residential zones newly covered by each type
+            of service.
+    """
+    if zone_type in SERVICE_EFFECTS:
+        count = newly_covered.get(zone_type, 0)
+        log.append(
+            f"The {zone_type} serves {count} more Residential "
+            f"zone{'' if count == 1 else 's'} within {SERVICE_RADIUS} steps."
+        )
+    elif newly_covered:
+        log.append(
+            f"The homes are within reach of a "
+            f"{' and a '.join(newly_covered)}."
+        )
+
+
+@timed('rules.regenerate_resources')
+def regenerate_resources(player_resources, total_daily_income):
+    """
+    Regenerate resources daily and add daily income.
+    Args:
+        player_resources (dict): A dictionary containing the player resources.
+        total_daily_income (float): The total daily income generated by zones.
+    """
+    for values in player_resources.values():
+        # Apply the regeneration rate directly to the current value
+        values['Current Value'] += values['Regeneration Rate']
+    # Add daily income to the player's money
+    player_resources['Money']['Current Value'] += total_daily_income
+
+
+@timed('rules.apply_random_event')
+def apply_random_event(events, player_resources, log=None):
+    """
+    Apply a day of events: the active events count down and a new one may
+    start.
+    Args:
+        events (EventEngine): The events of the game.
+        player_resources (dict): A dictionary containing the resources.
+        log (list): Messages for the player are appended here, if given.
+    Returns: str: The description of the last event started.
+    """
+    events.step(player_resources, log)
+    return events.last_event
+
+
+def check_metrics(metrics, log=None):
+    """
+    Check if any metrics have fallen below or above critical levels.
+    Args: metrics (dict): A dictionary containing the current metrics.
+        log (list): Messages for the player are appended here, if given.
+    Returns: bool: True if all metrics are within acceptable levels,
+    False if not.
+    """
+    return failed_metric(metrics, log) is None
+
+
+def failed_metric(metrics, log=None):
+    """
+    Find the first metric that has reached a critical level.
+    Args: metrics (dict): A dictionary containing the current metrics.
+        log (list): Messages for the player are appended here, if given.
+    Returns: str: The name of the failed metric, or None if all are fine.
+    """
+    for metric, value in metrics.items():
+        if metric == 'Crime Rate':
+            if value > METRIC_LIMITS[metric]:
+                if log is not None:
+                    log.append("Game Over: Crime Rate is too high!")
+                return metric
+        elif value < METRIC_LIMITS[metric]:
+            if log is not None:
+                log.append(f"Game Over: {metric} is too low!")
+            return metric
+    return None
+
+
+def update_metrics(metrics, player_resources, zone_type, amount,
+                   newly_covered=None, zones=DEFAULT_ZONES):
+    """
+    Update the metrics based on the type and amount of zone built, with the
+    effects of the zone type in the catalog kept within 0 to 100.
+    Args: metrics (dict): A dictionary containing the current metrics.
+        player_resources (dict): A dictionary containing the player resources.
+        zone_type (str): The type of zone built.
+        amount (int): The number of zones built.
+        newly_covered (dict): Residential zones newly covered by each type
+            of service, which apply that service's SERVICE_EFFECTS.
+        zones (ZoneCatalog): The effects of the zones.
+    """
+    zones.apply(
+        metrics, player_resources, ZONE_CODES[zone_type], amount, newly_covered
+    )
+
+
+class GameState:
+    """
+    The full state of one game: the grid, resources, metrics, events, the
+    current day and the zones built today. step() applies a player action
+    using the game rules, with no terminal input, output or delays.
+    Actions are tuples, ('build', x, y, zone_type), ('area', zone_type,
+    cells) to build on a list of (x, y) cells at once, or ('next',).
+    The status is 'playing' until the game ends as 'won' or 'lost'.
+    copy() forks a game in O(1) for lookahead. The forks share the
+    SHARED_PARTS of the game, and each copies a part the first time it
+    changes it, so a game must only be changed through its methods.
+    """
+
+    def __init__(self, zone_data, events, player_resources, metrics=None,
+                 size=GRID_SIZE, verbose=True, rng=None,
+                 zones_per_day=MAX_ZONES_PER_DAY):
+        """
+        Start a new game on day 1.
+        Args:
+            zone_data (ZoneCatalog): The compiled zones. Zone data, zone
+                types mapped to their count and income, is compiled first.
+            events (EventCatalog): The compiled events. A list of event
+                records is compiled first.
+            player_resources (dict): A dictionary containing the resources.
+            metrics (dict): The starting metrics, INITIAL_METRICS if None.
+            size (int): The size of the grid, up to MAX_GRID_SIZE.
+            verbose (bool): Whether to collect messages for the player.
+                Simulations turn this off to skip formatting them.
+            rng (random.Random): Draws the grid and the events. A seeded
+                generator replays the same game, a new one is used if None.
+            zones_per_day (int): Zones that can be built in a day, up to
+                ZONES_PER_DAY_LIMIT.
+        Raises: ValueError: If the size is larger than MAX_GRID_SIZE, or the
+            daily limit larger than ZONES_PER_DAY_LIMIT.
+        """
+        if not 1 <= size <= MAX_GRID_SIZE:
+            raise ValueError(f"The map size must be 1 to {MAX_GRID_SIZE}.")
+        if not 1 <= zones_per_day <= ZONES_PER_DAY_LIMIT:
+            raise ValueError(
+                f"The zones per day must be 1 to {ZONES_PER_DAY_LIMIT}."
+            )
+        self.size = size
+        self.zones_per_day = zones_per_day
+        rng = rng or random.Random()
+        if not isinstance(zone_data, ZoneCatalog):
+            zone_data = ZoneCatalog(zone_data)
+        self.zones = zone_data
+        if zone_data:
+            self.grid, _ = initialize_random_grid(size, zone_data, rng)
+        else:
+            # With no zone data, fall back to an empty grid
+            self.grid = initialize_grid(size)
+        self.ledger = IncomeLedger(self.grid, zone_data.incomes)
+        self.coverage = CoverageField(self.grid)
+        self.player_resources = player_resources
+        self.metrics = dict(INITIAL_METRICS if metrics is None else metrics)
+        if not isinstance(events, EventCatalog):
+            events = EventCatalog.compile(events)
+        self.events = EventEngine(events, rng)
+        self.shared = set()  # Parts shared with a fork of the game
+        self.day = 1
+        self.zones_built_today = 0
+        self.status = 'playing'
+        self.failure = None  # Why the game was lost
+        self.verbose = verbose
+        self.messages = [] if verbose else None
+        self.start_day()
+
+    @classmethod
+    def restore(cls, zone_data, events, grid, player_resources, metrics,
+                day, zones_built_today=0, active_events=(), last_event=None,
+                status='playing', failure=None, verbose=True, rng=None,
+                zones_per_day=MAX_ZONES_PER_DAY):
+        """
+        Rebuild a game part way through a day, as saved in a snapshot. The
+        day has already started, so its events and income aren't applied
+        again.
+        Args:
+            zone_data (ZoneCatalog): The compiled zones, or zone data.
+            events (EventCatalog): The compiled events.
+            grid (numpy.ndarray): The game grid.
+            player_resources (dict): A dictionary containing the resources.
+            metrics (dict): The current metrics.
+            day (int): The current day.
+            zones_built_today (int): The zones built so far today.
+            active_events (list): (index, days left) of the running events.
+            last_event (int): Index of the last event started, or None.
+            status (str): 'playing', 'won' or 'lost'.
+            failure (str): Why the game was lost, or None.
+            verbose (bool): Whether to collect messages for the player.
+            rng (random.Random): Draws the events from now on.
+            zones_per_day (int): Zones that can be built in a day.
+        Returns: GameState: The game.
+        """
+        state = cls.__new__(cls)
+        state.size = len(grid)
+        state.zones_per_day = zones_per_day
+        if not isinstance(zone_data, ZoneCatalog):
+            zone_data = ZoneCatalog(zone_data)
+        state.zones = zone_data
+        state.grid = grid
+        state.ledger = IncomeLedger(grid, zone_data.incomes)
+        state.coverage = CoverageField(grid)
+        state.player_resources = player_resources
+        state.metrics = dict(metrics)
+        state.events = EventEngine(events, rng or random.Random())
+        state.events.active = [tuple(entry) for entry in active_events]
+        state.events.last = last_event
+        state.shared = set()
+        state.day = day
+        state.zones_built_today = zones_built_today
+        state.status = status
+        state.failure = failure
+        state.verbose = verbose
+        state.messages = [] if verbose else None
+        return state
+
+    @property
+    def is_over(self):
+        """
+        bool: True once the game has been won or lost.
+        """
+        return self.status != 'playing'
+
+    @property
+    def rng(self):
+        """
+        random.Random: Draws the events from now on.
+        """
+        return self.events.rng
+
+    @property
+    def total_daily_income(self):
+        """
+        float: The daily income of every zone on the grid.
+        """
+        return self.ledger.total
+
+    @property
+    def last_event(self):
+        """
+        str: The description of the last event started, None if none has.
+        """
+        return self.events.last_event
+
+    @property
+    def money(self):
+        """
+        float: The player's current money.
+        """
+        return self.player_resources['Money']['Current Value']
+
+    def step(self, action):
+        """
+        Apply a player action and return the messages it produced.
+        Args: action (tuple): ('build', x, y, zone_type), ('area',
+            zone_type, cells) or ('next',).
+        Returns: list: Messages for the player, or None if not verbose.
+        """
+        self.messages = [] if self.verbose else None
+        if self.is_over:
+            raise ValueError("The game is over.")
+        if action[0] == 'build':
+            self.build(*action[1:])
+        elif action[0] == 'area':
+            self.build_area(*action[1:])
+        elif action[0] == 'next':
+            self.next_day()
+        else:
+            raise ValueError(f"Unknown action: {action[0]}")
+        return self.messages
+
+    def build(self, x, y, zone_type):
+        """
+        Build a zone, respecting the daily build limit.
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+            zone_type (str): The type of zone to place.
+        Returns: bool: True if the zone was placed.
+        """
+        if self.zones_built_today >= self.zones_per_day:
+            self.log("Max number of zones built today.")
+            return False
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            self.log(
+                f"Invalid coordinates. Please enter values between 0 "
+                f"and {self.size - 1}."
+            )
+            return False
+        self.own(*SHARED_PARTS)
+        placed = place_zone(
+            self.grid, zone_type, x, y, self.player_resources, self.metrics,
+            self.messages, self.ledger, self.coverage, self.zones
+        )
+        if placed:
+            self.zones_built_today += 1
+            self.check_metrics()
+        return placed
+
+    def build_area(self, zone_type, cells):
+        """
+        Build one type of zone on many cells at once, all of them or none,
+        within the daily build limit.
+        Args:
+            zone_type (str): The type of zone to place.
+            cells: (x, y) pairs of the cells, as a list or an N x 2 array.
+        Returns: int: The number of zones placed.
+        """
+        cells = area_cells(cells)
+        left = self.zones_per_day - self.zones_built_today
+        if len(cells) > left:
+            self.log(
+                f"Only {left} more zone{'' if left == 1 else 's'} can be "
+                f"built today."
+            )
+            return 0
+        self.own(*SHARED_PARTS)
+        placed = place_zones(
+            self.grid, zone_type, cells, self.player_resources, self.metrics,
+            self.messages, self.ledger, self.coverage, self.zones
+        )
+        if placed:
+            self.zones_built_today += placed
+            self.check_metrics()
+        return placed
+
+    def next_day(self):
+        """
+        Move to the next day, ending the game after the last day.
+        """
+        self.day += 1
+        self.zones_built_today = 0
+        if self.day > GAME_DAYS:
+            self.finish()
+        else:
+            self.start_day()
+
+    def start_day(self):
+        """
+        Apply the day's events and regenerate resources and income.
+        """
+        self.own('player_resources')
+        apply_random_event(self.events, self.player_resources, self.messages)
+        regenerate_resources(self.player_resources, self.ledger.total)
+        self.check_metrics()
+
+    def check_metrics(self):
+        """
+        End the game as lost if any metric has reached a critical level.
+        """
+        metric = failed_metric(self.metrics, self.messages)
+        if metric:
+            self.status = 'lost'
+            self.failure = metric
+            self.log(
+                "One or more metrics have reached critical levels. "
+                "The game is over, better luck next time!"
+            )
+
+    def finish(self):
+        """
+        End the game after the last day, won if the monetary goal is met.
+        """
+        self.day = GAME_DAYS
+        if self.money >= MONETARY_GOAL:
+            self.status = 'won'
+            self.log("Congratulations! You have won!")
+        else:
+            self.status = 'lost'
+            self.failure = 'Money'
+            self.log("Unfortunately, you have lost this time.")
+
+    def copy(self, rng=None):
+        """
+        Fork the game, to look ahead without changing it, in O(1) whatever
+        the size of the map. The catalogs are shared for good, and the
+        SHARED_PARTS until this game or the copy changes them.
+        Args: rng (random.Random): Draws the events of the copy. If None,
+            the copy draws the events this game would.
+        Returns: GameState: The copy, which doesn't collect messages.
+        """
+        state = GameState.__new__(GameState)
+        state.__dict__.update(self.__dict__)
+        state.events = self.events.copy(rng)
+        state.shared = set(SHARED_PARTS)
+        self.shared = set(SHARED_PARTS)
+        state.verbose = False
+        state.messages = None
+        return state
+
+    def own(self, *parts):
+        """
+        Copy the parts of the game still shared with a fork, before
+        changing them.
+        Args: *parts (str): Names of SHARED_PARTS.
+        """
+        for part in parts:
+            if part in self.shared:
+                self.shared.discard(part)
+                setattr(self, part, SHARED_PARTS[part](getattr(self, part)))
+
+    def log(self, message):
+        """
+        Record a message for the player, if messages are being collected.
+        Args: message (str): The message.
+        """
+        if self.messages is not None:
+            self.messages.append(message)
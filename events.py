@@ -0,0 +1,366 @@
+"""
+Random events for McGee Metropolis. The records of the events table are
+compiled once into an EventCatalog of events with pre-parsed effects and an
+alias table, so choosing an event is O(1) and applying one does no string
+parsing. An EventEngine holds the events active in one game and draws new
+ones from an injectable random number generator. Engines can be forked
+cheaply for lookahead: the running events are immutable records shared
+between forks, and a fork only builds its own generator when it draws.
+"""
+import random
+
+# Mapping from event impact types to player resource keys
+IMPACT_RESOURCES = {
+    'an electricity supply reduction': 'Electricity',
+    'an income reduction': 'Money',
+    'a water supply reduction': 'Water',
+}
+
+MAX_ACTIVE_EVENTS = 1  # Events that can impact the city at once
+
+MAX_DRAWS = 16  # Sampler draws before falling back to a scan of the events
+
+
+class Effect:
+    """
+    A pre-parsed impact on one resource. Applying it sets the resource's
+    current value to value * multiplier + offset, so '-15%' is a multiplier
+    of 0.85 and '-50' an offset of -50.
+    """
+    __slots__ = ('resource', 'multiplier', 'offset')
+
+    def __init__(self, resource, multiplier=1.0, offset=0.0):
+        """
+        Args:
+            resource (str): The player resource key.
+            multiplier (float): The factor applied to the current value.
+            offset (float): The amount added after the multiplier.
+        """
+        self.resource = resource
+        self.multiplier = multiplier
+        self.offset = offset
+
+    @classmethod
+    def parse(cls, impact_type, impact_value):
+        """
+        Compile an impact of the events table.
+        Args:
+            impact_type (str): The type of impact.
+            impact_value (str): The value of the impact, '%' for a percentage.
+        Returns: Effect: The effect, or None if the impact type has no
+            matching resource.
+        Raises: ValueError: If the impact value isn't a number.
+        """
+        resource = IMPACT_RESOURCES.get(impact_type)
+        if resource is None:
+            return None
+        impact_value = str(impact_value).replace(',', '')
+        if '%' in impact_value:
+            return cls(resource, 1 + float(impact_value.strip('%')) / 100)
+        return cls(resource, offset=float(impact_value))
+
+    def apply(self, player_resources):
+        """
+        Apply the effect to the player's resources.
+        Args: player_resources (dict): A dictionary containing the resources.
+        """
+        values = player_resources[self.resource]
+        values['Current Value'] = (
+            values['Current Value'] * self.multiplier + self.offset
+        )
+
+
+class Event:
+    """
+    A compiled event of the events table. Events are shared by every game
+    played with a catalog, so they are never changed once compiled.
+    """
+    __slots__ = ('description', 'impact_type', 'impact_value', 'duration',
+                 'weight', 'effect')
+
+    def __init__(self, description, impact_type, impact_value, duration,
+                 weight, effect):
+        """
+        Args:
+            description (str): The name of the event.
+            impact_type (str): The type of impact, as shown to the player.
+            impact_value (str): The value of the impact, as shown.
+            duration (int): The days the event lasts.
+            weight (float): How likely the event is relative to the others.
+            effect (Effect): The daily effect, None for no effect.
+        """
+        self.description = description
+        self.impact_type = impact_type
+        self.impact_value = impact_value
+        self.duration = duration
+        self.weight = weight
+        self.effect = effect
+
+
+class AliasSampler:
+    """
+    Draws an index in proportion to a list of weights in O(1) time with
+    Vose's alias method. Each slot of the table keeps its own index with
+    probability prob[slot] and otherwise gives its alias.
+    """
+    __slots__ = ('prob', 'alias')
+
+    def __init__(self, weights):
+        """
+        Build the alias table in O(n) time.
+        Args: weights (list): Non-negative weights, at least one positive.
+        """
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        self.prob = [1.0] * count
+        self.alias = list(range(count))
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # Whatever is left over is 1 up to rounding, and keeps its own index
+
+    def sample(self, rng):
+        """
+        Draw an index.
+        Args: rng (random.Random): The random number generator.
+        Returns: int: The index drawn.
+        """
+        # One uniform draw picks the slot and the coin flip within it
+        point = rng.random() * len(self.prob)
+        slot = int(point)
+        if point - slot < self.prob[slot]:
+            return slot
+        return self.alias[slot]
+
+
+class EventCatalog:
+    """
+    The compiled events of the events table and a sampler weighted by their
+    'Weight' column, which is optional and defaults to 1.
+    """
+
+    def __init__(self, events):
+        """
+        Args: events (list): The compiled Event objects.
+        """
+        self.events = tuple(events)
+        weights = [event.weight for event in self.events]
+        self.sampler = AliasSampler(weights) if sum(weights) > 0 else None
+
+    def __len__(self):
+        return len(self.events)
+
+    @classmethod
+    def compile(cls, records, log=None):
+        """
+        Compile the records of the events table.
+        Args: records (list): A list of dictionaries containing event data.
+            log (list): Messages about invalid values are appended here.
+        Returns: EventCatalog: The compiled events.
+        """
+        events = []
+        for record in records:
+            description = record.get('Description', '')
+            impact_type = record.get('Impact Type', '')
+            impact_value = record.get('Impact Value', '')
+            try:
+                duration = int(record.get('Duration', 0))
+            except ValueError:
+                if log is not None:
+                    log.append(f"Invalid duration {description}.")
+                duration = 0
+            try:
+                weight = max(float(record.get('Weight', 1) or 1), 0.0)
+            except ValueError:
+                if log is not None:
+                    log.append(f"Invalid weight {description}.")
+                weight = 1.0
+            try:
+                effect = Effect.parse(impact_type, impact_value)
+            except ValueError:
+                if log is not None:
+                    log.append(f"Invalid impact value {description}.")
+                effect = None
+            events.append(Event(description, impact_type, impact_value,
+                                duration, weight, effect))
+        return cls(events)
+
+    def records(self):
+        """
+        Turn the events back into records of the events table, which
+        compile to the same catalog.
+        Returns: list: A list of dictionaries containing event data.
+        """
+        return [
+            {
+                'Description': event.description,
+                'Impact Type': event.impact_type,
+                'Impact Value': event.impact_value,
+                'Duration': event.duration,
+                'Weight': event.weight
+            }
+            for event in self.events
+        ]
+
+    def draw(self, rng, excluded):
+        """
+        Draw an event by weight, skipping some of them.
+        Args:
+            rng (random.Random): The random number generator.
+            excluded (set): Indexes of events that can't be drawn.
+        Returns: int: The index of the event drawn, or None if every event
+            with a weight is excluded.
+        """
+        if self.sampler is None:
+            return None
+        for _ in range(MAX_DRAWS):
+            index = self.sampler.sample(rng)
+            if index not in excluded:
+                return index
+        # Almost all the weight is excluded, draw from what is left
+        candidates = [
+            index for index, event in enumerate(self.events)
+            if index not in excluded and event.weight > 0
+        ]
+        if not candidates:
+            return None
+        return rng.choices(
+            candidates, [self.events[index].weight for index in candidates]
+        )[0]
+
+
+class EventEngine:
+    """
+    The events of one game. Each day the active events apply their effect
+    and count down, and while fewer than max_active are running a new one
+    is drawn, never the event that started last.
+    """
+
+    def __init__(self, catalog, rng=None, max_active=MAX_ACTIVE_EVENTS):
+        """
+        Args:
+            catalog (EventCatalog): The compiled events.
+            rng (random.Random): Draws new events, the random module if None.
+            max_active (int): Events that can impact the city at once.
+        """
+        self.catalog = catalog
+        self.generator = rng or random
+        self.max_active = max_active
+        # (index, days left) of the running events. The list is replaced
+        # rather than changed, so forks can share it
+        self.active = []
+        self.last = None  # Index of the last event started
+        self.fork_state = None  # Generator state forks start from
+        self.resume_state = None  # Generator state of a fork yet to draw
+
+    @property
+    def rng(self):
+        """
+        random.Random: Draws new events. A fork builds its own from the
+        state it was forked at the first time it is needed.
+        """
+        if self.generator is None:
+            # Restoring a state overwrites all of it, so skip seeding
+            self.generator = random.Random.__new__(random.Random)
+            self.generator.setstate(self.resume_state)
+            self.resume_state = None
+        return self.generator
+
+    def copy(self, rng=None):
+        """
+        Fork the events, in O(1): the copy shares the running events, as
+        they are never changed in place.
+        Args: rng (random.Random): Draws the new events of the copy. If
+            None, it goes on from where this engine's generator is now,
+            whose state is read once for all the forks taken until this
+            engine next draws.
+        Returns: EventEngine: The copy.
+        """
+        engine = EventEngine.__new__(EventEngine)
+        engine.catalog = self.catalog
+        engine.max_active = self.max_active
+        engine.active = self.active
+        engine.last = self.last
+        engine.fork_state = None
+        engine.generator = rng
+        engine.resume_state = None
+        if rng is None:
+            if self.generator is None:
+                engine.resume_state = self.resume_state
+            else:
+                if self.fork_state is None:
+                    self.fork_state = self.generator.getstate()
+                engine.resume_state = self.fork_state
+        return engine
+
+    @property
+    def last_event(self):
+        """
+        str: The description of the last event started, None if none has.
+        """
+        if self.last is None:
+            return None
+        return self.catalog.events[self.last].description
+
+    def step(self, player_resources, log=None):
+        """
+        Apply a day of events to the player's resources.
+        Args:
+            player_resources (dict): A dictionary containing the resources.
+            log (list): Messages for the player are appended here, if given.
+        """
+        events = self.catalog.events
+        running = []
+        for index, days_left in self.active:
+            event = events[index]
+            if log is not None:
+                log.append(
+                    f"Oh no, an event is impacting the city: "
+                    f"{event.description} "
+                    f"resulting in {event.impact_type}"
+                    f" of {event.impact_value}. "
+                    f"Days left: {days_left}"
+                )
+            if event.effect is not None:
+                event.effect.apply(player_resources)
+            if days_left > 1:
+                running.append((index, days_left - 1))
+        self.active = running
+        if len(running) < self.max_active:
+            self.start(player_resources, log)
+
+    def start(self, player_resources, log=None):
+        """
+        Draw a new event, apply its first day and keep it running for the
+        rest of its duration.
+        Args:
+            player_resources (dict): A dictionary containing the resources.
+            log (list): Messages for the player are appended here, if given.
+        """
+        excluded = {index for index, _ in self.active}
+        if self.last is not None:
+            excluded.add(self.last)
+        index = self.catalog.draw(self.rng, excluded)
+        self.fork_state = None  # The generator has moved on
+        if index is None:
+            return
+        event = self.catalog.events[index]
+        self.last = index
+        if event.duration > 0:
+            self.active = self.active + [(index, event.duration)]
+        if log is not None:
+            log.append(
+                f"Oh no, a new event has started: {event.description} "
+                f"resulting in {event.impact_type}"
+                f" by {event.impact_value} "
+                f"for {event.duration} days."
+            )
+        if event.effect is not None:
+            event.effect.apply(player_resources)
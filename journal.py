@@ -0,0 +1,318 @@
+"""
+Replay journal for McGee Metropolis. A session is recorded as the seed of
+its random number generator, the inputs of each game and an append-only
+log of the player's actions, a few bytes each. A game resumed from a
+snapshot is recorded with its snapshot. As the grid and events only
+draw from the seeded generator, replaying the log plays the same games bit
+for bit, with no terminal or storage.
+
+Journals are written to JOURNAL_DIR, by default a directory in the system
+temp directory, and an empty JOURNAL_DIR turns them off.
+
+Usage: python journal.py path/to/session.mgj
+"""
+import json
+import os
+import random
+import secrets
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+from engine import (
+    EMPTY, GRID_SIZE, MAX_ZONES_PER_DAY, ZONE_CODES, ZONE_TYPES, GameState,
+    area_cells, parse_events
+)
+from snapshot import decode_snapshot
+
+MAGIC = b'MGJ1'
+
+# Record types, each a single byte followed by its fields
+SEED = b'S'  # The session seed, <Q
+GAME = b'G'  # A new game with new inputs, <I length then JSON
+RESTART = b'R'  # A new game with the inputs of the last one
+RESUME = b'P'  # A resumed game, JSON then a snapshot, each <I length first
+BUILD = b'B'  # A build action, <hhB x, y and zone code
+AREA = b'A'  # An area build action, <BI zone code and cells, then <hh each
+NEXT = b'N'  # A next day action
+
+SEED_FORMAT = struct.Struct('<Q')
+LENGTH_FORMAT = struct.Struct('<I')
+BUILD_FORMAT = struct.Struct('<hhB')
+AREA_FORMAT = struct.Struct('<BI')
+CELL_DTYPE = np.dtype('<i2')  # x or y of a cell of an area
+
+JOURNAL_DIR_NAME = 'mcgee_journals'
+
+
+def game_inputs(zone_data, events, player_resources, metrics, size,
+                zones_per_day=MAX_ZONES_PER_DAY):
+    """
+    Collect the inputs of a game as plain data, so they can be stored as
+    JSON and compared.
+    Args:
+        zone_data (ZoneCatalog): The compiled zones.
+        events (EventCatalog): The compiled events.
+        player_resources (dict): A dictionary containing the resources.
+        metrics (dict): The starting metrics, None for INITIAL_METRICS.
+        size (int): The size of the grid.
+        zones_per_day (int): Zones that can be built in a day.
+    Returns: dict: The inputs.
+    """
+    return {
+        'zone_data': zone_data.records(),
+        'events': events.records(),
+        'player_resources': player_resources,
+        'metrics': metrics,
+        'size': size,
+        'zones_per_day': zones_per_day
+    }
+
+
+class Journal:
+    """
+    Records a session: the games played and the actions taken in them.
+    new_game() starts each game from the session's generator and step()
+    applies and records an action on the current game. Records are kept
+    in memory and, if a path is given, appended to the file as they
+    happen, so the journal survives the process being killed.
+    """
+
+    def __init__(self, seed=None, path=None):
+        """
+        Args:
+            seed (int): Seeds the session, a random 64-bit seed if None.
+            path (str): The file to append the journal to, if given.
+        """
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.path = path
+        self.file = open(path, 'ab') if path else None
+        self.data = bytearray()
+        self.inputs = None  # The inputs of the current game
+        self.state = None  # The current game
+        self.write(MAGIC + SEED + SEED_FORMAT.pack(self.seed))
+
+    def write(self, record):
+        """
+        Append a record to the journal.
+        Args: record (bytes): The encoded record.
+        """
+        self.data += record
+        if self.file is not None:
+            self.file.write(record)
+            self.file.flush()
+
+    def new_game(self, zone_data, events, player_resources, metrics=None,
+                 size=GRID_SIZE, zones_per_day=MAX_ZONES_PER_DAY):
+        """
+        Start and record a new game.
+        Args:
+            zone_data (ZoneCatalog): The compiled zones.
+            events (EventCatalog): The compiled events.
+            player_resources (dict): A dictionary containing the resources.
+            metrics (dict): The starting metrics, INITIAL_METRICS if None.
+            size (int): The size of the grid.
+            zones_per_day (int): Zones that can be built in a day.
+        Returns: GameState: The new game, on day 1.
+        """
+        inputs = game_inputs(
+            zone_data, events, player_resources, metrics, size, zones_per_day
+        )
+        # Encode the inputs before the game starts changing the resources
+        encoded = json.dumps(inputs, separators=(',', ':')).encode('utf-8')
+        if self.inputs is not None and encoded == self.inputs:
+            self.write(RESTART)
+        else:
+            self.write(GAME + LENGTH_FORMAT.pack(len(encoded)) + encoded)
+            self.inputs = encoded
+        self.state = GameState(
+            zone_data, events, player_resources, metrics, size, rng=self.rng,
+            zones_per_day=zones_per_day
+        )
+        return self.state
+
+    def resume_game(self, snapshot, zone_data, events,
+                    zones_per_day=MAX_ZONES_PER_DAY):
+        """
+        Resume and record a game saved in a snapshot.
+        Args:
+            snapshot (bytes): The snapshot.
+            zone_data (ZoneCatalog): The compiled zones.
+            events (EventCatalog): The compiled events.
+            zones_per_day (int): Zones that can be built in a day.
+        Returns: GameState: The game, as it was when the snapshot was saved.
+        Raises: ValueError: If the snapshot isn't valid.
+        """
+        state = decode_snapshot(
+            snapshot, zone_data, events, rng=self.rng,
+            zones_per_day=zones_per_day
+        )
+        encoded = json.dumps(
+            {'zone_data': zone_data.records(), 'events': events.records(),
+             'zones_per_day': zones_per_day},
+            separators=(',', ':')
+        ).encode('utf-8')
+        self.write(
+            RESUME + LENGTH_FORMAT.pack(len(encoded)) + encoded +
+            LENGTH_FORMAT.pack(len(snapshot)) + snapshot
+        )
+        self.inputs = None  # The next game is recorded with its inputs
+        self.state = state
+        return state
+
+    def step(self, action):
+        """
+        Apply a player action to the current game and record it.
+        Args: action (tuple): ('build', x, y, zone_type), ('area',
+            zone_type, cells) or ('next',).
+        Returns: list: Messages for the player.
+        """
+        if action[0] == 'build':
+            _, x, y, zone_type = action
+            self.write(BUILD + BUILD_FORMAT.pack(x, y, ZONE_CODES[zone_type]))
+        elif action[0] == 'area':
+            _, zone_type, cells = action
+            cells = area_cells(cells)
+            self.write(
+                AREA + AREA_FORMAT.pack(ZONE_CODES[zone_type], len(cells)) +
+                cells.astype(CELL_DTYPE).tobytes()
+            )
+            action = ('area', zone_type, cells)
+        elif action[0] == 'next':
+            self.write(NEXT)
+        return self.state.step(action)
+
+    def close(self):
+        """
+        Close the journal file.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def new_game_from(inputs, rng, verbose):
+    """
+    Start a game from recorded inputs.
+    Args:
+        inputs (dict): The inputs of the game.
+        rng (random.Random): The session's generator.
+        verbose (bool): Whether to collect messages for the player.
+    Returns: GameState: The new game, on day 1.
+    """
+    return GameState(
+        inputs['zone_data'],
+        parse_events(inputs['events']),
+        {key: dict(value) for key, value in
+         inputs['player_resources'].items()},
+        inputs['metrics'],
+        inputs['size'],
+        verbose=verbose,
+        rng=rng,
+        zones_per_day=inputs.get('zones_per_day', MAX_ZONES_PER_DAY)
+    )
+
+
+def replay(data, verbose=False):
+    """
+    Replay a recorded session.
+    Args:
+        data (bytes): The journal.
+        verbose (bool): Whether to collect messages for the player.
+    Returns: list: The GameState of each game, as it was left.
+    Raises: ValueError: If the data isn't a journal.
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a McGee Metropolis journal.")
+    games = []
+    rng = None
+    inputs = None
+    offset = len(MAGIC)
+    while offset < len(data):
+        kind = data[offset:offset + 1]
+        offset += 1
+        if kind == SEED:
+            (seed,) = SEED_FORMAT.unpack_from(data, offset)
+            offset += SEED_FORMAT.size
+            rng = random.Random(seed)
+        elif kind == GAME:
+            (length,) = LENGTH_FORMAT.unpack_from(data, offset)
+            offset += LENGTH_FORMAT.size
+            inputs = json.loads(data[offset:offset + length])
+            offset += length
+            games.append(new_game_from(inputs, rng, verbose))
+        elif kind == RESTART:
+            games.append(new_game_from(inputs, rng, verbose))
+        elif kind == RESUME:
+            (length,) = LENGTH_FORMAT.unpack_from(data, offset)
+            offset += LENGTH_FORMAT.size
+            inputs = json.loads(data[offset:offset + length])
+            offset += length
+            (length,) = LENGTH_FORMAT.unpack_from(data, offset)
+            offset += LENGTH_FORMAT.size
+            games.append(decode_snapshot(
+                bytes(data[offset:offset + length]), inputs['zone_data'],
+                parse_events(inputs['events']), verbose, rng,
+                inputs.get('zones_per_day', MAX_ZONES_PER_DAY)
+            ))
+            offset += length
+        elif kind == BUILD:
+            x, y, code = BUILD_FORMAT.unpack_from(data, offset)
+            offset += BUILD_FORMAT.size
+            games[-1].step(('build', x, y, ZONE_TYPES[code]))
+        elif kind == AREA:
+            code, count = AREA_FORMAT.unpack_from(data, offset)
+            offset += AREA_FORMAT.size
+            cells = np.frombuffer(data, CELL_DTYPE, count * 2, offset)
+            offset += count * 2 * CELL_DTYPE.itemsize
+            games[-1].step(('area', ZONE_TYPES[code], cells))
+        elif kind == NEXT:
+            games[-1].step(('next',))
+        else:
+            raise ValueError(f"Unknown journal record at byte {offset - 1}.")
+    return games
+
+
+def open_journal():
+    """
+    Start the journal of a new session, in JOURNAL_DIR if it is set to a
+    directory.
+    Returns: Journal: The journal, kept only in memory if JOURNAL_DIR is
+        empty or can't be written to.
+    """
+    directory = os.environ.get(
+        'JOURNAL_DIR', os.path.join(tempfile.gettempdir(), JOURNAL_DIR_NAME)
+    )
+    if not directory:
+        return Journal()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"session-{time.strftime('%Y%m%d-%H%M%S')}-"
+                       f"{os.getpid()}-{secrets.token_hex(4)}.mgj"
+        )
+        return Journal(path=path)
+    except OSError:
+        return Journal()
+
+
+def main():
+    """
+    Replay the journal named on the command line and summarise its games.
+    """
+    if len(sys.argv) != 2:
+        print(__doc__.strip().split('\n')[-1])
+        sys.exit(2)
+    with open(sys.argv[1], 'rb') as journal_file:
+        data = journal_file.read()
+    for number, state in enumerate(replay(data), start=1):
+        print(f"Game {number}: day {state.day}, {state.status}, "
+              f"money {state.money:.2f}, "
+              f"{sum(state.ledger.counts) - state.ledger.counts[EMPTY]} "
+              f"zones")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+"""
+Build-order planner for McGee Metropolis. Searches the rest of a game day
+by day with a beam search: each day every mix of up to
+PLAN_BUILDS_PER_DAY affordable zones is tried, then the next day starts.
+Every plan is played against SCENARIOS sampled sequences of events at
+once, the same sequences for every plan, and is valued by the mean money
+at the end of the game when the rest of it is played out by the
+simulator's balanced policy.
+
+Games reached by more than one build order are searched once, through a
+transposition table keyed on a hash of the game. The search stops when
+the time budget runs out and returns the builds of the best plan for
+today, so it always answers within the budget, however far it got.
+
+Usage: python planner.py --budget 2 --seed 1
+"""
+import argparse
+import heapq
+import random
+import time
+import numpy as np
+from engine import (
+    EMPTY, GAME_DAYS, MONETARY_GOAL, RESIDENTIAL, SERVICE_EFFECTS,
+    GameState, SparseGrid, default_resources
+)
+from profiling import timed
+from simulate import balanced_policy, load_catalog
+from zones import ZONE_RULES
+
+DEFAULT_BUDGET = 1.0  # Seconds a plan may take
+BEAM_WIDTH = 8  # Plans kept after each day
+SCENARIOS = 4  # Sequences of events every plan is played against
+PLAN_BUILDS_PER_DAY = 3  # Most zones tried in a day, to bound the search
+SERVICE_CANDIDATES = 32  # Homes looked around when placing a service
+LOST = -1e12  # Value of a game lost on its metrics, before its last day
+
+
+def state_key(state):
+    """
+    Hash everything about a game that its future depends on, apart from
+    its random number generator.
+    Args: state (GameState): The game.
+    Returns: int: The hash.
+    """
+    grid = state.grid
+    if isinstance(grid, SparseGrid):
+        cells = frozenset(grid.cells.items())
+    else:
+        cells = grid.tobytes()
+    return hash((
+        state.day, state.zones_built_today, state.status, cells,
+        round(state.money, 2), tuple(state.metrics.values()),
+        tuple(map(tuple, state.events.active)), state.events.last
+    ))
+
+
+def empty_cell(grid):
+    """
+    Find the first empty cell of the grid, row by row.
+    Args: grid (numpy.ndarray or SparseGrid): The game grid.
+    Returns: tuple: The (x, y) of the cell, or None if the grid is full.
+    """
+    size = len(grid)
+    if isinstance(grid, SparseGrid):
+        for cell in range(size * size):
+            if divmod(cell, size) not in grid.cells:
+                return divmod(cell, size)
+        return None
+    cells = np.flatnonzero(grid.ravel() == EMPTY)
+    return divmod(int(cells[0]), size) if len(cells) else None
+
+
+def residential_cells(grid):
+    """
+    Args: grid (numpy.ndarray or SparseGrid): The game grid.
+    Returns: list: The (x, y) of every Residential zone.
+    """
+    if isinstance(grid, SparseGrid):
+        return sorted(
+            cell for cell, code in grid.cells.items() if code == RESIDENTIAL
+        )
+    return [
+        (int(x), int(y)) for x, y in np.argwhere(grid == RESIDENTIAL)
+    ]
+
+
+def choose_cell(state, zone_type):
+    """
+    Choose where a zone does the most good: a service where it reaches
+    the most homes no service of its type reaches yet, and a home where
+    the most types of service reach. Other zones, and zones with nowhere
+    better, go on the first empty cell. The choice depends only on the
+    game, so a plan builds the same way in every scenario.
+    Args:
+        state (GameState): The game.
+        zone_type (str): The type of zone to place.
+    Returns: tuple: The (x, y) of the cell, or None if the grid is full.
+    """
+    grid = state.grid
+    size = state.size
+    coverage = state.coverage
+    if isinstance(grid, SparseGrid):
+        occupied = grid.cells
+    else:
+        # Looking cells up in a set is much faster than indexing the array
+        occupied = {
+            (int(x), int(y)) for x, y in np.argwhere(grid != EMPTY)
+        }
+    scores = {}
+    if zone_type in SERVICE_EFFECTS:
+        reach = coverage.reach[zone_type]
+        homes = [
+            cell for cell in residential_cells(grid) if not reach.get(cell)
+        ][:SERVICE_CANDIDATES]
+        for x, y in homes:
+            for dx, dy in coverage.offsets:
+                cell = (x + dx, y + dy)
+                if (0 <= cell[0] < size and 0 <= cell[1] < size and
+                        cell not in occupied):
+                    scores[cell] = scores.get(cell, 0) + 1
+    elif zone_type == 'Residential':
+        for reach in coverage.reach.values():
+            for cell, services in reach.items():
+                if services and cell not in occupied:
+                    scores[cell] = scores.get(cell, 0) + 1
+    if scores:
+        # The best score, then the first cell, so the choice is repeatable
+        return min(scores, key=lambda cell: (-scores[cell], cell))
+    return empty_cell(grid)
+
+
+def out_of_time(deadline):
+    """
+    Args: deadline (float): A time.perf_counter() time, or None for none.
+    Returns: bool: True if the deadline has passed.
+    """
+    return deadline is not None and time.perf_counter() > deadline
+
+
+def build_mixes(states, actions, zone_types, builds, deadline=None):
+    """
+    Build every mix of up to a number of zones in every scenario. Each mix
+    is built on the games of the mix one zone shorter, so a zone is only
+    placed once for all the mixes that start with the same zones.
+    Args:
+        states (list): The game in each scenario, not changed.
+        actions (list): The actions taken so far in the first scenario.
+        zone_types (list): The zone types the mixes may add.
+        builds (int): The most zones a mix may add.
+        deadline (float): No more mixes are built after this
+            time.perf_counter() time, None to build them all.
+    Yields: tuple: The game in each scenario after a mix, and the actions
+        taken in the first, starting with the empty mix.
+    """
+    yield states, actions
+    if builds == 0:
+        return
+    for index, zone_type in enumerate(zone_types):
+        if out_of_time(deadline):
+            return
+        built = []
+        taken = list(actions)
+        for scenario, state in enumerate(states):
+            state = state.copy()  # With its generator, so its events go on
+            if not state.is_over:
+                cell = choose_cell(state, zone_type)
+                if (cell is not None and state.build(*cell, zone_type) and
+                        scenario == 0):
+                    taken.append(('build', *cell, zone_type))
+            built.append(state)
+        # Later zone types only, so each mix is built in one order
+        yield from build_mixes(
+            built, taken, zone_types[index:], builds - 1, deadline
+        )
+
+
+def play_days(states, deadline=None):
+    """
+    Play one more day of a plan every way it could go: each mix of up to
+    PLAN_BUILDS_PER_DAY affordable zones, then the next day.
+    Args:
+        states (list): The game in each scenario, not changed.
+        deadline (float): No more mixes are played after this
+            time.perf_counter() time, None to play them all.
+    Yields: tuple: The game in each scenario at the start of the next day,
+        and the actions taken today in the first.
+    """
+    state = states[0]
+    builds = min(state.zones_per_day - state.zones_built_today,
+                 PLAN_BUILDS_PER_DAY)
+    zone_types = [
+        zone_type for zone_type in ZONE_RULES
+        if state.zones.cost(zone_type) <= state.money
+    ]
+    for games, actions in build_mixes(
+        states, [], zone_types, builds, deadline
+    ):
+        if out_of_time(deadline):
+            return
+        played = []
+        for state in games:
+            state = state.copy()
+            if not state.is_over:
+                state.step(('next',))
+            played.append(state)
+        yield played, actions + [('next',)]
+
+
+def final_value(state):
+    """
+    Value a finished game by its money, with games lost on their metrics
+    below any other, the later the loss the better.
+    Args: state (GameState): The game.
+    Returns: float: The value.
+    """
+    if state.status == 'lost' and state.failure != 'Money':
+        return LOST + state.day
+    return state.money
+
+
+def estimate(state):
+    """
+    Estimate a game cheaply, as its money plus its income for the days
+    left, to choose which plans are worth playing out.
+    Args: state (GameState): The game.
+    Returns: float: The estimate.
+    """
+    if state.is_over:
+        return final_value(state)
+    return state.money + state.total_daily_income * (GAME_DAYS - state.day)
+
+
+def rollout(state, seed, deadline=None):
+    """
+    Play a game out to its end with the balanced policy.
+    Args:
+        state (GameState): The game, not changed.
+        seed (int): Seeds the policy's choice of cells.
+        deadline (float): The time.perf_counter() time to give up at, None
+            to play to the end however long it takes.
+    Returns: float: The value of the finished game, or None if the
+        deadline passed first.
+    """
+    state = state.copy()
+    rng = random.Random(seed)
+    while not state.is_over:
+        if out_of_time(deadline):
+            return None
+        state.step(balanced_policy(state, rng))
+    return final_value(state)
+
+
+class Plan:
+    """
+    The best plan found: the actions to take today, the mean value at the
+    end of the game when they are followed by the best days found and then
+    the balanced policy, the share of scenarios won, and how far and long
+    the search went.
+    """
+
+    def __init__(self, actions, value, win_rate, days, nodes, seconds):
+        self.actions = actions
+        self.value = value
+        self.win_rate = win_rate
+        self.days = days
+        self.nodes = nodes
+        self.seconds = seconds
+
+
+class Node:
+    """
+    A plan being searched: the game in each scenario after its days, the
+    actions of its first day and its value.
+    """
+    __slots__ = ('states', 'actions', 'estimate', 'value', 'wins')
+
+    def __init__(self, states, actions):
+        self.states = states
+        self.actions = actions
+        self.estimate = sum(map(estimate, states)) / len(states)
+        self.value = None
+        self.wins = 0.0
+
+
+@timed('planner.plan')
+def plan(state, budget=DEFAULT_BUDGET, beam_width=BEAM_WIDTH,
+         scenarios=SCENARIOS, seed=0):
+    """
+    Search for the builds that lead to the most money at the end of the
+    game, without changing the game.
+    Args:
+        state (GameState): The game, part way through a day.
+        budget (float): Seconds the search may take.
+        beam_width (int): Plans kept after each day.
+        scenarios (int): Sequences of events every plan is played against.
+        seed (int): Seeds the scenarios and the rollouts.
+    Returns: Plan: The best plan found in the time. If no plan could be
+        played out in time, the plan for today that looks best, with no
+        value, or one that only moves to the next day if the game is over
+        or nothing could be searched.
+    """
+    start = time.perf_counter()
+    deadline = start + budget
+    root = Node([
+        state.copy(random.Random(seed * scenarios + scenario))
+        for scenario in range(scenarios)
+    ], [('next',)])
+    beam = [root]
+    # Values of the games already played out, by scenario and state_key()
+    table = {}
+    best = None
+    guess = None  # The plan for today that looks best before any play out
+    days = 0
+    nodes = 0
+
+    def evaluate(node):
+        values = []
+        for scenario, game in enumerate(node.states):
+            key = (scenario, state_key(game))
+            if key not in table:
+                value = rollout(game, seed + scenario, deadline)
+                if value is None:
+                    return False  # Out of time, the node stays unvalued
+                table[key] = value
+            values.append(table[key])
+        node.value = sum(values) / len(values)
+        node.wins = sum(
+            game.money >= MONETARY_GOAL for game in node.states
+        ) / len(node.states)
+        return True
+
+    while beam and not all(game.is_over for game in beam[0].states):
+        # Leave at least half the time left to play the new plans out
+        now = time.perf_counter()
+        expanded_by = now + (deadline - now) / 2
+        children = {}
+        for node in beam:
+            if out_of_time(expanded_by):
+                break
+            for games, actions in play_days(node.states, expanded_by):
+                key = tuple(map(state_key, games))
+                if key in children:
+                    continue  # Reached already by another build order
+                nodes += 1
+                children[key] = Node(
+                    games, actions if node is root else node.actions
+                )
+        if not children:
+            break
+        # Play out only the plans that look best, as that is the slow part
+        candidates = heapq.nlargest(
+            beam_width * 2, children.values(), key=lambda node: node.estimate
+        )
+        if beam[0] is root:
+            guess = candidates[0]
+        evaluated = []
+        for node in candidates:
+            if out_of_time(deadline) or not evaluate(node):
+                break
+            evaluated.append(node)
+        if not evaluated:
+            break
+        beam = heapq.nlargest(
+            beam_width, evaluated, key=lambda node: node.value
+        )
+        days += 1
+        if best is None or beam[0].value > best.value:
+            best = beam[0]
+    if best is None:
+        actions = [('next',)] if guess is None else guess.actions
+        return Plan(actions, None, 0.0, 0, nodes,
+                    time.perf_counter() - start)
+    return Plan(best.actions, best.value, best.wins, days, nodes,
+                time.perf_counter() - start)
+
+
+def describe(plan):
+    """
+    Describe a plan for the player.
+    Args: plan (Plan): The plan.
+    Returns: list: Messages for the player.
+    """
+    builds = [
+        f"a {zone_type} at {x}, {y}"
+        for _, x, y, zone_type in plan.actions[:-1]
+    ]
+    if builds:
+        advice = (
+            f"Hint: build {', '.join(builds)}, then go to the next day."
+        )
+    else:
+        advice = "Hint: go to the next day."
+    if plan.value is None:
+        return [advice, "There was no time to look further ahead."]
+    return [
+        advice,
+        f"Expected money on day {GAME_DAYS}: {max(plan.value, 0):,.0f} "
+        f"(goal {MONETARY_GOAL:,}, won in {plan.win_rate:.0%} of the "
+        f"futures tried), looking {plan.days} "
+        f"day{'' if plan.days == 1 else 's'} ahead in "
+        f"{plan.seconds:.1f}s."
+    ]
+
+
+def main():
+    """
+    Plan a new seeded game, to try the planner without playing.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET)
+    parser.add_argument('--beam-width', type=int, default=BEAM_WIDTH)
+    parser.add_argument('--scenarios', type=int, default=SCENARIOS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--storage', choices=['sheets', 'sqlite'],
+                        default='sqlite')
+    args = parser.parse_args()
+    zone_data, events = load_catalog(args.storage)
+    state = GameState(
+        zone_data, events, default_resources(), verbose=False,
+        rng=random.Random(args.seed)
+    )
+    found = plan(state, args.budget, args.beam_width, args.scenarios,
+                 args.seed)
+    print('\n'.join(describe(found)))
+    print(f"{found.nodes} plans searched")
+
+
+if __name__ == '__main__':
+    main()
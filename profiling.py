@@ -0,0 +1,304 @@
+"""
+Profiling for McGee Metropolis. With PROFILE set, the storage calls, the
+drawing of the screen and the rules steps of each turn are timed into
+histograms named after them, costing about a microsecond a call.
+Without it the hooks aren't installed at all.
+
+The p50, p95 and p99 of each histogram are written as JSON on exit to
+PROFILE_REPORT (by default mcgee_profile.json in the system temp
+directory), and served at http://127.0.0.1:PROFILE_PORT/ while the game
+runs if PROFILE_PORT is set.
+
+CPROFILE_SESSION names one session, 'local' for a terminal game, to run
+under cProfile. Its stats are written to CPROFILE_DIR (by default the
+system temp directory) when the session ends, for `python -m pstats`.
+
+Usage: python profiling.py path/to/report.json
+"""
+import atexit
+import cProfile
+import functools
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get('PROFILE', '') not in ('', '0')
+
+REPORT_FILE_NAME = 'mcgee_profile.json'
+PERCENTILES = (50, 95, 99)
+
+# Buckets per doubling of the latency, 8 about 9% apart, with latencies
+# counted in units of 1024 ns, about a microsecond
+SUB_BUCKET_BITS = 3
+BUCKETS_PER_OCTAVE = 1 << SUB_BUCKET_BITS
+BUCKET_COUNT = 40 * BUCKETS_PER_OCTAVE  # Up to about 13 days
+UNIT_NS = 1024
+
+
+def bucket_of(nanos):
+    """
+    Find the bucket of a latency, from its highest bits.
+    Args: nanos (int): The latency in nanoseconds.
+    Returns: int: The bucket.
+    """
+    units = (nanos >> 10) + 1
+    octave = units.bit_length() - 1
+    sub = (units << SUB_BUCKET_BITS >> octave) - BUCKETS_PER_OCTAVE
+    return min(octave * BUCKETS_PER_OCTAVE + sub, BUCKET_COUNT - 1)
+
+
+def bucket_limit(bucket):
+    """
+    Find the upper edge of a bucket.
+    Args: bucket (int): The bucket.
+    Returns: float: The latency at its upper edge, in milliseconds.
+    """
+    octave, sub = divmod(bucket, BUCKETS_PER_OCTAVE)
+    units = math.ceil(
+        (BUCKETS_PER_OCTAVE + sub + 1 << octave) / BUCKETS_PER_OCTAVE
+    )
+    return (units - 1) * UNIT_NS / 1e6
+
+
+class Histogram:
+    """
+    Latencies of one hook in log-spaced buckets, so recording is a few
+    integer operations and a percentile is accurate to a bucket. Counts
+    are updated without a lock, so a count may rarely be lost when
+    sessions on different threads record at the same moment.
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, nanos):
+        """
+        Add one latency.
+        Args: nanos (int): The latency in nanoseconds.
+        """
+        # bucket_of(), inlined as this runs on every call of a hook
+        units = (nanos >> 10) + 1
+        octave = units.bit_length() - 1
+        bucket = (
+            octave * BUCKETS_PER_OCTAVE +
+            (units << SUB_BUCKET_BITS >> octave) - BUCKETS_PER_OCTAVE
+        )
+        self.counts[min(bucket, BUCKET_COUNT - 1)] += 1
+        self.count += 1
+        self.total_ns += nanos
+        if nanos > self.max_ns:
+            self.max_ns = nanos
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile of the latencies recorded.
+        Args: percent (float): The percentile, from 0 to 100.
+        Returns: float: The latency in milliseconds, the upper edge of its
+            bucket, or 0.0 if nothing has been recorded.
+        """
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bucket_limit(bucket), self.max_ns / 1e6)
+        return 0.0
+
+    def summary(self):
+        """
+        Summarise the latencies recorded.
+        Returns: dict: The count, and the mean, percentiles and max in
+            milliseconds.
+        """
+        count = self.count
+        summary = {
+            'count': count,
+            'mean_ms': self.total_ns / count / 1e6 if count else 0.0
+        }
+        for percent in PERCENTILES:
+            summary[f'p{percent}_ms'] = self.percentile(percent)
+        summary['max_ms'] = self.max_ns / 1e6
+        return summary
+
+
+HISTOGRAMS = {}  # Histogram of each hook, by name
+HISTOGRAMS_LOCK = threading.Lock()
+
+
+def histogram(name):
+    """
+    Get the histogram of a hook, creating it on first use.
+    Args: name (str): The name of the hook.
+    Returns: Histogram: Its histogram.
+    """
+    found = HISTOGRAMS.get(name)
+    if found is None:
+        with HISTOGRAMS_LOCK:
+            found = HISTOGRAMS.setdefault(name, Histogram())
+    return found
+
+
+def timed(name):
+    """
+    Decorate a function to time each call into a histogram, if profiling
+    is enabled.
+    Args: name (str): The name of the hook.
+    Returns: function: The decorator, which returns the function as it is
+        when profiling is off.
+    """
+    def decorate(function):
+        if not ENABLED:
+            return function
+        record = histogram(name).record
+        clock = time.perf_counter_ns
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(clock() - start)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def timer(name):
+    """
+    Time a block of code into a histogram, if profiling is enabled.
+    Args: name (str): The name of the hook.
+    """
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        histogram(name).record(time.perf_counter_ns() - start)
+
+
+def report():
+    """
+    Summarise every histogram.
+    Returns: dict: Hook names mapped to their summary, sorted by name.
+    """
+    with HISTOGRAMS_LOCK:
+        hooks = sorted(HISTOGRAMS.items())
+    return {name: hook.summary() for name, hook in hooks}
+
+
+def write_report(path=None):
+    """
+    Write the report as JSON.
+    Args: path (str): The file, PROFILE_REPORT or the default if None.
+    """
+    path = path or os.environ.get(
+        'PROFILE_REPORT', os.path.join(tempfile.gettempdir(), REPORT_FILE_NAME)
+    )
+    try:
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump(report(), report_file, indent=2)
+    except OSError as e:
+        print(f"Could not save the profile report: {e}", file=sys.__stderr__)
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """
+    Serves the report as JSON on any GET request.
+    """
+
+    def do_GET(self):
+        body = json.dumps(report(), indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep requests off the game's terminal
+
+
+def serve_report(port):
+    """
+    Serve the report on the local machine from a background thread.
+    Args: port (int): The port to listen on.
+    """
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', port), ReportHandler)
+    except OSError as e:
+        print(f"Could not serve the profile report: {e}", file=sys.__stderr__)
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+CAPTURE_LOCK = threading.Lock()  # cProfile captures one session at a time
+
+
+@contextmanager
+def capture(session):
+    """
+    Run a session under cProfile if CPROFILE_SESSION names it, writing the
+    stats to CPROFILE_DIR when it ends. cProfile only follows the thread
+    it is enabled in, so other sessions of the game server aren't in them.
+    Args: session (str): The session name.
+    """
+    if (os.environ.get('CPROFILE_SESSION') != session or
+            not CAPTURE_LOCK.acquire(blocking=False)):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        CAPTURE_LOCK.release()
+        path = os.path.join(
+            os.environ.get('CPROFILE_DIR', tempfile.gettempdir()),
+            f"mcgee-{session}-{time.strftime('%Y%m%d-%H%M%S')}.prof"
+        )
+        try:
+            profiler.dump_stats(path)
+            print(f"cProfile stats saved to {path}", file=sys.__stderr__)
+        except OSError as e:
+            print(f"Could not save the cProfile stats: {e}",
+                  file=sys.__stderr__)
+
+
+def main():
+    """
+    Print a saved report as a table.
+    """
+    if len(sys.argv) != 2:
+        print(__doc__.strip().split('\n')[-1])
+        sys.exit(2)
+    with open(sys.argv[1], encoding='utf-8') as report_file:
+        hooks = json.load(report_file)
+    print(f"{'Hook':<28}{'Count':>8}" + ''.join(
+        f"{f'p{percent} ms':>10}" for percent in PERCENTILES
+    ) + f"{'Max ms':>10}")
+    for name, summary in hooks.items():
+        print(f"{name:<28}{summary['count']:>8}" + ''.join(
+            f"{summary[f'p{percent}_ms']:>10.3f}" for percent in PERCENTILES
+        ) + f"{summary['max_ms']:>10.3f}")
+
+
+if ENABLED and __name__ != '__main__':
+    atexit.register(write_report)
+    if os.environ.get('PROFILE_PORT'):
+        serve_report(int(os.environ['PROFILE_PORT']))
+
+if __name__ == '__main__':
+    main()
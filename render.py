@@ -0,0 +1,401 @@
+"""
+Terminal rendering for McGee Metropolis. Builds the city map, resources and
+metrics as lines of text, and draws them as a frame fixed at the top of the
+terminal. After the first full draw, only the parts of the frame that
+changed are sent, as ANSI cursor-positioned updates in a single write,
+which keeps the bytes sent over the pty and websocket bridge small.
+Large maps are shown through a VIEW_SIZE square view that the player can
+move, so drawing costs the same whatever the size of the map.
+Text such as the intro is typed out in chunked frames that any keypress
+skips. TEXT_PACING=instant, or input that isn't a terminal, prints it at
+once.
+"""
+import os
+import select
+import shutil
+import sys
+import textwrap
+from engine import ZONE_TYPES
+from profiling import timed
+from zones import METRICS, SERVICE_RADIUS, ZONE_CODES, ZONE_RULES
+
+try:
+    import termios
+    import tty
+except ImportError:  # No terminal control, text is always printed at once
+    termios = None
+
+ZONE_SYMBOLS = {
+    'Residential': '🟢',  # Residential
+    'Commercial': '🟣',  # Commercial
+    'Industrial': '🟤',  # Industrial
+    'School': '🟡',  # School
+    'Hospital': '🔴',  # Hospital
+    '-': '⚪'  # Empty space
+}
+
+# Rows kept free below the frame for messages and prompts
+MIN_PROMPT_ROWS = 5
+
+FRAME_SECONDS = 1 / 30  # Time between frames of typed text
+
+VIEW_SIZE = 10  # Rows and columns of the map shown at once
+
+
+class Colour:
+    """
+    ANSI colour codes for coloured console output.
+    This class provides constants for various ANSI colour codes that can be
+    used to format text output in the console with different colurs and styles.
+    """
+    HEADER = '\033[95m'
+    BLUE = '\033[94m'
+    GREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+    UNDERLINE = '\033[4m'
+
+
+def pacing_is_instant():
+    """
+    Check whether text should be printed at once rather than typed out,
+    as it is for scripted and headless runs.
+    Returns: bool: True if text is printed at once.
+    """
+    if os.environ.get('TEXT_PACING', 'typed') == 'instant':
+        return True
+    if hasattr(sys.stdin, 'wait_for_key'):
+        return False  # A game server session, which reports keypresses
+    return termios is None or not sys.stdin.isatty()
+
+
+def type_text(text, colour='', chars_per_second=50):
+    """
+    Type text out a chunk per frame. Any keypress finishes it at once, and
+    the key is swallowed so it doesn't reach the next prompt.
+    Args:
+        text (str): The text to type.
+        colour (str): A Colour code for the text.
+        chars_per_second (int): The typing speed.
+    """
+    if pacing_is_instant():
+        sys.stdout.write(colour + text + Colour.ENDC)
+        sys.stdout.flush()
+        return
+    if hasattr(sys.stdin, 'wait_for_key'):
+        type_chunks(text, colour, chars_per_second, sys.stdin.wait_for_key)
+        return
+    fd = sys.stdin.fileno()
+    settings = termios.tcgetattr(fd)
+
+    def wait_for_key(seconds):
+        pressed, _, _ = select.select([fd], [], [], seconds)
+        if pressed:
+            os.read(fd, 1024)
+        return bool(pressed)
+
+    try:
+        tty.setcbreak(fd)  # Read keys as they are pressed, without echo
+        type_chunks(text, colour, chars_per_second, wait_for_key)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, settings)
+
+
+def type_chunks(text, colour, chars_per_second, wait_for_key):
+    """
+    Write text a chunk per frame until it is all written or a key is
+    pressed, then write the rest at once.
+    Args:
+        text (str): The text to type.
+        colour (str): A Colour code for the text.
+        chars_per_second (int): The typing speed.
+        wait_for_key (function): Waits up to a number of seconds for a
+            keypress, swallows it and returns True if there was one.
+    """
+    chunk = max(1, round(chars_per_second * FRAME_SECONDS))
+    sys.stdout.write(colour)
+    for start in range(0, len(text), chunk):
+        sys.stdout.write(text[start:start + chunk])
+        sys.stdout.flush()
+        if wait_for_key(FRAME_SECONDS):
+            sys.stdout.write(text[start + chunk:])
+            break
+    sys.stdout.write(Colour.ENDC)
+    sys.stdout.flush()
+
+
+def grid_lines(grid, origin=(0, 0), view=VIEW_SIZE):
+    """
+    Lay out a view of the grid with boxed borders and a one line key to the
+    symbols. Only the cells in view are read, so large maps cost no more to
+    draw than small ones.
+    Args: grid (numpy.ndarray or SparseGrid): The game grid of zone codes.
+        origin (tuple): The (x, y) of the top left cell in view.
+        view (int): The number of rows and columns in view.
+    Returns: list: The lines of text.
+    """
+    cell_width = 4
+    size = len(grid)
+    x0, y0 = origin
+    cells = grid[x0:x0 + view, y0:y0 + view]
+    label_width = max(2, len(str(size - 1)))
+    header = " " * (label_width + 1) + "".join(
+        f"{column:^5}" for column in range(y0, y0 + len(cells[0]))
+    )
+    if size > view:
+        header += f"  ({size}x{size} map)"
+    lines = [header]
+    for index, row in enumerate(cells, start=x0):
+        # Each row with a numerical label
+        lines.append(
+            f"{index:{label_width}} |" +
+            "|".join(
+                f"{ZONE_SYMBOLS.get(ZONE_TYPES[cell], '⚪'):^{cell_width}}"
+                for cell in row
+            ) +
+            "|"
+        )
+    lines.append(
+        Colour.BOLD + "Key: " +
+        " ".join(
+            f"{symbol} {zone_type if zone_type != '-' else 'Empty'}"
+            for zone_type, symbol in ZONE_SYMBOLS.items()
+        ) +
+        Colour.ENDC
+    )
+    return lines
+
+
+def resource_lines(resources):
+    """
+    Lay out the player's resources as a table.
+    Args: resources (dict): A dictionary containing the player's resources.
+    Returns: list: The lines of text, each 32 characters wide.
+    """
+    lines = [
+        f"{Colour.BLUE}{'Resources:':<32}{Colour.ENDC}",
+        f"{Colour.HEADER}{'Resource Type':<14}{'Value':>10}"
+        f"{'Regen':>8}{Colour.ENDC}"
+    ]
+    for key, value in resources.items():
+        lines.append(f"{key:<14}{value['Current Value']:10.2f}"
+                     f"{value['Regeneration Rate']:8.2f}")
+    return lines
+
+
+def metric_lines(metrics):
+    """
+    Lay out the current metrics as a table.
+    Args: metrics (dict): A dictionary containing the current metrics.
+    Returns: list: The lines of text.
+    """
+    lines = [
+        f"{Colour.GREEN}Metrics:{Colour.ENDC}",
+        f"{Colour.HEADER}{'Metric Type':<17}{'Value':>7}{Colour.ENDC}"
+    ]
+    for key, value in metrics.items():
+        lines.append(f"{key:<17}{value:6}%")
+    return lines
+
+
+def zone_lines(zones, impacts=True, width=72):
+    """
+    Describe each zone type from the zone catalog, for the instructions
+    and help, so they always match the rules being played.
+    Args:
+        zones (ZoneCatalog): The compiled zones.
+        impacts (bool): Whether to describe the metric impacts of each.
+        width (int): The width to wrap the lines to.
+    Returns: list: The lines of text, indented to sit in a list.
+    """
+    lines = []
+    for zone_type in ZONE_RULES:
+        code = ZONE_CODES[zone_type]
+        text = (
+            f"{zone_type} {ZONE_SYMBOLS[zone_type]}: Cost to build: "
+            f"{zones.costs[code]:g}, income generated "
+            f"{zones.incomes[code]:g} per day."
+        )
+        changes = [
+            f"{metric} {delta:+g}" for metric, delta in zip(
+                METRICS, zones.effects[code]
+            ) if delta
+        ]
+        if zones.money_rates[code]:
+            changes.insert(0, f"Money {zones.money_rates[code]:+.0%}")
+        services = [
+            f"{metric} {delta:+g}" for metric, delta in zip(
+                METRICS, zones.coverage[code]
+            ) if delta
+        ]
+        if services:
+            changes.append(
+                f"{', '.join(services)} for each Residential zone within "
+                f"{SERVICE_RADIUS} steps that no {zone_type} reached before"
+            )
+        lines += textwrap.wrap(
+            text, width, initial_indent='- ', subsequent_indent='  '
+        )
+        if impacts and changes:
+            lines += textwrap.wrap(
+                f"Impact: {', '.join(changes)}.", width,
+                initial_indent='  ', subsequent_indent='  '
+            )
+    return lines
+
+
+def side_by_side(left, right, width, gap=4):
+    """
+    Join two tables into one, line by line.
+    Args:
+        left (list): Lines of the left table, shorter lines are padded.
+        right (list): Lines of the right table.
+        width (int): The width of the left table without colour codes.
+        gap (int): Spaces between the tables.
+    Returns: list: The joined lines.
+    """
+    lines = []
+    for index in range(max(len(left), len(right))):
+        left_line = left[index] if index < len(left) else ' ' * width
+        right_line = right[index] if index < len(right) else ''
+        lines.append(left_line + ' ' * gap + right_line)
+    return lines
+
+
+def city_frame(state, origin=(0, 0)):
+    """
+    Lay out the full status frame: the map, resources, metrics and day.
+    Args: state (GameState): The current game.
+        origin (tuple): The (x, y) of the top left cell of the map in view.
+    Returns: list: The lines of text.
+    """
+    return (
+        grid_lines(state.grid, origin) +
+        side_by_side(
+            resource_lines(state.player_resources),
+            metric_lines(state.metrics),
+            32
+        ) +
+        [f"Day {state.day}: Good Morning! A New day has started..."]
+    )
+
+
+class Renderer:
+    """
+    Draws the status frame at the top of the terminal and keeps the last
+    frame drawn. The first draw, and any draw after invalidate(), clears
+    the screen, writes the whole frame and sets a scroll region below it
+    for messages and prompts. Later draws only send the lines, or parts of
+    lines, that changed. If the terminal is too short to hold the frame
+    above the prompts, every draw is a full redraw.
+    """
+
+    def __init__(self, stream=None):
+        """
+        Args: stream (file): Where to write, sys.stdout at draw time if None.
+        """
+        self.stream = stream
+        self.previous = None  # The lines of the last frame drawn
+        self.origin = (0, 0)  # The top left cell of the map in view
+        self.bytes_written = 0
+        self.frames = 0
+
+    def invalidate(self):
+        """
+        Forget the last frame, so the next draw is a full redraw. Call this
+        whenever something else clears or scrolls the whole screen.
+        """
+        self.previous = None
+
+    def centre_on(self, x, y, size):
+        """
+        Move the view of the map so a cell is in the middle of it, as far
+        as the edges of the map allow.
+        Args:
+            x (int): The x-coordinate of the cell.
+            y (int): The y-coordinate of the cell.
+            size (int): The size of the map.
+        """
+        limit = max(size - VIEW_SIZE, 0)
+        self.origin = (
+            min(max(x - VIEW_SIZE // 2, 0), limit),
+            min(max(y - VIEW_SIZE // 2, 0), limit)
+        )
+
+    def follow(self, x, y, size):
+        """
+        Bring a cell into view if it is outside the view of the map.
+        Args:
+            x (int): The x-coordinate of the cell.
+            y (int): The y-coordinate of the cell.
+            size (int): The size of the map.
+        """
+        x0, y0 = self.origin
+        if not (x0 <= x < x0 + VIEW_SIZE and y0 <= y < y0 + VIEW_SIZE):
+            self.centre_on(x, y, size)
+
+    @timed('render.frame')
+    def draw(self, state):
+        """
+        Draw the status frame of a game and leave the cursor below it.
+        Args: state (GameState): The current game.
+        """
+        lines = city_frame(state, self.origin)
+        rows = shutil.get_terminal_size((80, 24)).lines
+        fits = len(lines) + MIN_PROMPT_ROWS <= rows
+        if not fits:
+            # Too short for a fixed frame, redraw it all in one write
+            output = '\033[r\033[H\033[2J' + '\n'.join(lines) + '\n'
+            self.previous = None
+        elif self.previous is None or len(self.previous) != len(lines):
+            output = (
+                '\033[r\033[H\033[2J' + '\n'.join(lines) +
+                # Scroll only the rows below the frame
+                f'\033[{len(lines) + 1};{rows}r'
+            )
+            self.previous = lines
+        else:
+            output = ''.join(
+                self.line_update(row, old, new)
+                for row, (old, new) in enumerate(
+                    zip(self.previous, lines), start=1
+                )
+                if old != new
+            )
+            self.previous = lines
+        if fits:
+            # Clear the prompt area and leave the cursor at its top
+            output += f'\033[{len(lines) + 1};1H\033[J'
+        stream = self.stream or sys.stdout
+        stream.write(output)
+        stream.flush()
+        self.bytes_written += len(output.encode('utf-8'))
+        self.frames += 1
+
+    def line_update(self, row, old, new):
+        """
+        Build the update turning one drawn line into another. Plain ASCII
+        lines of the same length only get the changed runs of characters.
+        Other lines, such as grid rows whose symbols may be drawn at
+        different widths by different terminals, are rewritten whole.
+        Args:
+            row (int): The 1-based terminal row of the line.
+            old (str): The line as drawn.
+            new (str): The line to draw.
+        Returns: str: The ANSI escape sequences and text to send.
+        """
+        if len(old) != len(new) or not (old + new).isascii() or '\033' in new:
+            return f'\033[{row};1H{new}\033[K'
+        updates = []
+        index = 0
+        while index < len(new):
+            if old[index] == new[index]:
+                index += 1
+                continue
+            start = index
+            while index < len(new) and old[index] != new[index]:
+                index += 1
+            updates.append(f'\033[{row};{start + 1}H{new[start:index]}')
+        return ''.join(updates)
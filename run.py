@@ -3,56 +3,111 @@ McGee Metropolis: A city-building game. This contains the implementation of
 McGee Metropolis, a game where players build and manage a city, balancing
 resources and metrics to achieve goals within a set number of days.
 """
-import random
-import time
-import gspread
-from google.oauth2.service_account import Credentials
-from gspread.exceptions import GSpreadException
-
-# Constants
-GRID_SIZE = 10
-ZONE_SYMBOLS = {
-    'Residential': '🟢',  # Residential
-    'Commercial': '🟣',  # Commercial
-    'Industrial': '🟤',  # Industrial
-    'School': '🟡',  # School
-    'Hospital': '🔴',  # Hospital
-    '-': '⚪'  # Empty space
+import math
+import os
+import textwrap
+import threading
+import numpy as np
+from engine import (
+    DEFAULT_RESOURCES, GRID_SIZE, INITIAL_METRICS, MAX_GRID_SIZE,
+    MAX_ZONES_PER_DAY, METRIC_LIMITS, ZONES_PER_DAY_LIMIT, parse_events,
+    parse_player_resources, parse_zone_data
+)
+from journal import open_journal
+from planner import DEFAULT_BUDGET, describe, plan
+from profiling import capture, timed
+from render import (
+    VIEW_SIZE, Colour, Renderer, grid_lines, metric_lines, resource_lines,
+    type_text, zone_lines
+)
+from snapshot import open_snapshots
+from storage import (
+    SEED_ROWS, TABLE_COLUMNS, StorageError, open_storage, session_name
+)
+
+# Storage setup, Google Sheets or a local SQLite database
+STORAGE = open_storage()
+
+# The zones of the built-in zones table, to describe the game before
+# storage has been read
+BUILT_IN_ZONES = parse_zone_data(
+    [TABLE_COLUMNS['zones']] + [list(row) for row in SEED_ROWS['zones']]
+)
+
+# The letter the player types for each zone type
+ZONE_KEYS = {
+    'R': 'Residential',
+    'C': 'Commercial',
+    'I': 'Industrial',
+    'S': 'School',
+    'H': 'Hospital'
 }
+ZONE_PROMPT = (
+    "Enter zone type - R (Residential), C (Commercial),"
+    "I (Industrial), S (School), H (Hospital): "
+)
 
-MAX_ZONES_PER_DAY = 3  # Maximum number of zones that can be built in a day
 
-"""ANSI color codes for colored console output."""
+class Session(threading.local):
+    """
+    The parts of the game that belong to one player: their name in
+    storage, the renderer of their screen, the journal of their games and
+    the snapshot of their game in progress. A terminal game has one
+    session. The game server plays each session in its own thread, and
+    each thread gets its own.
+    """
+
+    def __init__(self):
+        self.name = session_name()  # Names the player's resources in storage
+        self.renderer = Renderer()  # Draws the status frame, sending changes
+        self.journal = open_journal()  # Records the games for replays
+        self.snapshots = open_snapshots()  # To resume after a drop
+
+
+SESSION = Session()
 
 
-class Colour:
+def map_size():
     """
-    ANSI colour codes for coloured console output.
-    This class provides constants for various ANSI colour codes that can be
-    used to format text output in the console with different colurs and styles.
+    Read the size of the map from the MAP_SIZE environment variable.
+    Returns: int: The size, GRID_SIZE if unset or invalid, and at most
+        MAX_GRID_SIZE.
     """
-    HEADER = '\033[95m'
-    BLUE = '\033[94m'
-    GREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
+    try:
+        size = int(os.environ.get('MAP_SIZE', GRID_SIZE))
+    except ValueError:
+        return GRID_SIZE
+    return min(max(size, 1), MAX_GRID_SIZE)
 
-# Google Sheets setup
 
+def zones_per_day():
+    """
+    Read how many zones can be built in a day from the ZONES_PER_DAY
+    environment variable, so large maps can be built up faster.
+    Returns: int: The limit, MAX_ZONES_PER_DAY if unset or invalid, and at
+        most ZONES_PER_DAY_LIMIT.
+    """
+    try:
+        limit = int(os.environ.get('ZONES_PER_DAY', MAX_ZONES_PER_DAY))
+    except ValueError:
+        return MAX_ZONES_PER_DAY
+    return min(max(limit, 1), ZONES_PER_DAY_LIMIT)
 
-SCOPE = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive"
-]
 
-CREDS = Credentials.from_service_account_file('creds.json')
-SCOPED_CREDS = CREDS.with_scopes(SCOPE)
-GSPREAD_CLIENT = gspread.authorize(SCOPED_CREDS)
-SHEET = GSPREAD_CLIENT.open('McGee_Metropolis')
+def plan_budget():
+    """
+    Read how long a hint may take to plan from the PLAN_BUDGET environment
+    variable.
+    Returns: float: The time budget in seconds, DEFAULT_BUDGET if unset or
+        invalid, and at least a tenth of a second.
+    """
+    try:
+        budget = float(os.environ.get('PLAN_BUDGET', DEFAULT_BUDGET))
+    except ValueError:
+        return DEFAULT_BUDGET
+    if not math.isfinite(budget):
+        return DEFAULT_BUDGET
+    return max(budget, 0.1)
 
 
 def clear_screen():
@@ -60,6 +115,7 @@ def clear_screen():
     Clears the screen.
     """
     print("\033c", end="")
+    SESSION.renderer.invalidate()  # The next status frame is drawn in full
 
 
 def show_intro():
@@ -84,12 +140,7 @@ def show_intro():
     Every move has an impact on your resources & metrics, so plan carefully.
     """
     print(Colour.GREEN + logo + Colour.ENDC)
-    for char in welcome_message:
-        print(Colour.BLUE + char, end='', flush=True)
-        time.sleep(0.05)
-    for char in aim:
-        print(Colour.GREEN + char, end='', flush=True)
-        time.sleep(0.02)
+    type_text(Colour.BLUE + welcome_message + Colour.GREEN + aim)
     while True:
         choice = input(
             Colour.BOLD +
@@ -128,22 +179,12 @@ def show_instructions():
     6. Tables will update you each day with your current metrics and resources.
     """
 
-    # Zone Details
-    zone_details = """
-     Zone Details:
-    - Residential 🟢: Cost to build: 1250, income generated 250 per day
-    - Commercial 🟣: Cost to build: 450, income generated 100 per day
-    - Industrial 🟤: Cost to build: 450, income generated 75 per day
-    - School 🟡: Cost to build: 100, income generated 20 per day
-    - Hospital 🔴: Cost to build: 100, income generated 30 per day
-    """
+    # Zone Details, from the built-in zones, as storage may not be ready
+    zone_details = "\n     Zone Details:\n" + textwrap.indent(
+        "\n".join(zone_lines(BUILT_IN_ZONES, impacts=False)), '    '
+    ) + "\n"
 
-    for char in instructions:
-        print(Colour.GREEN + char, end='', flush=True)
-        time.sleep(0.02)
-    for char in zone_details:
-        print(Colour.GREEN + char, end='', flush=True)
-        time.sleep(0.02)
+    type_text(instructions + zone_details, Colour.GREEN)
     while True:
         choice = input(
             Colour.BOLD +
@@ -177,27 +218,25 @@ def show_tips():
 
     Metric Stats:
     If you hit any of these metrics, you will lose the game:
-    Employment Rate: 50
-    Crime Rate: 30
-    Happiness Index: 50
-    Health: 50
-
-    1. Building any zone will increase your daily income, max 3 built per day.
+""" + "".join(
+        f"    {metric}: {limit}\n" for metric, limit in METRIC_LIMITS.items()
+    ) + f"""
+    1. Building any zone will increase your daily income, max {zones_per_day()}
+    built per day.
     2. If you are building a residential zone your employment rate
     will decrease.
     3. If you build a commercial zone your employment rate will increase,
     but your happiness index will decrease.
     4. If you build an industrial zone your happiness index
     and your citizens health will both decrease.
-    5. Building a hospital will boost your citizens health
-    6. Building a school will increase your employment rate
-    and boost your happiness index.
+    5. Building a hospital will boost the health of the residential zones
+    within 2 steps of it that no hospital reached before.
+    6. Building a school will increase your employment rate and boost your
+    happiness index for each residential zone it newly reaches in 2 steps.
     7. Water and electricity regenerate at a rate of 5 per day.
     """
 
-    for char in metrics_tips:
-        print(Colour.GREEN + char, end='', flush=True)
-        time.sleep(0.02)
+    type_text(metrics_tips, Colour.GREEN)
     while True:
         choice = input(
             Colour.BOLD +
@@ -216,432 +255,275 @@ def show_tips():
 
 def fetch_zone_data():
     """
-    Fetch the data of each zone type from Google Sheets.
-    Returns: dict: A dictionary with zone types as keys and a dictionary of
-    count and income as values.
+    Fetch the data of each zone type from storage.
+    Returns: ZoneCatalog: The compiled zones, with none to place on a new
+        grid if they couldn't be read.
     """
+    log = []
     try:
-        zone_sheet = SHEET.worksheet('zones')
-        data = zone_sheet.get_all_values()
-        zone_data = {}
-        for row in data[1:]:  # Skip header row
-            zone_type = row[0]
-            count = row[1].strip()
-            income = row[2].strip()
-            if count.isdigit():  # Validate and convert count and income
-                count = int(count)
-            else:
-                print(f"Invalid count for {zone_type}: {count}")
-                count = 0
-            try:
-                income = float(income) if income else 0.0
-            except ValueError:
-                print(f"Invalid income for {zone_type}: {income}")
-                income = 0.0
-            zone_data[zone_type] = {
-                'count': count,
-                'income': income
-            }
-        return zone_data
-    except GSpreadException as e:
-        print(f"Google Sheets error fetching zone data: {e}")
-        return {}
-
-
-def initialize_grid(size):
-    """
-    Initialise an empty game grid with the specified size.
-    Args: size (int): The size of the grid.
-    Returns: list: A 2D list representing the empty game grid.
-    """
-    return [['-' for _ in range(size)] for _ in range(size)]
-
-
-def initialize_random_grid(size, zone_data):
-    """
-    Initialise the game grid with random zones based on fetched counts.
-    Args: size (int): The size of the grid.
-        zone_data (dict): A dictionary containing zone types and their data.
-    Returns: tuple: A tuple containing the initialied grid and the total daily
-        income.
-    """
-    grid = [['-' for _ in range(size)] for _ in range(size)]
-    positions = [(x, y) for x in range(size) for y in range(size)]
-    random.shuffle(positions)  # Shuffle positions for random placement
-    total_daily_income = 0
-    for zone_type, data in zone_data.items():
-        count = data['count']
-        income = data['income']
-        for _ in range(min(count, len(positions))):
-            x, y = positions.pop()
-            grid[x][y] = zone_type
-            total_daily_income += income
-    return grid, total_daily_income
-
-
-def place_zone(grid, zone_type, x, y, player_resources, metrics):
-    """
-    Place a zone on the grid at the specified coordinates if enough resources
-    are available.
-    Args:
-        grid (list): The game grid.
-        zone_type (str): The type of zone to place.
-        x (int): The x-coordinate.
-        y (int): The y-coordinate.
-        player_resources (dict): A dictionary containing the player's
-        resources.
-        metrics (dict): A dictionary containing the current metrics.
-    """
-    # Costs of resources
-    zone_costs = {
-        'Residential': 1250,
-        'Commercial': 450,
-        'Industrial': 450,
-        'School': 100,
-        'Hospital': 100}
-    if player_resources['Money']['Current Value'] >= zone_costs[zone_type]:
-        if grid[x][y] == '-':
-            grid[x][y] = zone_type
-            # Deduct the cost of zone from resources
-            player_resources['Money']['Current Value'] -= zone_costs[zone_type]
-            print(
-                f"Congratulations, you built a {zone_type} & placed it at"
-                f"{x}, {y}."
-            )
-            print(f"Remaining Money: {player_resources['Money']}")
-            update_metrics(metrics, player_resources, zone_type, 1)
-        else:
-            print("This plot is already occupied, please choose another plot")
-    else:
-        print("Sorry, you do not enough money to build this zone right now.")
+        zone_data = parse_zone_data(STORAGE.read_values('zones'), log)
+    except StorageError as e:
+        log.append(f"Storage error fetching zone data: {e}")
+        zone_data = parse_zone_data([])
+    for message in log:
+        print(message)
+    return zone_data
 
 
+@timed('render.print_grid')
 def print_grid(grid):
     """
     Print the grid to the console with boxed borders and consistent alignment.
     Also prints a key to help players understand the symbols used for
     different zones.
     Args:
-        grid (list): The game grid.
-    """
-    cell_width = 4
-    print("      0    1    2    3    4    5    6    7    8    9")
-    for index, row in enumerate(grid):
-        # Print each row with a numerical label
-        row_str = (
-            f"{index:2} |" +
-            "|".join(
-                f"{ZONE_SYMBOLS.get(str(cell), '⚪'):^{cell_width}}"
-                for cell in row
-            ) +
-            "|"
-        )
-        print(row_str)
-    print()  # Ensure there's a new line after the grid for better spacing
-    # Print the key
-    key = """
-    Key:
-    🟢 - Residential
-    🟣 - Commercial
-    🟤 - Industrial
-    🟡 - School
-    🔴 - Hospital
-    ⚪ - Empty space
+        grid (numpy.ndarray): The game grid of zone codes.
     """
-    print(Colour.BOLD + key + Colour.ENDC)
+    print("\n".join(grid_lines(grid)))
 
 
 def get_resources():
     """
-    Source and display resources from the 'resources' worksheet.
+    Source and display the player's resources from the 'resources' worksheet.
     """
     try:
-        resources = SHEET.worksheet('resources')
-        data = resources.get_all_values()
+        data = STORAGE.read_resources(SESSION.name)
         print("\nCurrent Resources:")
         for row in data:
-            print(row)
-    except gspread.exceptions.WorksheetNotFound:
-        print("Error: 'resources' worksheet not found.")
+            print(list(row.values()))
+    except StorageError as e:
+        print(f"Error reading the 'resources' table: {e}")
 
 
 def fetch_player_resources():
     """
-    Fetch player resources from the 'resources' worksheet
+    Fetch the player's resources from the 'resources' worksheet
     and return as a dictionary.
     Returns:
         dict: A dictionary containing player resources.
     """
-    player_resources = {}
+    log = []
     try:
-        resources_sheet = SHEET.worksheet('resources')
-        data = resources_sheet.get_all_records()  # Convert list to dictionary
-        for res in data:
-            resource_type = res['Resource Type']
-            current_value = res['Current Value']
-            regeneration_rate = res.get('Regeneration Rate', 0)
-            # Convert current_value to float, handling strings with commas
-            try:
-                current_value = float(str(current_value).replace(',', ''))
-            except ValueError:
-                print(f"Invalid value for {resource_type}: {current_value}")
-                current_value = 0.0
-            # Convert to float or default to 0.0 if empty
-            try:
-                regeneration_rate = float(regeneration_rate)
-            except ValueError:
-                print(f"Invalid rate for {resource_type}: {regeneration_rate}")
-                regeneration_rate = 0.0
-            player_resources[resource_type] = {
-                'Current Value': current_value,
-                'Regeneration Rate': regeneration_rate
-            }
-    except GSpreadException as e:
-        print(f"Google Sheets error fetching player resources: {e}")
+        player_resources = parse_player_resources(
+            STORAGE.read_resources(SESSION.name), log
+        )
+    except StorageError as e:
+        log.append(f"Storage error fetching player resources: {e}")
+        player_resources = {}
+    for message in log:
+        print(message)
     return player_resources
 
 
 def update_resources_in_sheet(player_resources):
     """
-    Update the resources back to Google Sheets.
+    Queue the resources to be written back to storage. The write happens
+    in the background, see save_resources to wait for it.
     Args:
         player_resources (dict):
         A dictionary containing the player's resources.
     """
     try:
-        resources_sheet = SHEET.worksheet('resources')
-        for resource_type, values in player_resources.items():
-            # Find the cell with the resource type
-            cell = resources_sheet.find(resource_type)
-            resources_sheet.update_cell(
-                cell.row,
-                cell.col + 1,
-                values['Current Value']
+        STORAGE.write_resources({SESSION.name: {
+            resource_type: (
+                values['Current Value'], values['Regeneration Rate']
             )
-            resources_sheet.update_cell(
-                cell.row,
-                cell.col + 2,
-                values['Regeneration Rate']
-            )
-    except GSpreadException as e:
-        print(f"Google Sheets error updating resources: {e}")
+            for resource_type, values in player_resources.items()
+        }})
+    except StorageError as e:
+        print(f"Storage error updating resources: {e}")
 
 
 def reset_resources_to_default():
-    """Reset the resource values in the Google Sheet
+    """Reset the player's resource values in storage
     to their default amounts."""
     try:
-        resources_sheet = SHEET.worksheet('resources')
-        default_resources = {
-            'Money': (10000, 0.0),
-            'Electricity': (500, 5.0),  # Set regeneration rate for Electricity
-            'Water': (500, 5.0)  # Set regeneration rate for Water
-        }
-        # Iterate over the default_resources dictionary and update the sheet
-        for resource, values in default_resources.items():
-            current_value, regeneration_rate = values
-            cell = resources_sheet.find(resource)
-            # Update the resource value to default
-            resources_sheet.update_cell(cell.row, cell.col + 1, current_value)
-            resources_sheet.update_cell(
-                cell.row,
-                cell.col + 2,
-                regeneration_rate)
+        STORAGE.write_resources({SESSION.name: DEFAULT_RESOURCES})
+        # Wait so the next read sees the defaults
+        STORAGE.drain(SESSION.name)
         print("Resources have been reset to default values.")
-    except GSpreadException as e:
-        print(f"Google Sheets error resetting resources: {e}")
+    except StorageError as e:
+        print(f"Storage error resetting resources: {e}")
 
 
-def regenerate_resources(player_resources, total_daily_income):
+def release_resources():
     """
-    Regenerate resources daily and add daily income.
-    Args:
-        player_resources (dict): A dictionary containing the player resources.
-        total_daily_income (float): The total daily income generated by zones.
+    Release the player's resources in storage as their session ends, so
+    later sessions can reuse the storage rows instead of adding more.
     """
-    for resource, values in player_resources.items():
-        # Apply the regeneration rate directly to the current value
-        if isinstance(values, dict):
-            values['Current Value'] += values['Regeneration Rate']
-        else:
-            print(f"Unexpected data structure for {resource}: {values}")
-    # Add daily income to the player's money
-    player_resources['Money']['Current Value'] += total_daily_income
+    try:
+        STORAGE.release_resources(SESSION.name)
+    except StorageError as e:
+        print(f"Storage error releasing resources: {e}")
 
 
+def save_resources():
+    """
+    Wait until the player's queued resource writes have reached storage.
+    """
+    try:
+        STORAGE.drain(SESSION.name)
+    except StorageError as e:
+        print(f"Storage error saving resources: {e}")
+
+
+@timed('render.print_resources')
 def print_resources(resources):
     """
     Print the player's resources in a formatted table.
     Args:
         resources (dict): A dictionary containing the player's resources.
     """
-    header = (
-        f"{Colour.HEADER}{'Resource Type':<20}{Colour.ENDC}"
-        f"{Colour.HEADER}{'Current Value':<15}{Colour.ENDC}"
-        f"{Colour.HEADER}{'Regeneration Rate':<15}{Colour.ENDC}"
-    )
-    print(Colour.BLUE + "Resources:" + Colour.ENDC)
-    print(header)
-    for key, value in resources.items():
-        print(f"{key:<15} {value['Current Value']:10.2f} "
-              f"{value['Regeneration Rate']:15.2f}")
-    print()
+    print("\n".join(resource_lines(resources)))
 
 
-def handle_zone_action(grid, player_resources, metrics):
+def handle_zone_action(state):
     """
-    Handle the action of placing a zone and check resources.
-    Args:
-        grid (list): The game grid.
-        player_resources (dict): A dictionary containing the player resources.
-        metrics (dict): A dictionary containing the current metrics.
+    Ask the player where and what to build, then build the zone.
+    Args: state (GameState): The current game.
+    Returns: list: Messages for the player about the build.
     """
-    clear_screen()
     while True:
         try:
             x = int(input(f"Enter X coordinate to build a zone "
-                          f"(0-{GRID_SIZE-1}): "))
+                          f"(0-{state.size - 1}): "))
             y = int(input(f"Enter Y coordinate to build a zone "
-                          f"(0-{GRID_SIZE-1}): "))
-            if 0 <= x < GRID_SIZE and 0 <= y < GRID_SIZE:
-                zone_input = input(
-                    "Enter zone type - R (Residential), C (Commercial),"
-                    "I (Industrial), S (School), H (Hospital): "
-                ).upper()
-                zone_map = {
-                    'R': 'Residential',
-                    'C': 'Commercial',
-                    'I': 'Industrial',
-                    'S': 'School',
-                    'H': 'Hospital'
-                }
-                if zone_input in zone_map:
-                    zone_type = zone_map[zone_input]
-                    place_zone(
-                        grid,
-                        zone_type,
-                        x,
-                        y,
-                        player_resources,
-                        metrics
+                          f"(0-{state.size - 1}): "))
+            if 0 <= x < state.size and 0 <= y < state.size:
+                zone_input = input(ZONE_PROMPT).upper()
+                if zone_input in ZONE_KEYS:
+                    # Bring the new zone into view and build it
+                    SESSION.renderer.follow(x, y, state.size)
+                    return SESSION.journal.step(
+                        ('build', x, y, ZONE_KEYS[zone_input])
                     )
-                    return True  # Zone successfully placed
                 else:
                     print("Invalid. Please use 'R', 'C', 'I', 'S', or 'H'")
             else:
                 print(
                     f"Invalid coordinates. Please enter values between 0 "
-                    f"and {GRID_SIZE - 1}."
+                    f"and {state.size - 1}."
                 )
         except ValueError:
             print("Invalid input. Please enter numeric grid coordinates.")
 
 
-def fetch_events():
-    """
-    Fetch event data from the Google Sheet.
-    Returns:
-        list: A list of dictionaries containing event data.
+def parse_area(text, size):
     """
-    try:
-        events_sheet = SHEET.worksheet('events')
-        events = events_sheet.get_all_records()
-        # Initialise all events as inactive with specified duration
-        for event in events:
-            event['Active'] = False
-            try:
-                event['Duration'] = int(event.get('Duration', 0))
-            except ValueError:
-                print(f"Invalid duration {event.get('Description', '')}.")
-                event['Duration'] = 0
-        return events
-    except GSpreadException as e:
-        print(f"Google Sheets error fetching events: {e}")
-        return []
-
-
-def apply_random_event(events, player_resources, last_event=None):
-    """
-    Randomly select and apply an event effect if it's not currently active,
-    and handle event duration.
+    Read the plots of an area, either a rectangle as the X and Y of two
+    opposite corners, such as '2 3 4 5', or a list of X,Y plots, such as
+    '2,3 4,5 6,7'.
     Args:
-        events (list): A list of dictionaries containing event data.
-        player_resources (dict): A dictionary containing the resources.
-        last_event (str): The description of the last event applied.
-        day (int): The current day in the game.
-    """
-    active_events = [event for event in events if event['Active']]
-    for event in active_events:
-        if event['Duration'] > 0:
-            print(
-                f"Oh no, an event is impacting the city:"
-                f"{event['Description']} "
-                f"resulting in {event['Impact Type']}"
-                f" of {event['Impact Value']}. "
-                f"Days left: {event['Duration']}"
-            )
-            apply_impact(
-                player_resources, event['Impact Type'], event['Impact Value']
-            )
-            event['Duration'] -= 1
-        if event['Duration'] <= 0:
-            event['Active'] = False
-    if not any(event['Active'] for event in events):
-        new_event = random.choice(
-            [event for event in events if event['Description'] != last_event]
+        text (str): The area as the player typed it.
+        size (int): The size of the map.
+    Returns: numpy.ndarray: The (x, y) of each plot, as an N x 2 array.
+    Raises: ValueError: If the text isn't an area on the map.
+    """
+    values = text.replace(',', ' ').split()
+    if not all(value.lstrip('-').isdigit() for value in values):
+        raise ValueError("Please enter numeric grid coordinates.")
+    if ',' in text:
+        cells = [
+            [int(value) for value in plot.split(',')] for plot in text.split()
+        ]
+        if any(len(cell) != 2 for cell in cells):
+            raise ValueError("Each plot must be an X,Y pair.")
+        cells = np.array(cells, dtype=np.int64).reshape(-1, 2)
+    else:
+        corners = [int(value) for value in text.split()]
+        if len(corners) != 4:
+            raise ValueError("A rectangle needs X1 Y1 X2 Y2.")
+        cells = np.array(corners, dtype=np.int64).reshape(2, 2)
+    if not ((cells >= 0) & (cells < size)).all():
+        raise ValueError(
+            f"Invalid coordinates. Please enter values between 0 and "
+            f"{size - 1}."
         )
-        if not new_event['Active']:
-            new_event['Active'] = True
-            new_event['Duration'] = int(new_event.get('Duration', 1))
-            print(
-                f"Oh no, a new event has started: {new_event['Description']} "
-                f"resulting in {new_event['Impact Type']}"
-                f" by {new_event['Impact Value']} "
-                f"for {new_event['Duration']} days."
+    if ',' not in text:
+        (x1, y1), (x2, y2) = cells.min(axis=0), cells.max(axis=0)
+        xs, ys = np.mgrid[x1:x2 + 1, y1:y2 + 1]
+        cells = np.column_stack((xs.ravel(), ys.ravel()))
+    return cells
+
+
+def handle_area_action(state):
+    """
+    Ask the player for an area and a zone type, and build that zone on
+    every plot of the area at once.
+    Args: state (GameState): The current game.
+    Returns: list: Messages for the player.
+    """
+    left = state.zones_per_day - state.zones_built_today
+    while True:
+        text = input(
+            f"Enter the area to build, up to {left} zones, as two corners "
+            f"'X1 Y1 X2 Y2' or as plots 'X,Y X,Y' (0-{state.size - 1}): "
+        )
+        try:
+            cells = parse_area(text, state.size)
+        except ValueError as e:
+            print(f"Invalid area. {e}")
+            continue
+        zone_input = input(ZONE_PROMPT).upper()
+        if zone_input in ZONE_KEYS:
+            # Bring the first new zone into view and build the area
+            SESSION.renderer.follow(
+                int(cells[0, 0]), int(cells[0, 1]), state.size
             )
-            apply_impact(
-                player_resources,
-                new_event['Impact Type'],
-                new_event['Impact Value']
+            return SESSION.journal.step(
+                ('area', ZONE_KEYS[zone_input], cells)
             )
-            return new_event['Description']
-        return last_event
+        print("Invalid. Please use 'R', 'C', 'I', 'S', or 'H'")
 
 
-def apply_impact(player_resources, impact_type, impact_value):
+def handle_hint_action(state):
     """
-    Apply the calculated impact to the player's resources.
-    Args:
-        player_resources (dict): A dictionary containing the player resources.
-        impact_type (str): The type of impact.
-        impact_value (str): The value of the impact.
+    Search for the best builds for today and suggest them to the player,
+    without changing the game.
+    Args: state (GameState): The current game.
+    Returns: list: Messages for the player.
     """
-    # Mapping from event impact types to player resource keys
-    impact_type_map = {
-        'an electricity supply reduction': 'Electricity',
-        'an income reduction': 'Money',
-        'a water supply reduction': 'Water',
-    }
+    print(f"Planning for up to {plan_budget():g} seconds...")
+    return describe(plan(state, plan_budget(), seed=state.day))
 
-    adjusted_impact_type = impact_type_map.get(impact_type, None)
-    if not adjusted_impact_type:  # Check if the mapping was successful
-        return  # Exit if no valid mapping exists
-    update_resource(player_resources, adjusted_impact_type, impact_value)
+
+def handle_view_action(state):
+    """
+    Ask the player which cell to centre the view of a large map on.
+    Args: state (GameState): The current game.
+    """
+    while True:
+        try:
+            x = int(input(f"Enter X coordinate to view "
+                          f"(0-{state.size - 1}): "))
+            y = int(input(f"Enter Y coordinate to view "
+                          f"(0-{state.size - 1}): "))
+            if 0 <= x < state.size and 0 <= y < state.size:
+                SESSION.renderer.centre_on(x, y, state.size)
+                return
+            print(
+                f"Invalid coordinates. Please enter values between 0 "
+                f"and {state.size - 1}."
+            )
+        except ValueError:
+            print("Invalid input. Please enter numeric grid coordinates.")
 
 
-def update_resource(player_resources, resource_type, impact_value):
+def fetch_events():
     """
-    Update a specific resource based on an impact value.
-    Args:
-        player_resources (dict): A dictionary containing the resources.
-        resource_type (str): The type of resource to update.
-        impact_value (str): The value of the impact.
+    Fetch event data from storage and compile it.
+    Returns:
+        EventCatalog: The compiled events, empty if they couldn't be read.
     """
-    if '%' in impact_value:
-        modifier = float(impact_value.strip('%')) / 100
-        player_resources[resource_type]['Current Value'] *= (1 + modifier)
-    else:
-        player_resources[resource_type]['Current Value'] += float(impact_value)
+    log = []
+    try:
+        events = parse_events(STORAGE.read_records('events'), log)
+    except StorageError as e:
+        log.append(f"Storage error fetching events: {e}")
+        events = parse_events([])
+    for message in log:
+        print(message)
+    return events
 
 
 def fetch_metrics():
@@ -649,132 +531,74 @@ def fetch_metrics():
     Fetch the initial metrics for the game.
     Returns: dict: A dictionary containing the initial metrics.
     """
-    return {
-        'Employment Rate': 70,
-        'Crime Rate': 5,
-        'Happiness Index': 75,
-        'Health': 80
-    }
+    return dict(INITIAL_METRICS)
 
 
-def check_metrics(metrics):
+@timed('render.print_metrics')
+def print_metrics(metrics):
     """
-    Check if any metrics have fallen below or above critical levels.
+    Print the current metrics in a formatted table.
     Args: metrics (dict): A dictionary containing the current metrics.
-    Returns: bool: True if all metrics are within acceptable levels,
-    False if not.
-    """
-    min_values = {
-        'Employment Rate': 50,
-        'Crime Rate': 30,  # Represents a max value
-        'Happiness Index': 50,
-        'Health': 50
-    }
-    for metric, value in metrics.items():
-        if metric == 'Crime Rate':
-            if value > min_values[metric]:
-                print("Game Over: Crime Rate is too high!")
-                return False
-        else:
-            if value < min_values[metric]:
-                print(f"Game Over: {metric} is too low!")
-                return False
-    return True
-
-
-def update_metrics(metrics, player_resources, zone_type, amount):
     """
-    Update the metrics based on the type and amount of zone built.
-    Args: metrics (dict): A dictionary containing the current metrics.
-        player_resources (dict): A dictionary containing the player resources.
-        zone_type (str): The type of zone built.
-        amount (int): The number of zones built.
-    """
-    if zone_type == 'Residential':
-        metrics['Employment Rate'] -= amount * 5  # Employment rate decreases
-    elif zone_type == 'Commercial':
-        player_resources['Money']['Current Value'] += (
-            player_resources['Money']['Current Value'] * 0.05
-        )
-        metrics['Employment Rate'] += amount * 2  # Employment rate increases
-        metrics['Happiness Index'] -= amount * 1  # Happiness decreases
-    elif zone_type == 'Industrial':
-        metrics['Happiness Index'] -= amount * 1  # Happiness decreases
-        metrics['Health'] -= amount * 1  # Health decreases
-    elif zone_type == 'School':
-        metrics['Employment Rate'] += amount * 2  # Employment rate increases
-        metrics['Happiness Index'] += amount * 1  # Happiness increases
-    elif zone_type == 'Hospital':
-        metrics['Health'] += amount * 5  # Health increases
-
-    # Ensure metrics don't go out of bounds
-    metrics['Employment Rate'] = min(max(metrics['Employment Rate'], 0), 100)
-    metrics['Crime Rate'] = min(max(metrics['Crime Rate'], 0), 100)
-    metrics['Happiness Index'] = min(max(metrics['Happiness Index'], 0), 100)
-    metrics['Health'] = min(max(metrics['Health'], 0), 100)
+    print("\n".join(metric_lines(metrics)))
 
 
-def print_metrics(metrics):
+def metric_limit_lines():
     """
-    Print the current metrics in a formatted table.
-    Args: metrics (dict): A dictionary containing the current metrics.
+    Describe the critical level of each metric, for the help.
+    Returns: list: The lines of text.
     """
-    header = (
-        f"{Colour.HEADER}{'Metric Type':<27}{Colour.ENDC}"
-        f"{Colour.HEADER}{'Value (%)':<27}{Colour.ENDC}"
-    )
-    print(Colour.GREEN + "Metrics:" + Colour.ENDC)
-    print(header)
-    for key, value in metrics.items():
-        print(f"{key:<20} {value:10}%")
-    print()
+    return [
+        f"- {metric}: Should not exceed {limit}%." if metric == 'Crime Rate'
+        else f"- {metric}: Should not fall below {limit}%."
+        for metric, limit in METRIC_LIMITS.items()
+    ]
 
 
-def print_help():
+def print_help(state):
     """
     Print the help message displaying available commands and game details.
+    Args: state (GameState): The current game, whose zones and daily limit
+        are described.
     """
+    clear_screen()
     help_text = """
     Commands available:
       build - Place a new zone.
+      area - Place one type of zone on a rectangle or a list of plots.
       next - Move to the next day.
+      hint - Suggest the builds for today that lead to the most money.
       restart - Restart the game.
       help - Show this help message.
       exit - Exit the game.
+      view - Move the view of a large map.
 
     Game Rules:
     - You have 30 days to build and manage your city.
     - Your goal is to reach 2,000,000 in money within 30 days.
-    - You can build a maximum of 3 zones per day.
+    - You can build a maximum of {per_day} zones per day.
     - Each zone type has a different cost and daily income generation.
     Metric Limits:
-    - Employment Rate: Should not fall below 50%.
-    - Crime Rate: Should not exceed 30%.
-    - Happiness Index: Should not fall below 50%.
-    - Health: Should not fall below 50%.
+{limits}
     Resources:
     - Money: Used to build zones and is increased by daily income.
     - Electricity: Consumed by the city and regenerated daily.
     - Water: Consumed by the city and regenerated daily.
     Zone Details:
-    - Residential 🟢: Cost to build: 1250, income generated 250 per day.
-      Impact: Decreases Employment Rate by 5%.
-    - Commercial 🟣: Cost to build: 450, income generated 100 per day.
-      Impact: Increases Money by 5%, Employment Rate by 2%, decreases
-      Happiness by 1%.
-    - Industrial 🟤: Cost to build: 450, income generated 75 per day.
-      Impact: Decreases Happiness by 1%, Health by 1%.
-    - School 🟡: Cost to build: 100, income generated 20 per day.
-      Impact: Increases Employment Rate by 2%, Happiness by 1%.
-    - Hospital 🔴: Cost to build: 100, income generated 30 per day.
-      Impact: Increases Health by 5%.
+{zones}
+    - New Residential zones already in reach of a Hospital or School get
+      the same boost.
     Random Events:
     - Events can impact your resources (e.g., reducing electricity or water
     supply, or decreasing income).
     - Event impacts last for a specified duration and can significantly
     affect your city's metrics.
     Press Enter to continue...
-    """
+    """.format(
+        per_day=state.zones_per_day,
+        limits=textwrap.indent("\n".join(metric_limit_lines()), '    '),
+        zones=textwrap.indent("\n".join(zone_lines(state.zones)), '    ')
+    )
     print(help_text)
     input()  # Pause and wait for user input to continue
 
@@ -794,28 +618,18 @@ def start_new_game(reset_resources=True):
     Args:
         reset_resources (bool): Whether to reset resources to default values.
     Returns:
-        tuple: grid, total_daily_income, player_resources, metrics, events,
-        current_day
+        GameState: The new game, on day 1.
     """
     if reset_resources:
         reset_resources_to_default()  # Reset resources for new game
-    zone_data = fetch_zone_data()
-    events = fetch_events()
-    player_resources = fetch_player_resources()
-    metrics = fetch_metrics()
-    current_day = 1  # Start the day counter
-    if zone_data:
-        grid, total_daily_income = initialize_random_grid(GRID_SIZE, zone_data)
-    else:
-        # If fetching fails, fallback to an empty grid
-        grid, total_daily_income = initialize_grid(GRID_SIZE), 0
-    return (
-        grid,
-        total_daily_income,
-        player_resources,
-        metrics,
-        events,
-        current_day
+    SESSION.renderer.origin = (0, 0)  # Show the top left of the new map
+    return SESSION.journal.new_game(
+        fetch_zone_data(),
+        fetch_events(),
+        fetch_player_resources(),
+        fetch_metrics(),
+        map_size(),
+        zones_per_day()
     )
 
 
@@ -853,141 +667,192 @@ def show_goodbye_message():
             print("Invalid input. Please type 'yes' or 'no'.")
 
 
-def main():
+def print_city(state, messages):
     """
-    Main function to run the game.
-    Initialises the game, handles the main game loop, and manages game state.
+    Show the city map, resources, metrics and the latest messages for the
+    player. Only the parts of the map and tables that changed since they
+    were last shown are redrawn.
+    Args:
+        state (GameState): The current game.
+        messages (list): Messages produced by the last action.
     """
-    show_intro()  # Show introduction and instructions at the start
-    monetary_goal = 2000000
-    # Minimum / maximum acceptable metric values
-    min_metrics = {
-        'Employment Rate': 50,
-        'Crime Rate': 50,
-        'Happiness Index': 50,
-        'Health': 50
-    }
-    while True:
-        (grid, total_daily_income, player_resources,
-         metrics, events, current_day) = start_new_game()
-        game_over = False
-        last_event = None
-        zones_built_today = 0  # Track zones built in the current day
-        while current_day <= 30 and not game_over:
-            clear_screen()
-            print("McGee Metropolis City Map:")
-            print_grid(grid)
-            print("\nCurrent Resources and Metrics:")
-            # Functions to print resources and metrics in a formatted table
-            print_resources(player_resources)
-            print_metrics(metrics)
-            print(f"Day {current_day}: Good Morning! A New day has started...")
-            last_event = apply_random_event(
-                events, player_resources, last_event
-            )
-            regenerate_resources(player_resources, total_daily_income)
-            if not check_metrics(metrics):
-                print(
-                    "One or more metrics have reached critical levels. "
-                    "The game is over, better luck next time!"
-                )
-                game_over = True
-                continue
-            if zones_built_today < MAX_ZONES_PER_DAY:
+    SESSION.renderer.draw(state)
+    for message in messages:
+        print(message)
+
+
+def leave_game():
+    """
+    Confirm the player wants to exit, release their resources and say
+    goodbye. A new game resets the resources anyway.
+    Returns: bool: True if the player is leaving to play a new game,
+    False if they changed their mind about exiting.
+    """
+    if not confirm_exit():
+        return False
+    SESSION.snapshots.clear()  # The game is abandoned, don't offer it again
+    release_resources()
+    return show_goodbye_message()
+
+
+def play_day_loop(state):
+    """
+    Run the day loop of one game, asking the player for actions until the
+    game ends, or the player restarts or leaves to play again.
+    Args: state (GameState): The game to play.
+    Returns: bool: True if the game ended, False if a new game should start.
+    """
+    messages = state.messages
+    while not state.is_over:
+        SESSION.snapshots.save(state)  # Keep the game if the connection drops
+        today = state.day
+        print_city(state, messages)
+        messages = []
+        if state.zones_built_today < state.zones_per_day:
+            if state.size > VIEW_SIZE:
                 action = input(
                     "\nChoose the action you would like to take:"
-                    "\n1. Build a zone  "
-                    "\n2. Go to the next day  "
-                    "\n3. Access help  "
-                    "\n4. Restart the game  "
-                    "\n5. Exit the game:"
-                    "\nChoose: (zone/next/help/restart/exit):  "
+                    "\n1. Build a zone  2. Build an area  "
+                    "3. Go to the next day"
+                    "\n4. Get a hint  5. Access help  6. Restart the game"
+                    "\n7. Exit the game  8. Move the view"
+                    "\nChoose: (zone/area/next/hint/help/restart/exit/view):  "
                 ).lower()
-                if action == 'zone':
-                    if handle_zone_action(grid, player_resources, metrics):
-                        zones_built_today += 1
-                    clear_screen()
-                    print("McGee Metropolis City Map:")
-                    print_grid(grid)
-                    print("\nCurrent Resources and Metrics:")
-                    print_resources(player_resources)
-                    print_metrics(metrics)
-                elif action == 'next':
-                    current_day += 1  # Increment the day counter
-                    zones_built_today = 0  # Reset the counter for the new day
-                elif action == 'restart':
-                    if confirm_restart():  # Confirm restart decision
-                        print("Restarting the game.")
-                        (
-                            grid, total_daily_income, player_resources,
-                            metrics, events, current_day
-                        ) = start_new_game(reset_resources=True)
-                        last_event = None
-                        game_over = False
-                        break
-                elif action == 'help':
-                    print_help()
-                elif action == 'exit':
-                    if confirm_exit():
-                        if show_goodbye_message():
-                            reset_resources_to_default()  # Reset resources
-                            return
-                else:
-                    print(
-                        "Invalid. Choose 'zone', 'next', 'restart', "
-                        "'help', or 'exit'."
-                    )
             else:
-                print("Max number of zones built today.")
                 action = input(
-                    "\nPress 'next' to move to the next day or 'exit' to "
-                    "exit the game: "
+                    "\nChoose the action you would like to take:"
+                    "\n1. Build a zone  2. Build an area  "
+                    "3. Go to the next day"
+                    "\n4. Get a hint  5. Access help  6. Restart the game"
+                    "\n7. Exit the game"
+                    "\nChoose: (zone/area/next/hint/help/restart/exit):  "
                 ).lower()
-                if action == 'next':
-                    current_day += 1  # Increment the day counter
-                    zones_built_today = 0  # Reset the counter for the new day
-                elif action == 'exit':
-                    if confirm_exit():
-                        if show_goodbye_message():
-                            reset_resources_to_default()  # Reset resources
-                            return
-            update_resources_in_sheet(player_resources)
-        if game_over or current_day > 30:
-            money_goal_met = (
-                player_resources['Money']['Current Value'] >= monetary_goal
-            )
-            metrics_goal_met = all(
-                value >= min_metrics[metric]
-                for metric, value in metrics.items()
-            )
-            if money_goal_met and metrics_goal_met:
-                print("Congratulations! You have won!")
+            if action == 'zone':
+                messages = handle_zone_action(state)
+            elif action == 'area':
+                messages = handle_area_action(state)
+            elif action == 'next':
+                messages = SESSION.journal.step(('next',))
+            elif action == 'hint':
+                messages = handle_hint_action(state)
+            elif action == 'restart':
+                if confirm_restart():  # Confirm restart decision
+                    print("Restarting the game.")
+                    return False
+            elif action == 'help':
+                print_help(state)
+            elif action == 'exit':
+                if leave_game():
+                    return False
+            elif action == 'view' and state.size > VIEW_SIZE:
+                handle_view_action(state)
             else:
-                print("Unfortunately, you have lost this time.")
-            while True:  # Prompt to restart or exit
-                action = input(
-                    "\nThe game is over, please choose (restart/exit): "
-                ).lower()
-                if action == 'restart':
-                    if confirm_restart():  # Confirm restart decision
-                        print("Restarting the game.")
-                        (
-                            grid, total_daily_income, player_resources,
-                            metrics, events, current_day
-                        ) = start_new_game(reset_resources=True)
-                        last_event = None
-                        game_over = False
-                        break
-                    elif action == 'exit':
-                        if confirm_exit():
-                            if show_goodbye_message():
-                                reset_resources_to_default()
-                                return
-                    else:
-                        print("Invalid input. Type 'restart' or 'exit'.")
-                if game_over:
-                    break  # Exit the outer while loop and end the game
-    show_intro()  # Show introduction and instructions
+                messages = [
+                    "Invalid. Choose 'zone', 'area', 'next', 'hint', "
+                    "'restart', 'help', or 'exit'."
+                ]
+        else:
+            print("Max number of zones built today.")
+            action = input(
+                "\nPress 'next' to move to the next day or 'exit' to "
+                "exit the game: "
+            ).lower()
+            if action == 'next':
+                messages = SESSION.journal.step(('next',))
+            elif action == 'exit':
+                if leave_game():
+                    return False
+        update_resources_in_sheet(state.player_resources)
+        if state.day != today:
+            STORAGE.flush()  # Persist resources at the day boundary
+    print_city(state, messages)
+    return True
+
+
+def resume_game():
+    """
+    Offer to resume the game the player was last disconnected from.
+    Returns: GameState: The resumed game, or None to start a new one.
+    """
+    snapshot = SESSION.snapshots.load()
+    if snapshot is None:
+        return None
+    try:
+        state = SESSION.journal.resume_game(
+            snapshot, fetch_zone_data(), fetch_events(), zones_per_day()
+        )
+    except ValueError:
+        SESSION.snapshots.clear()  # A damaged snapshot can't be resumed
+        return None
+    if state.is_over:
+        SESSION.snapshots.clear()
+        return None
+    while True:
+        choice = input(
+            Colour.BOLD +
+            f"\nWelcome back! Resume your game from day {state.day}? "
+            "(yes/no): " + Colour.ENDC
+        ).strip().lower()
+        if choice == 'yes':
+            clear_screen()
+            return state
+        elif choice == 'no':
+            SESSION.snapshots.clear()
+            clear_screen()
+            return None
+        else:
+            print("Invalid input. Please type 'yes' or 'no'.")
+
+
+def main(session_id=None):
+    """
+    Main function to run the game.
+    Initialises the game, handles the main game loop, and manages game state.
+    Args: session_id (str): Names the player's resources and snapshots,
+        SESSION_ID from the environment if None.
+    """
+    if session_id is not None:
+        SESSION.name = session_name(session_id)
+        SESSION.snapshots = open_snapshots(SESSION.name)
+    with capture(SESSION.name):  # Under cProfile if CPROFILE_SESSION is set
+        try:
+            play_session()
+        finally:
+            # Exited or disconnected; a resumed game restores its resources
+            # from the snapshot
+            release_resources()
+
+
+def play_session():
+    """
+    Play games until the player exits, offering first to resume the game
+    they were disconnected from.
+    """
+    state = resume_game()
+    if state is None:
+        show_intro()  # Show introduction and instructions at the start
+    while True:
+        if state is None:
+            state = start_new_game()
+        ended = play_day_loop(state)
+        SESSION.snapshots.clear()
+        state = None
+        if not ended:
+            continue
+        save_resources()  # Make sure the final resources are stored
+        while True:  # Prompt to restart or exit
+            action = input(
+                "\nThe game is over, please choose (restart/exit): "
+            ).lower()
+            if action == 'restart':
+                if confirm_restart():  # Confirm restart decision
+                    print("Restarting the game.")
+                    break
+            elif action == 'exit':
+                if leave_game():
+                    break
+            else:
+                print("Invalid input. Type 'restart' or 'exit'.")
 
 
 if __name__ == "__main__":
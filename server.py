@@ -0,0 +1,243 @@
+"""
+Game server for McGee Metropolis. Hosts many game sessions in one process,
+so a new player doesn't pay for starting Python, importing the storage
+libraries and authorising with Google: every session shares the storage
+connection and the cached zones and events of run.py.
+
+The web terminal connects to the server over TCP once per websocket. The
+client sends one line with the browser's session ID, which may be empty,
+then the two sides exchange raw terminal bytes as they would over a pty:
+keystrokes in, text and ANSI escape codes out. The server echoes keys and
+edits lines as a terminal would. Each session plays run.main() in its own
+thread, with sys.stdin and sys.stdout passed to the session of the calling
+thread.
+
+Usage: python server.py --port 8765
+"""
+import argparse
+import asyncio
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+import traceback
+
+# Browser terminals are 80x24, and this is read when frames are drawn
+os.environ.setdefault('COLUMNS', '80')
+os.environ.setdefault('LINES', '24')
+
+import run  # noqa: E402, the terminal size must be set first
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+CURRENT = threading.local()  # The session played by the calling thread
+
+
+class TerminalSession:
+    """
+    One connected player. Keystrokes arrive on the event loop and are
+    edited into lines, as a terminal in canonical mode would, for the game
+    thread to read. Text the game writes is sent back through the loop.
+    """
+
+    def __init__(self, loop, writer):
+        """
+        Args:
+            loop (asyncio.AbstractEventLoop): The server's event loop.
+            writer (asyncio.StreamWriter): The connection to the player.
+        """
+        self.loop = loop
+        self.writer = writer
+        self.lines = queue.Queue()  # Finished lines for the game thread
+        self.buffer = []  # The line being typed
+        self.last = ''  # The last character received
+        self.escape = False  # In an escape sequence, such as an arrow key
+        self.typing = False  # Text is being typed out, keys skip it
+        self.key = threading.Event()
+        self.connected_at = time.perf_counter()
+        self.first_output = None  # Seconds from connecting to first output
+
+    def receive(self, data):
+        """
+        Handle keystrokes from the player. Called on the event loop.
+        Args: data (bytes): The bytes received.
+        """
+        if self.typing:
+            self.key.set()  # Swallow the key, it only skips the typing
+            return
+        for char in data.decode('utf-8', 'replace'):
+            if self.escape:
+                self.escape = not char.isalpha() and char != '~'
+            elif char == '\x1b':
+                self.escape = True
+            elif char == '\n' and self.last == '\r':
+                pass  # The second half of a CR LF line ending
+            elif char in '\r\n':
+                self.send('\r\n')
+                self.lines.put(''.join(self.buffer) + '\n')
+                self.buffer = []
+            elif char in '\x7f\b':
+                if self.buffer:
+                    self.buffer.pop()
+                    self.send('\b \b')
+            elif char.isprintable():
+                self.buffer.append(char)
+                self.send(char)
+            self.last = char
+
+    def send(self, text):
+        """
+        Send text to the player. Called on the event loop.
+        Args: text (str): The text, with terminal line endings.
+        """
+        if not self.writer.is_closing():
+            self.writer.write(text.encode('utf-8'))
+
+    def hang_up(self):
+        """
+        End the game thread's input, as the player has disconnected.
+        """
+        self.lines.put(None)
+        self.key.set()
+
+    # The rest is called by the game thread, through sys.stdin and stdout
+
+    def write(self, text):
+        if self.first_output is None:
+            self.first_output = time.perf_counter() - self.connected_at
+        self.loop.call_soon_threadsafe(self.send, text.replace('\n', '\r\n'))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        line = self.lines.get()
+        if line is None:
+            self.lines.put(None)  # Every later read is at the end too
+            return ''
+        return line
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        pass  # exit() closes sys.stdin, which only ends this session
+
+    def wait_for_key(self, seconds):
+        """
+        Wait for a keypress while text is typed out.
+        Args: seconds (float): The longest time to wait.
+        Returns: bool: True if a key was pressed.
+        """
+        self.typing = True
+        try:
+            pressed = self.key.wait(seconds)
+            self.key.clear()
+            return pressed
+        finally:
+            self.typing = False
+
+
+class SessionStream:
+    """
+    Stands in for sys.stdin or sys.stdout, passing every use to the
+    session of the calling thread, or to the real stream outside sessions.
+    """
+
+    def __init__(self, fallback):
+        """
+        Args: fallback (file): The real stream.
+        """
+        self.fallback = fallback
+
+    def __getattr__(self, name):
+        return getattr(getattr(CURRENT, 'session', None) or self.fallback,
+                       name)
+
+
+def play(session, session_id):
+    """
+    Play the game for one session, in its own thread.
+    Args:
+        session (TerminalSession): The player.
+        session_id (str): Names the player's snapshots.
+    """
+    CURRENT.session = session
+    try:
+        run.main(session_id)
+    except (EOFError, SystemExit):
+        pass  # The player left or disconnected
+    except Exception:
+        traceback.print_exc(file=sys.__stderr__)
+    finally:
+        session.loop.call_soon_threadsafe(session.writer.close)
+
+
+async def handle_connection(reader, writer):
+    """
+    Start a session for a new connection and feed it keystrokes until the
+    player disconnects.
+    Args:
+        reader (asyncio.StreamReader): Bytes from the player.
+        writer (asyncio.StreamWriter): Bytes to the player.
+    """
+    session = TerminalSession(asyncio.get_running_loop(), writer)
+    line = await reader.readline()
+    # Without an ID from the browser, the session can't be resumed later
+    session_id = line.decode('utf-8', 'replace').strip() or (
+        secrets.token_hex(8)
+    )
+    threading.Thread(
+        target=play, args=(session, session_id), daemon=True
+    ).start()
+    try:
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                break
+            session.receive(data)
+    except ConnectionError:
+        pass
+    finally:
+        session.hang_up()
+        if session.first_output is not None:
+            print(f"Session ended, first output after "
+                  f"{session.first_output * 1000:.1f} ms",
+                  file=sys.__stderr__)
+
+
+async def serve(host, port):
+    """
+    Accept connections until the process is stopped.
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+    """
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f"Game server listening on {host}:{port}", file=sys.__stderr__)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """
+    Parse the command line and run the server.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    sys.stdin = SessionStream(sys.stdin)
+    sys.stdout = SessionStream(sys.stdout)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Monte Carlo balance simulator for McGee Metropolis. Plays many seeded games
+headlessly with a build policy across a pool of worker processes and
+reports the win rate, the distribution of money at the end of the game and
+why games were lost.
+
+Usage: python simulate.py --games 10000 --policy balanced --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+import numpy as np
+from engine import (
+    EMPTY, GAME_DAYS, GRID_SIZE, MAX_GRID_SIZE, MAX_ZONES_PER_DAY,
+    METRIC_LIMITS, MONETARY_GOAL, ZONES_PER_DAY_LIMIT, GameState,
+    default_resources, parse_events, parse_zone_data
+)
+from storage import open_storage
+from zones import ZONE_RULES
+
+GAMES_PER_TASK = 250  # Games played by a worker before reporting back
+RANDOM_CELL_TRIES = 8  # Random cells tried before scanning for an empty one
+
+
+def random_empty_cell(state, rng):
+    """
+    Pick a random empty cell of the grid.
+    Args:
+        state (GameState): The game.
+        rng (random.Random): The policy's random number generator.
+    Returns: tuple: The (x, y) of the cell, or None if the grid is full.
+    """
+    if state.ledger.counts[EMPTY] == 0:
+        return None
+    # Most of the grid is usually empty, so a few random tries find a cell
+    # without scanning the grid, which matters on large maps
+    for _ in range(RANDOM_CELL_TRIES):
+        x, y = rng.randrange(state.size), rng.randrange(state.size)
+        if state.grid[x, y] == EMPTY:
+            return x, y
+    cells = np.flatnonzero(state.grid[:, :] == EMPTY)
+    return divmod(int(cells[rng.randrange(len(cells))]), state.size)
+
+
+def idle_policy(state, rng):
+    """
+    Never build, only move to the next day.
+    """
+    return ('next',)
+
+
+def random_policy(state, rng):
+    """
+    Build a random affordable zone on a random empty cell, up to the daily
+    limit, then move to the next day.
+    """
+    if state.zones_built_today >= state.zones_per_day:
+        return ('next',)
+    affordable = [
+        zone_type for zone_type in ZONE_RULES
+        if state.zones.cost(zone_type) <= state.money
+    ]
+    cell = random_empty_cell(state, rng)
+    if not affordable or cell is None:
+        return ('next',)
+    return ('build', *cell, rng.choice(affordable))
+
+
+def balanced_policy(state, rng):
+    """
+    Build to keep every metric clear of its limit, otherwise build the
+    Commercial zones that grow money fastest, up to the daily limit.
+    """
+    if state.zones_built_today >= state.zones_per_day:
+        return ('next',)
+    metrics = state.metrics
+    margin = 10  # Points above a metric limit before it is protected
+    if metrics['Health'] < METRIC_LIMITS['Health'] + margin:
+        zone_type = 'Hospital'
+    elif (metrics['Happiness Index'] < METRIC_LIMITS['Happiness Index'] +
+          margin):
+        zone_type = 'School'
+    elif (metrics['Employment Rate'] < METRIC_LIMITS['Employment Rate'] +
+          margin):
+        zone_type = 'School'
+    else:
+        zone_type = 'Commercial'
+    cell = random_empty_cell(state, rng)
+    if state.zones.cost(zone_type) > state.money or cell is None:
+        return ('next',)
+    return ('build', *cell, zone_type)
+
+
+POLICIES = {
+    'idle': idle_policy,
+    'random': random_policy,
+    'balanced': balanced_policy
+}
+
+
+def play_game(seed, policy, zone_data, events, size=GRID_SIZE,
+              zones_per_day=MAX_ZONES_PER_DAY):
+    """
+    Play one seeded game to the end with a build policy.
+    Args:
+        seed (int): Seeds the game rules and the policy.
+        policy (function): Chooses the next action from (state, rng).
+        zone_data (ZoneCatalog): The compiled zones.
+        events (EventCatalog): The compiled events.
+        size (int): The size of the map.
+        zones_per_day (int): Zones that can be built in a day.
+    Returns: GameState: The finished game.
+    """
+    rng = random.Random(seed)
+    state = GameState(
+        zone_data, events, default_resources(), size=size, verbose=False,
+        rng=random.Random(seed), zones_per_day=zones_per_day
+    )
+    while not state.is_over:
+        state.step(policy(state, rng))
+    return state
+
+
+def run_task(task):
+    """
+    Play a batch of games in a worker and summarise them, so only small
+    results cross the process boundary.
+    Args: task (tuple): (first seed, number of games, policy name,
+        zone data, events, map size, zones per day).
+    Returns: dict: Wins, failure reasons and end-of-game money.
+    """
+    (first_seed, games, policy_name, zone_data, events, size,
+     zones_per_day) = task
+    policy = POLICIES[policy_name]
+    wins = 0
+    failures = Counter()
+    final_money = []
+    for seed in range(first_seed, first_seed + games):
+        state = play_game(
+            seed, policy, zone_data, events, size, zones_per_day
+        )
+        if state.status == 'won':
+            wins += 1
+        else:
+            failures[state.failure] += 1
+        if state.day == GAME_DAYS and state.failure in (None, 'Money'):
+            final_money.append(state.money)
+    return {'wins': wins, 'failures': failures, 'final_money': final_money}
+
+
+def percentile(values, fraction):
+    """
+    Find a percentile of sorted values by the nearest-rank method.
+    Args:
+        values (list): Sorted values.
+        fraction (float): The percentile as a fraction, 0.5 for the median.
+    Returns: float: The value, or 0.0 if there are none.
+    """
+    if not values:
+        return 0.0
+    index = min(int(fraction * len(values)), len(values) - 1)
+    return values[index]
+
+
+def simulate(games, policy_name, zone_data, events, workers=None, seed=0,
+             size=GRID_SIZE, zones_per_day=MAX_ZONES_PER_DAY):
+    """
+    Play seeded games across a process pool and aggregate the results.
+    Args:
+        games (int): The number of games to play.
+        policy_name (str): A key of POLICIES.
+        zone_data (ZoneCatalog): The compiled zones.
+        events (EventCatalog): The compiled events.
+        workers (int): Worker processes, one per CPU core if None.
+        seed (int): Seed of the first game, later games count up from it.
+        size (int): The size of the map.
+        zones_per_day (int): Zones that can be built in a day.
+    Returns: dict: The win rate, end-of-game money distribution, failure
+        reasons and games per second.
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = [
+        (start, min(GAMES_PER_TASK, seed + games - start), policy_name,
+         zone_data, events, size, zones_per_day)
+        for start in range(seed, seed + games, GAMES_PER_TASK)
+    ]
+    start_time = time.perf_counter()
+    if workers == 1:
+        results = [run_task(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(run_task, tasks, chunksize=1)
+    seconds = time.perf_counter() - start_time
+    wins = sum(result['wins'] for result in results)
+    failures = Counter()
+    final_money = []
+    for result in results:
+        failures.update(result['failures'])
+        final_money.extend(result['final_money'])
+    final_money.sort()
+    return {
+        'games': games,
+        'policy': policy_name,
+        'workers': workers,
+        'size': size,
+        'zones_per_day': zones_per_day,
+        'win_rate': wins / games if games else 0.0,
+        'monetary_goal': MONETARY_GOAL,
+        'final_money': {
+            'games_reaching_day_30': len(final_money),
+            'mean': sum(final_money) / len(final_money) if final_money else 0,
+            'p5': percentile(final_money, 0.05),
+            'p25': percentile(final_money, 0.25),
+            'p50': percentile(final_money, 0.5),
+            'p75': percentile(final_money, 0.75),
+            'p95': percentile(final_money, 0.95)
+        },
+        'failures': dict(failures.most_common()),
+        'seconds': seconds,
+        'games_per_second': games / seconds if seconds else 0.0
+    }
+
+
+def load_catalog(backend):
+    """
+    Read the zone and event data the simulated games are played with.
+    Args: backend (str): The storage backend, 'sheets' or 'sqlite'.
+    Returns: tuple: The compiled zones and events.
+    """
+    storage = open_storage(backend)
+    zone_data = parse_zone_data(storage.read_values('zones'))
+    events = parse_events(storage.read_records('events'))
+    return zone_data, events
+
+
+def print_report(report):
+    """
+    Print a simulation report as a readable summary.
+    Args: report (dict): The result of simulate().
+    """
+    money = report['final_money']
+    print(f"Policy: {report['policy']}, games: {report['games']}, "
+          f"map: {report['size']}x{report['size']}, "
+          f"workers: {report['workers']}")
+    print(f"Win rate: {report['win_rate']:.2%}")
+    print(f"Money at day {GAME_DAYS} "
+          f"({money['games_reaching_day_30']} games): "
+          f"p5 {money['p5']:.0f}, p25 {money['p25']:.0f}, "
+          f"median {money['p50']:.0f}, p75 {money['p75']:.0f}, "
+          f"p95 {money['p95']:.0f}, goal {report['monetary_goal']}")
+    print("Games lost by reason:")
+    for reason, count in report['failures'].items():
+        print(f"  {reason:<20} {count}")
+    print(f"{report['games_per_second']:.0f} games per second in "
+          f"{report['seconds']:.2f}s")
+
+
+def main():
+    """
+    Parse the command line and run the simulation.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--policy', choices=POLICIES, default='balanced')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=GRID_SIZE,
+                        help=f"The size of the map, up to {MAX_GRID_SIZE}")
+    parser.add_argument('--zones-per-day', type=int,
+                        default=MAX_ZONES_PER_DAY,
+                        help="Zones that can be built in a day")
+    parser.add_argument('--storage', choices=['sheets', 'sqlite'],
+                        default='sqlite')
+    parser.add_argument('--json', action='store_true',
+                        help="Print the report as JSON")
+    args = parser.parse_args()
+    if not 1 <= args.size <= MAX_GRID_SIZE:
+        parser.error(f"--size must be 1 to {MAX_GRID_SIZE}")
+    if not 1 <= args.zones_per_day <= ZONES_PER_DAY_LIMIT:
+        parser.error(f"--zones-per-day must be 1 to {ZONES_PER_DAY_LIMIT}")
+    zone_data, events = load_catalog(args.storage)
+    report = simulate(
+        args.games, args.policy, zone_data, events, args.workers, args.seed,
+        args.size, args.zones_per_day
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
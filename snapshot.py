@@ -0,0 +1,294 @@
+"""
+Session snapshots for McGee Metropolis. After every turn the full state of
+the game is written as a compact binary snapshot, a few hundred bytes, to
+SNAPSHOT_DIR (by default a directory in the system temp directory). The
+web terminal kills the game when its websocket closes, so a player who
+reconnects with the same SESSION_ID is offered their game back from the
+last snapshot.
+
+A snapshot is a fixed header, the grid codes, the metrics, the resources
+and the active events. Large maps store only their occupied cells. Names
+are stored with their values, so a snapshot doesn't depend on the order of
+the storage tables.
+"""
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+from engine import (
+    MAX_ZONES_PER_DAY, GameState, SparseGrid, initialize_grid
+)
+from storage import session_name
+
+MAGIC = b'MGS1'
+
+# Magic, grid size, day, zones built today, status, last event (-1 for
+# none), then the number of metrics, resources and active events
+HEADER_FORMAT = struct.Struct('<4sHHHBhBBB')
+NAME_FORMAT = struct.Struct('<B')  # Length of a UTF-8 name
+VALUE_FORMAT = struct.Struct('<d')
+RESOURCE_FORMAT = struct.Struct('<dd')  # Current value, regeneration rate
+EVENT_FORMAT = struct.Struct('<HH')  # Event index, days left
+COUNT_FORMAT = struct.Struct('<I')  # Occupied cells of a sparse grid
+CELL_FORMAT = struct.Struct('<HHB')  # x, y and zone code of a cell
+
+STATUSES = ('playing', 'won', 'lost')
+
+SNAPSHOT_DIR_NAME = 'mcgee_snapshots'
+
+
+def pack_name(name):
+    """
+    Encode a name with its length.
+    Args: name (str): The name, at most 255 bytes of UTF-8.
+    Returns: bytes: The encoded name.
+    """
+    encoded = name.encode('utf-8')
+    return NAME_FORMAT.pack(len(encoded)) + encoded
+
+
+def unpack_name(data, offset):
+    """
+    Decode a name written by pack_name().
+    Args:
+        data (bytes): The snapshot.
+        offset (int): Where the name starts.
+    Returns: tuple: The name and the offset after it.
+    """
+    (length,) = NAME_FORMAT.unpack_from(data, offset)
+    offset += NAME_FORMAT.size
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def number(value):
+    """
+    Restore a stored number, as an int if it is whole, as metrics are.
+    Args: value (float): The stored value.
+    Returns: int or float: The number.
+    """
+    return int(value) if value.is_integer() else value
+
+
+def encode_grid(grid):
+    """
+    Encode the zone codes of a grid, every cell of a dense grid or the
+    occupied cells of a sparse one.
+    Args: grid (numpy.ndarray or SparseGrid): The game grid.
+    Returns: bytes: The encoded grid.
+    """
+    if isinstance(grid, SparseGrid):
+        return COUNT_FORMAT.pack(len(grid.cells)) + b''.join(
+            CELL_FORMAT.pack(x, y, code)
+            for (x, y), code in grid.cells.items()
+        )
+    return grid.tobytes()
+
+
+def decode_grid(data, offset, size):
+    """
+    Decode a grid written by encode_grid().
+    Args:
+        data (bytes): The snapshot.
+        offset (int): Where the grid starts.
+        size (int): The size of the grid.
+    Returns: tuple: The grid and the offset after it.
+    """
+    grid = initialize_grid(size)
+    if isinstance(grid, SparseGrid):
+        (count,) = COUNT_FORMAT.unpack_from(data, offset)
+        offset += COUNT_FORMAT.size
+        for _ in range(count):
+            x, y, code = CELL_FORMAT.unpack_from(data, offset)
+            offset += CELL_FORMAT.size
+            grid[x, y] = code
+        return grid, offset
+    grid[:] = np.frombuffer(
+        data, np.int8, size * size, offset
+    ).reshape(size, size)
+    return grid, offset + size * size
+
+
+def encode_snapshot(state):
+    """
+    Encode the full state of a game.
+    Args: state (GameState): The game.
+    Returns: bytes: The snapshot.
+    """
+    events = state.events
+    last = -1 if events.last is None else events.last
+    parts = [
+        HEADER_FORMAT.pack(
+            MAGIC, state.size, state.day, state.zones_built_today,
+            STATUSES.index(state.status), last, len(state.metrics),
+            len(state.player_resources), len(events.active)
+        ),
+        pack_name(state.failure or ''),
+        encode_grid(state.grid)
+    ]
+    for name, value in state.metrics.items():
+        parts.append(pack_name(name) + VALUE_FORMAT.pack(value))
+    for name, values in state.player_resources.items():
+        parts.append(pack_name(name) + RESOURCE_FORMAT.pack(
+            values['Current Value'], values['Regeneration Rate']
+        ))
+    for index, days_left in events.active:
+        parts.append(EVENT_FORMAT.pack(index, days_left))
+    return b''.join(parts)
+
+
+def decode_snapshot(data, zone_data, events, verbose=True, rng=None,
+                    zones_per_day=MAX_ZONES_PER_DAY):
+    """
+    Rebuild a game from a snapshot.
+    Args:
+        data (bytes): The snapshot.
+        zone_data (ZoneCatalog): The compiled zones.
+        events (EventCatalog): The compiled events.
+        verbose (bool): Whether to collect messages for the player.
+        rng (random.Random): Draws the events from now on.
+        zones_per_day (int): Zones that can be built in a day.
+    Returns: GameState: The game.
+    Raises: ValueError: If the data isn't a valid snapshot.
+    """
+    try:
+        (magic, size, day, zones_built_today, status, last, metric_count,
+         resource_count, event_count) = HEADER_FORMAT.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a McGee Metropolis snapshot.")
+        failure, offset = unpack_name(data, HEADER_FORMAT.size)
+        grid, offset = decode_grid(data, offset, size)
+        metrics = {}
+        for _ in range(metric_count):
+            name, offset = unpack_name(data, offset)
+            (value,) = VALUE_FORMAT.unpack_from(data, offset)
+            offset += VALUE_FORMAT.size
+            metrics[name] = number(value)
+        player_resources = {}
+        for _ in range(resource_count):
+            name, offset = unpack_name(data, offset)
+            current_value, regeneration_rate = RESOURCE_FORMAT.unpack_from(
+                data, offset
+            )
+            offset += RESOURCE_FORMAT.size
+            player_resources[name] = {
+                'Current Value': current_value,
+                'Regeneration Rate': regeneration_rate
+            }
+        active = []
+        for _ in range(event_count):
+            index, days_left = EVENT_FORMAT.unpack_from(data, offset)
+            offset += EVENT_FORMAT.size
+            if index < len(events):  # Skip events no longer in the table
+                active.append([index, days_left])
+        status = STATUSES[status]
+    except (struct.error, UnicodeDecodeError, IndexError) as e:
+        raise ValueError(f"Invalid snapshot: {e}") from e
+    return GameState.restore(
+        zone_data, events, grid, player_resources, metrics, day,
+        zones_built_today, active,
+        last if 0 <= last < len(events) else None,
+        status, failure or None, verbose, rng, zones_per_day
+    )
+
+
+class SnapshotStore:
+    """
+    Keeps the latest snapshot of one session in a file, replaced
+    atomically on each save so a killed process never leaves half a
+    snapshot behind. Save timings are kept for stats().
+    """
+
+    def __init__(self, path):
+        """
+        Args: path (str): The snapshot file, or None to keep no snapshots.
+        """
+        self.path = path
+        self.saves = 0
+        self.last_bytes = 0
+        self.save_seconds = 0.0
+        self.max_save_seconds = 0.0
+
+    def save(self, state):
+        """
+        Write a snapshot of a game in place of the last one.
+        Args: state (GameState): The game.
+        """
+        if self.path is None:
+            return
+        start = time.perf_counter()
+        data = encode_snapshot(state)
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, 'wb') as snapshot_file:
+                snapshot_file.write(data)
+            os.replace(temporary, self.path)
+        except OSError:
+            return  # A lost snapshot only means the game can't be resumed
+        seconds = time.perf_counter() - start
+        self.saves += 1
+        self.last_bytes = len(data)
+        self.save_seconds += seconds
+        self.max_save_seconds = max(self.max_save_seconds, seconds)
+
+    def load(self):
+        """
+        Read the last snapshot saved.
+        Returns: bytes: The snapshot, or None if there is none.
+        """
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, 'rb') as snapshot_file:
+                return snapshot_file.read()
+        except OSError:
+            return None
+
+    def clear(self):
+        """
+        Remove the snapshot, once its game has ended or been abandoned.
+        """
+        if self.path is None:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def stats(self):
+        """
+        Report the size and write latency of the snapshots saved.
+        Returns: dict: Saves, the size of the last snapshot in bytes and
+            the mean and max save time in milliseconds.
+        """
+        return {
+            'saves': self.saves,
+            'last_bytes': self.last_bytes,
+            'mean_save_ms': (
+                self.save_seconds / self.saves * 1000 if self.saves else 0.0
+            ),
+            'max_save_ms': self.max_save_seconds * 1000
+        }
+
+
+def open_snapshots(session=None):
+    """
+    Open the snapshot store of a session. The web terminal names sessions
+    from the browser, and a plain terminal is the 'local' session.
+    Args: session (str): The session ID, the SESSION_ID environment
+        variable if None.
+    Returns: SnapshotStore: The store, keeping no snapshots if SNAPSHOT_DIR
+        is empty or can't be written to.
+    """
+    directory = os.environ.get(
+        'SNAPSHOT_DIR',
+        os.path.join(tempfile.gettempdir(), SNAPSHOT_DIR_NAME)
+    )
+    session = session_name(session)
+    if not directory:
+        return SnapshotStore(None)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return SnapshotStore(None)
+    return SnapshotStore(os.path.join(directory, f"{session}.mgs"))
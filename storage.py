@@ -0,0 +1,1139 @@
+"""
+Storage backends for McGee Metropolis. The game reads its zones, resources
+and events tables through one of these backends: the Google Sheet used by
+the live game, or a local SQLite database holding the same tables so the
+game can run offline with no network round trips.
+The backend is chosen with the STORAGE_BACKEND environment variable
+('sheets', 'sqlite' or 'memory', which keeps nothing between runs), and
+STORAGE_PATH sets the SQLite database file.
+Reads of the static zones and events tables from Google Sheets are cached
+on local disk for CACHE_TTL seconds (0 disables the cache) in CACHE_DIR.
+Resource writes are queued and written behind the game by a background
+worker every FLUSH_INTERVAL seconds, or sooner when a flush is requested.
+Each session keeps its own resource rows, named in the 'Session' column,
+and the rows with no session hold the starting resources.
+Every Google Sheets request goes through one RequestScheduler, which keeps
+within SHEETS_QUOTA requests a minute and retries rate limited requests.
+"""
+import atexit
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from profiling import timer
+
+SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive"
+]
+
+SPREADSHEET_NAME = 'McGee_Metropolis'
+DEFAULT_DB_PATH = 'mcgee_metropolis.db'
+DEFAULT_CACHE_TTL = 3600  # Seconds before cached catalog data is revalidated
+CACHE_FILE_NAME = 'mcgee_metropolis_catalog.json'
+DEFAULT_FLUSH_INTERVAL = 5  # Seconds between write-behind flushes
+DEFAULT_SHEETS_QUOTA = 60  # Sheets requests a minute, the per-user quota
+SHEETS_BURST = 10  # Requests that can be sent at once after a quiet spell
+MAX_RETRIES = 5  # Retries of a rate limited or failed request
+BASE_BACKOFF = 1.0  # Seconds before the first retry, doubled each time
+MAX_BACKOFF = 32.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Request priorities, lower first: a player waits on interactive reads,
+# while background writes can wait for quota
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Reference data that only changes when the game is retuned
+CATALOG_TABLES = ('zones', 'events')
+
+DEFAULT_SESSION = 'local'  # The session of a game played in a terminal
+TEMPLATE_SESSION = ''  # Resource rows read by a session with none of its own
+# Marks Google Sheet resource rows released by an ended session, for reuse.
+# session_name() never makes it, so no session can own these rows.
+RELEASED_SESSION = '*'
+
+# Header row of each table, in the same order as the Google Sheet columns
+TABLE_COLUMNS = {
+    'zones': ['Zone Type', 'Count', 'Income'],
+    'resources': [
+        'Resource Type', 'Current Value', 'Regeneration Rate', 'Session'
+    ],
+    'events': ['Description', 'Impact Type', 'Impact Value', 'Duration']
+}
+
+# Rows used to seed a new local database, matching the live Google Sheet
+SEED_ROWS = {
+    'zones': [
+        ('Residential', '10', '250'),
+        ('Commercial', '5', '100'),
+        ('Industrial', '3', '75'),
+        ('School', '2', '20'),
+        ('Hospital', '2', '30')
+    ],
+    'resources': [
+        ('Money', 10000, 0, TEMPLATE_SESSION),
+        ('Water', 500, 5, TEMPLATE_SESSION),
+        ('Electricity', 500, 5, TEMPLATE_SESSION)
+    ],
+    'events': [
+        ('Drought', 'a water supply reduction', '-15.00%', 3),
+        ('Power Outage', 'an electricity supply reduction', '-20.00%', 2),
+        ('Recession', 'an income reduction', '-10.00%', 2),
+        ('Heatwave', 'a water supply reduction', '-10.00%', 2),
+        ('Storm Damage', 'an electricity supply reduction', '-50', 1),
+        ('Tax Audit', 'an income reduction', '-500', 1)
+    ]
+}
+
+
+class StorageError(Exception):
+    """
+    Raised when a storage backend fails to read or write game data.
+    """
+
+
+def session_name(session=None):
+    """
+    Make a session ID safe to use in file names and storage rows.
+    Args: session (str): The session ID, the SESSION_ID environment
+        variable if None.
+    Returns: str: The session name, DEFAULT_SESSION if it is empty.
+    """
+    if session is None:
+        session = os.environ.get('SESSION_ID', '')
+    return re.sub(r'[^A-Za-z0-9-]', '', session)[:64] or DEFAULT_SESSION
+
+
+def resource_records(rows):
+    """
+    Turn rows of resource values into records, as read_records() returns.
+    Args: rows (list): Rows of resource type, current value and
+        regeneration rate.
+    Returns: list: A list of dictionaries, one per resource.
+    """
+    columns = TABLE_COLUMNS['resources'][:3]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def appended_row(response):
+    """
+    Find the first row written by a Google Sheets append.
+    Args: response (dict): The reply to the append request.
+    Returns: int: The row number of the first appended row.
+    Raises: StorageError: If the reply doesn't give the appended range.
+    """
+    try:
+        updated_range = response['updates']['updatedRange']
+        return int(re.search(r'!\D+(\d+)', updated_range).group(1))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise StorageError(
+            f"Unexpected reply to appending resources: {response!r}"
+        ) from e
+
+
+class RequestScheduler:
+    """
+    Sends requests within a quota. A token bucket holds up to burst
+    requests and refills at rate requests a second, and requests waiting
+    for a token are served by priority, then in order. A request that fails
+    with a retryable error is retried after a jittered exponential backoff,
+    and a rate limit also empties the bucket so other requests slow down.
+    Identical reads in flight at the same time are sent once, and every
+    caller gets the same result, which must not be changed.
+    """
+
+    def __init__(self, rate, burst=SHEETS_BURST, retries=MAX_RETRIES,
+                 retryable=None):
+        """
+        Args:
+            rate (float): Requests a second the quota allows.
+            burst (int): The most requests sent at once.
+            retries (int): Retries of a failed request before giving up.
+            retryable (function): Takes an error and returns True if the
+                request should be retried, None to never retry.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.retryable = retryable or (lambda error: False)
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.waiting = []  # Heap of (priority, order) of waiting requests
+        self.order = itertools.count()
+        self.in_flight = {}  # Futures of the reads being sent, by key
+        self.condition = threading.Condition()
+        self.counts = {'requests': 0, 'retries': 0, 'deduplicated': 0}
+        self.wait_seconds = 0.0  # Total time spent waiting for quota
+
+    def call(self, function, key=None, priority=INTERACTIVE):
+        """
+        Send a request through the scheduler.
+        Args:
+            function (function): Sends the request and returns its result.
+            key (tuple): Identifies a read, so identical reads in flight are
+                sent once. None for writes.
+            priority (int): INTERACTIVE or BACKGROUND.
+        Returns: The result of the request.
+        """
+        if key is None:
+            return self.send(function, priority)
+        with self.condition:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+            else:
+                self.counts['deduplicated'] += 1
+        if not owner:
+            return future.result()
+        try:
+            result = self.send(function, priority)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.condition:
+                del self.in_flight[key]
+
+    def send(self, function, priority):
+        """
+        Send a request when the quota allows, retrying it if it fails with
+        a retryable error.
+        Args:
+            function (function): Sends the request and returns its result.
+            priority (int): INTERACTIVE or BACKGROUND.
+        Returns: The result of the request.
+        """
+        for attempt in range(self.retries + 1):
+            self.acquire(priority)
+            try:
+                return function()
+            except Exception as e:
+                if attempt == self.retries or not self.retryable(e):
+                    raise
+                if getattr(e, 'code', None) == 429:
+                    with self.condition:
+                        self.tokens = min(self.tokens, 0.0)
+                with self.condition:
+                    self.counts['retries'] += 1
+                # Full jitter, so retrying sessions don't stampede together
+                time.sleep(random.uniform(
+                    0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+                ))
+
+    def acquire(self, priority):
+        """
+        Wait for a token, after every waiting request of a higher priority
+        and every earlier request of the same priority.
+        Args: priority (int): INTERACTIVE or BACKGROUND.
+        """
+        start = time.monotonic()
+        with self.condition:
+            ticket = (priority, next(self.order))
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst,
+                    self.tokens + (now - self.refilled_at) * self.rate
+                )
+                self.refilled_at = now
+                if self.waiting[0] != ticket:
+                    self.condition.wait()  # Woken when the head is served
+                elif self.tokens >= 1:
+                    heapq.heappop(self.waiting)
+                    self.tokens -= 1
+                    self.counts['requests'] += 1
+                    self.wait_seconds += now - start
+                    self.condition.notify_all()
+                    return
+                else:
+                    self.condition.wait((1 - self.tokens) / self.rate)
+
+    def stats(self):
+        """
+        Report the requests sent, retried and deduplicated, and the time
+        spent waiting for quota.
+        Returns: dict: The counts, and the total wait in milliseconds.
+        """
+        with self.condition:
+            return dict(
+                self.counts, waiting=len(self.waiting),
+                wait_ms=self.wait_seconds * 1000
+            )
+
+
+class SheetsStorage:
+    """
+    Storage backend reading and writing the 'McGee_Metropolis' Google Sheet.
+    Importing gspread and google-auth, authorising and opening the sheet
+    all happen on a background thread started on creation, so the game can
+    show its intro straight away. Data calls wait for the connection only
+    if it is not ready yet. Every request goes through the scheduler.
+    """
+    # Replaced by gspread's GSpreadException once gspread is imported
+    api_error = StorageError
+
+    def __init__(self, creds_file='creds.json', quota=DEFAULT_SHEETS_QUOTA):
+        self.creds_file = creds_file
+        self.scheduler = RequestScheduler(
+            quota / 60, retryable=self.is_retryable
+        )
+        self.gspread = None
+        self.spreadsheet = None
+        self.connect_error = None
+        self.connect_seconds = None  # Time taken to import and authorise
+        self.connected = threading.Event()
+        self.worksheets = {}  # Worksheet handles, fetched once per session
+        self.resource_rows = None  # Row of each session's resources
+        self.free_rows = []  # Rows released by ended sessions
+        self.index_lock = threading.Lock()
+        threading.Thread(target=self.connect, daemon=True).start()
+
+    def connect(self):
+        """
+        Import the Google client libraries, authorise with the service
+        account credentials and open the spreadsheet.
+        """
+        start = time.perf_counter()
+        try:
+            import gspread
+            from google.oauth2.service_account import Credentials
+            from gspread.exceptions import GSpreadException
+            self.gspread = gspread
+            self.api_error = GSpreadException
+            creds = Credentials.from_service_account_file(self.creds_file)
+            scoped_creds = creds.with_scopes(SCOPE)
+            client = gspread.authorize(scoped_creds)
+            self.spreadsheet = self.request(
+                'open', lambda: client.open(SPREADSHEET_NAME)
+            )
+        except Exception as e:  # Reported on the first data call
+            self.connect_error = e
+        finally:
+            self.connect_seconds = time.perf_counter() - start
+            self.connected.set()
+
+    def is_retryable(self, error):
+        """
+        Check whether a failed request is worth retrying: rate limits,
+        server errors and dropped connections are.
+        Args: error (Exception): The error the request raised.
+        Returns: bool: True if the request should be retried.
+        """
+        return (
+            getattr(error, 'code', None) in RETRY_STATUSES or
+            isinstance(error, OSError)
+        )
+
+    def request(self, name, function, key=None, priority=INTERACTIVE):
+        """
+        Send a request through the scheduler, timing it under
+        'sheets.<name>' when profiling.
+        Args:
+            name (str): What the request does, naming its timings.
+            function (function): Sends the request and returns its result.
+            key (tuple): Identifies a read, so identical reads are sent
+                once. None for writes.
+            priority (int): INTERACTIVE or BACKGROUND.
+        Returns: The result of the request.
+        Raises: StorageError: If the request fails.
+        """
+        try:
+            with timer(f'sheets.{name}'):
+                return self.scheduler.call(function, key, priority)
+        except (self.api_error, OSError) as e:
+            raise StorageError(e) from e
+
+    @property
+    def sheet(self):
+        """
+        The opened spreadsheet, waiting for the background connection if it
+        has not finished yet.
+        """
+        self.connected.wait()
+        if self.connect_error:
+            raise StorageError(
+                f"Could not connect to Google Sheets: {self.connect_error}"
+            )
+        return self.spreadsheet
+
+    def get_worksheet(self, name):
+        """
+        Fetch a worksheet by name, caching the handle so that later calls
+        don't repeat the spreadsheet metadata request.
+        Args: name (str): The title of the worksheet.
+        Returns: gspread.Worksheet: The worksheet handle.
+        """
+        if name not in self.worksheets:
+            sheet = self.sheet
+            self.worksheets[name] = self.request(
+                'worksheet', lambda: sheet.worksheet(name), ('worksheet', name)
+            )
+        return self.worksheets[name]
+
+    def read_values(self, table):
+        """
+        Read every row of a table as strings, including the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of rows, each a list of cell strings.
+        """
+        worksheet = self.get_worksheet(table)
+        return self.request(
+            'read_values', worksheet.get_all_values, ('values', table)
+        )
+
+    def read_records(self, table):
+        """
+        Read a table as a list of dictionaries keyed by the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of dictionaries, one per row.
+        """
+        worksheet = self.get_worksheet(table)
+        return self.request(
+            'read_records', worksheet.get_all_records, ('records', table)
+        )
+
+    def version(self):
+        """
+        Fetch the spreadsheet's Drive modifiedTime, a single cheap request
+        used to revalidate cached data.
+        Returns: str: The last modified time of the spreadsheet.
+        """
+        sheet = self.sheet
+        return self.request(
+            'version', sheet.get_lastUpdateTime, ('version',)
+        )
+
+    def resource_index(self, resources_sheet):
+        """
+        Read the 'resources' worksheet once and cache the row of each
+        resource of each session, and the rows free for reuse, so later
+        reads and writes go straight to their rows. Called with index_lock
+        held.
+        Args: resources_sheet (gspread.Worksheet): The 'resources' worksheet.
+        Returns: dict: Session names mapped to resource types mapped to the
+            row number. The starting resources are under TEMPLATE_SESSION.
+        """
+        if self.resource_rows is None:
+            data = self.request(
+                'read_values', resources_sheet.get_all_values,
+                ('values', 'resources')
+            )
+            if data and len(data[0]) < len(TABLE_COLUMNS['resources']):
+                # Name the session column of a sheet from before sessions
+                self.request('add_session_column', lambda: (
+                    resources_sheet.update(
+                        values=[TABLE_COLUMNS['resources']],
+                        range_name='A1', raw=False
+                    )
+                ))
+            rows = {}
+            free_rows = []
+            for row_index, row in enumerate(data[1:], start=2):  # Skip header
+                session = row[3] if len(row) > 3 else TEMPLATE_SESSION
+                if session == RELEASED_SESSION:
+                    free_rows.append(row_index)
+                elif row and row[0]:
+                    rows.setdefault(session, {}).setdefault(row[0], row_index)
+            self.resource_rows = rows
+            self.free_rows = free_rows
+        return self.resource_rows
+
+    def forget_resource_rows(self):
+        """
+        Drop the cached rows after a failed write, which may have left the
+        sheet and the cache disagreeing, so the next call reads them again.
+        """
+        with self.index_lock:
+            self.resource_rows = None
+            self.free_rows = []
+
+    def read_resources(self, session):
+        """
+        Read the resources of a session in a single request, or the
+        starting resources if the session has none yet.
+        Args: session (str): The session name.
+        Returns: list: A list of dictionaries, one per resource.
+        """
+        resources_sheet = self.get_worksheet('resources')
+        with self.index_lock:
+            index = self.resource_index(resources_sheet)
+            rows = index.get(session) or index.get(TEMPLATE_SESSION, {})
+            rows = tuple(sorted(rows.values()))
+        if not rows:
+            return []
+        ranges = self.request(
+            'read_resources', lambda: resources_sheet.batch_get(
+                [f"A{row}:C{row}" for row in rows]
+            ),
+            ('resources', rows)
+        )
+        return resource_records(
+            value_range[0] for value_range in ranges if value_range
+        )
+
+    def write_resources(self, batch):
+        """
+        Write the resources of every session in the batch: the rows already
+        in the sheet, and the rows of new sessions taking over released
+        rows, in one batched update, and any other rows of new sessions in
+        one append. Only the write-behind worker writes, so these are
+        background requests.
+        Args:
+            batch (dict): Session names mapped to resource types mapped to
+            a tuple of (current value, regeneration rate).
+        Raises: StorageError: If a request fails, or the append reply
+            doesn't say where the rows went.
+        """
+        resources_sheet = self.get_worksheet('resources')
+        updates = []
+        new_keys = []
+        new_rows = []
+        with self.index_lock:
+            index = self.resource_index(resources_sheet)
+            for session, resources in batch.items():
+                for resource_type, values in resources.items():
+                    row = index.get(session, {}).get(resource_type)
+                    if row is not None:
+                        # Current value and regeneration rate, B and C
+                        updates.append({
+                            'range': f"B{row}:C{row}",
+                            'values': [list(values)]
+                        })
+                    elif self.free_rows:
+                        row = self.free_rows.pop()
+                        index.setdefault(session, {})[resource_type] = row
+                        updates.append({
+                            'range': f"A{row}:D{row}",
+                            'values': [[resource_type, *values, session]]
+                        })
+                    else:
+                        new_keys.append((session, resource_type))
+                        new_rows.append([resource_type, *values, session])
+        try:
+            if updates:
+                self.request(
+                    'update_resources',
+                    lambda: resources_sheet.batch_update(updates, raw=False),
+                    priority=BACKGROUND
+                )
+            if new_rows:
+                response = self.request(
+                    'append_resources', lambda: resources_sheet.append_rows(
+                        new_rows, value_input_option='USER_ENTERED',
+                        table_range='A1'
+                    ),
+                    priority=BACKGROUND
+                )
+                # The append lands after the last row of the table
+                first = appended_row(response)
+                with self.index_lock:
+                    for offset, (session, resource_type) in enumerate(
+                        new_keys
+                    ):
+                        index.setdefault(session, {})[resource_type] = (
+                            first + offset
+                        )
+        except StorageError:
+            self.forget_resource_rows()
+            raise
+
+    def release_resources(self, session):
+        """
+        Mark the rows of a session whose game has ended as free, so the
+        next new session writes its resources there instead of adding rows.
+        The session reads the starting resources until it writes again.
+        Args: session (str): The session name.
+        """
+        resources_sheet = self.get_worksheet('resources')
+        with self.index_lock:
+            rows = sorted(
+                self.resource_index(resources_sheet).get(session, {}).values()
+            )
+        if not rows:
+            return
+        try:
+            self.request(
+                'release_resources', lambda: resources_sheet.batch_update([
+                    {'range': f"D{row}", 'values': [[RELEASED_SESSION]]}
+                    for row in rows
+                ], raw=False)
+            )
+        except StorageError:
+            self.forget_resource_rows()
+            raise
+        with self.index_lock:
+            # None if the index was read again after the rows were marked
+            released = self.resource_index(resources_sheet).pop(session, None)
+            if released:
+                self.free_rows.extend(released.values())
+
+
+class SQLiteStorage:
+    """
+    Storage backend keeping the zones, resources and events tables in a
+    local SQLite database. A new database is seeded with SEED_ROWS.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        try:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.create_tables()
+        except sqlite3.Error as e:
+            raise StorageError(e) from e
+
+    def create_tables(self):
+        """
+        Create and seed any missing tables.
+        """
+        with self.connection:
+            for table, columns in TABLE_COLUMNS.items():
+                exists = self.connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                    "AND name = ?", (table,)
+                ).fetchone()
+                if exists:
+                    self.add_missing_columns(table, columns)
+                    continue
+                column_sql = ', '.join(f'"{column}"' for column in columns)
+                self.connection.execute(f'CREATE TABLE {table} ({column_sql})')
+                self.connection.executemany(
+                    f"INSERT INTO {table} VALUES "
+                    f"({', '.join('?' for _ in columns)})",
+                    SEED_ROWS[table]
+                )
+            # Each session's resources are found through this index
+            self.connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS resources_session '
+                'ON resources ("Session", "Resource Type")'
+            )
+
+    def add_missing_columns(self, table, columns):
+        """
+        Add columns missing from a table made by an older version of the
+        game, such as the session of each resource.
+        Args:
+            table (str): The table name.
+            columns (list): The columns the table should have.
+        """
+        existing = {
+            row[1] for row in
+            self.connection.execute(f'PRAGMA table_info({table})')
+        }
+        for column in columns:
+            if column not in existing:
+                self.connection.execute(
+                    f'ALTER TABLE {table} ADD COLUMN "{column}" '
+                    f"NOT NULL DEFAULT ''"
+                )
+
+    def read_values(self, table):
+        """
+        Read every row of a table as strings, including the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of rows, each a list of cell strings.
+        """
+        rows = [list(TABLE_COLUMNS[table])]
+        for row in self.read_rows(table):
+            rows.append(['' if value is None else str(value) for value in row])
+        return rows
+
+    def read_records(self, table):
+        """
+        Read a table as a list of dictionaries keyed by the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of dictionaries, one per row.
+        """
+        columns = TABLE_COLUMNS[table]
+        return [dict(zip(columns, row)) for row in self.read_rows(table)]
+
+    def read_rows(self, table):
+        """
+        Read the raw rows of a table in insertion order.
+        Args: table (str): The table name.
+        Returns: list: A list of row tuples.
+        """
+        try:
+            return self.connection.execute(
+                f'SELECT * FROM {table} ORDER BY rowid'
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise StorageError(e) from e
+
+    def read_resources(self, session):
+        """
+        Read the resources of a session, or the starting resources if the
+        session has none yet.
+        Args: session (str): The session name.
+        Returns: list: A list of dictionaries, one per resource.
+        """
+        try:
+            for owner in (session, TEMPLATE_SESSION):
+                rows = self.connection.execute(
+                    'SELECT "Resource Type", "Current Value", '
+                    '"Regeneration Rate" FROM resources WHERE "Session" = ? '
+                    'ORDER BY rowid', (owner,)
+                ).fetchall()
+                if rows:
+                    return resource_records(rows)
+            return []
+        except sqlite3.Error as e:
+            raise StorageError(e) from e
+
+    def write_resources(self, batch):
+        """
+        Write the resources of every session in the batch in one
+        transaction, adding the rows of new sessions.
+        Args:
+            batch (dict): Session names mapped to resource types mapped to
+            a tuple of (current value, regeneration rate).
+        """
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT INTO resources VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT ("Session", "Resource Type") DO UPDATE SET '
+                    '"Current Value" = excluded."Current Value", '
+                    '"Regeneration Rate" = excluded."Regeneration Rate"',
+                    [
+                        (resource_type, current_value, regeneration_rate,
+                         session)
+                        for session, resources in batch.items()
+                        for resource_type, (current_value, regeneration_rate)
+                        in resources.items()
+                    ]
+                )
+        except sqlite3.Error as e:
+            raise StorageError(e) from e
+
+    def release_resources(self, session):
+        """
+        Delete the resources of a session whose game has ended. The session
+        reads the starting resources until it writes again.
+        Args: session (str): The session name.
+        """
+        try:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM resources WHERE "Session" = ?', (session,)
+                )
+        except sqlite3.Error as e:
+            raise StorageError(e) from e
+
+
+class MemoryStorage:
+    """
+    Storage backend holding the tables in memory, seeded with SEED_ROWS,
+    for benchmarks and headless runs. Each call is counted in calls, as
+    each would be a round trip to Google Sheets.
+    """
+
+    def __init__(self):
+        self.tables = {
+            table: [list(row) for row in rows]
+            for table, rows in SEED_ROWS.items()
+        }
+        self.calls = Counter()
+
+    def read_values(self, table):
+        """
+        Read every row of a table as strings, including the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of rows, each a list of cell strings.
+        """
+        self.calls['read_values'] += 1
+        return [list(TABLE_COLUMNS[table])] + [
+            [str(value) for value in row] for row in self.tables[table]
+        ]
+
+    def read_records(self, table):
+        """
+        Read a table as a list of dictionaries keyed by the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of dictionaries, one per row.
+        """
+        self.calls['read_records'] += 1
+        columns = TABLE_COLUMNS[table]
+        return [dict(zip(columns, row)) for row in self.tables[table]]
+
+    def read_resources(self, session):
+        """
+        Read the resources of a session, or the starting resources if the
+        session has none yet.
+        Args: session (str): The session name.
+        Returns: list: A list of dictionaries, one per resource.
+        """
+        self.calls['read_resources'] += 1
+        rows = self.tables['resources']
+        for owner in (session, TEMPLATE_SESSION):
+            owned = [row[:3] for row in rows if row[3] == owner]
+            if owned:
+                return resource_records(owned)
+        return []
+
+    def write_resources(self, batch):
+        """
+        Write the resources of every session in the batch.
+        Args:
+            batch (dict): Session names mapped to resource types mapped to
+            a tuple of (current value, regeneration rate).
+        """
+        self.calls['write_resources'] += 1
+        rows = self.tables['resources']
+        for session, resources in batch.items():
+            for resource_type, values in resources.items():
+                for row in rows:
+                    if row[0] == resource_type and row[3] == session:
+                        row[1:3] = values
+                        break
+                else:
+                    rows.append([resource_type, *values, session])
+
+    def release_resources(self, session):
+        """
+        Delete the resources of a session whose game has ended.
+        Args: session (str): The session name.
+        """
+        self.calls['release_resources'] += 1
+        self.tables['resources'] = [
+            row for row in self.tables['resources'] if row[3] != session
+        ]
+
+    def version(self):
+        """
+        Report the version of the data, which never changes.
+        Returns: str: The version.
+        """
+        self.calls['version'] += 1
+        return 'memory'
+
+
+class CachedStorage:
+    """
+    Wraps a storage backend, caching reads of the catalog tables in a JSON
+    file shared by every session on the host. Cached data is used without
+    any request until it is older than the TTL. It is then revalidated
+    against the backend's version and only downloaded again if the
+    version has changed. All other calls go straight to the backend.
+    """
+
+    def __init__(self, backend, path, ttl=DEFAULT_CACHE_TTL):
+        self.backend = backend
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def read_values(self, table):
+        """
+        Read every row of a table as strings, including the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of rows, each a list of cell strings.
+        """
+        if table not in CATALOG_TABLES:
+            return self.backend.read_values(table)
+        rows = self.read_cached(table, 'values', self.backend.read_values)
+        return [list(row) for row in rows]
+
+    def read_records(self, table):
+        """
+        Read a table as a list of dictionaries keyed by the header row.
+        Args: table (str): The table name.
+        Returns: list: A list of dictionaries, one per row.
+        """
+        if table not in CATALOG_TABLES:
+            return self.backend.read_records(table)
+        records = self.read_cached(table, 'records', self.backend.read_records)
+        return [dict(record) for record in records]
+
+    def read_cached(self, table, kind, fetch):
+        """
+        Return cached data for a table, refreshing it if it has expired.
+        Args:
+            table (str): The table name.
+            kind (str): 'values' or 'records', the shape of the data.
+            fetch (function): Reads the data from the backend.
+        Returns: list: The cached rows or records.
+        """
+        key = f"{table}:{kind}"
+        entry = self.entries.get(key)
+        if not self.is_fresh(entry):
+            # Another session may already have refreshed the shared file
+            self.entries.update(self.load())
+            entry = self.entries.get(key)
+        if self.is_fresh(entry):
+            return entry['data']
+        try:
+            version = self.backend.version()
+        except StorageError:
+            if entry is None:
+                raise
+            # Better a stale catalog than a game with no zones or events
+            return entry['data']
+        if entry is None or entry['version'] != version:
+            entry = {'version': version, 'data': fetch(table)}
+        entry['fetched_at'] = time.time()
+        self.entries[key] = entry
+        self.save()
+        return entry['data']
+
+    def is_fresh(self, entry):
+        """
+        Check whether a cache entry is younger than the TTL.
+        Args: entry (dict): The cache entry, or None.
+        Returns: bool: True if the entry can be used without revalidation.
+        """
+        return (
+            entry is not None and time.time() - entry['fetched_at'] < self.ttl
+        )
+
+    def load(self):
+        """
+        Load the cache file, ignoring it if it is missing or unreadable.
+        Returns: dict: The cache entries keyed by table and kind.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """
+        Write the cache file atomically so concurrent sessions never read a
+        partly written file.
+        """
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as cache_file:
+                json.dump(self.entries, cache_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not save the catalog cache: {e}")
+
+
+class WriteBehindStorage:
+    """
+    Wraps a storage backend so resource writes never block the game.
+    Writes are coalesced in a queue holding only the latest value of each
+    resource of each session, and a background worker writes the queued
+    values of every session to the backend in one batch every flush
+    interval or when a flush is requested. drain() blocks until the
+    values queued before it was called have been written, so it returns
+    however busy other sessions keep the queue, and it is also run when
+    the program exits.
+    """
+
+    def __init__(self, backend, interval=DEFAULT_FLUSH_INTERVAL):
+        self.backend = backend
+        self.interval = interval
+        self.pending = {}  # Latest queued values of each session
+        self.in_flight = 0  # Resources being written by the worker
+        # Batches taken from the queue by the worker and written so far,
+        # in order, so a drain knows which batch holds its values
+        self.batches_taken = 0
+        self.batches_written = 0
+        self.flush_requested = False
+        self.flush_count = 0
+        self.flush_seconds = {'last': 0.0, 'total': 0.0, 'max': 0.0}
+        # Flush errors not yet reported, by the session whose values failed
+        self.errors = {}
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run_worker, daemon=True).start()
+        atexit.register(self.drain_at_exit)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def write_resources(self, batch):
+        """
+        Queue resource values to be written, replacing any older queued
+        value of the same resource of the same session.
+        Args:
+            batch (dict): Session names mapped to resource types mapped to
+            a tuple of (current value, regeneration rate).
+        """
+        with self.condition:
+            for session, resources in batch.items():
+                self.pending.setdefault(session, {}).update(resources)
+
+    def flush(self):
+        """
+        Ask the worker to write the queued values now, without waiting.
+        """
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+
+    def drain(self, session=None):
+        """
+        Wait until the values queued before the call have been written.
+        Values other sessions queue meanwhile aren't waited for. Errors
+        from background flushes are raised here as a StorageError.
+        Args: session (str): Wait only for this session's values and
+            report only its errors, or every session's if None.
+        """
+        with self.condition:
+            queued = (
+                session in self.pending if session is not None
+                else self.pending
+            )
+            # The worker writes the batch in flight, then the queue
+            target = self.batches_taken + (1 if queued else 0)
+            while self.batches_written < target:
+                # The worker clears the request after each batch
+                self.flush_requested = True
+                self.condition.notify_all()
+                self.condition.wait()
+            if session is not None:
+                errors = self.errors.pop(session, [])
+            else:
+                # A failed batch is recorded once for each of its sessions
+                errors = list(dict.fromkeys(
+                    error for session_errors in self.errors.values()
+                    for error in session_errors
+                ))
+                self.errors = {}
+        if errors:
+            raise StorageError("; ".join(str(error) for error in errors))
+
+    def release_resources(self, session):
+        """
+        Release the resources of a session whose game has ended, dropping
+        its queued values and waiting for any being written first, so none
+        are written back after the release.
+        Args: session (str): The session name.
+        """
+        with self.condition:
+            self.pending.pop(session, None)
+        try:
+            self.drain(session)
+        finally:
+            self.backend.release_resources(session)
+
+    def drain_at_exit(self):
+        """
+        Drain the queue when the program exits, reporting any error.
+        """
+        try:
+            self.drain()
+        except StorageError as e:
+            print(f"Storage error saving resources: {e}")
+
+    def run_worker(self):
+        """
+        Write queued values every flush interval or when a flush is
+        requested.
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.flush_requested, timeout=self.interval
+                )
+                self.flush_requested = False
+                batch, self.pending = self.pending, {}
+                self.in_flight = sum(map(len, batch.values()))
+                if batch:
+                    self.batches_taken += 1
+            try:
+                if batch:
+                    self.write_batch(batch)
+            finally:
+                # Count the batch whatever happened, or drains wait forever
+                with self.condition:
+                    self.in_flight = 0
+                    if batch:
+                        self.batches_written += 1
+                    self.condition.notify_all()
+
+    def write_batch(self, batch):
+        """
+        Write one batch of queued values to the backend and time it.
+        A failed batch is recorded and dropped, so a broken connection
+        can't hold up draining at exit. Any error is recorded, not only a
+        StorageError, as an error escaping would stop the worker.
+        Args: batch (dict): The resource values of each session to write.
+        """
+        start = time.perf_counter()
+        try:
+            self.backend.write_resources(batch)
+        except Exception as e:  # Anything, or the worker thread dies
+            if not isinstance(e, StorageError):
+                e = StorageError(f"{type(e).__name__}: {e}")
+            with self.condition:
+                for session in batch:
+                    self.errors.setdefault(session, []).append(e)
+        finally:
+            seconds = time.perf_counter() - start
+            with self.condition:
+                self.flush_count += 1
+                self.flush_seconds['last'] = seconds
+                self.flush_seconds['total'] += seconds
+                self.flush_seconds['max'] = max(
+                    self.flush_seconds['max'], seconds
+                )
+
+    def stats(self):
+        """
+        Report the queue depth and flush latency.
+        Returns: dict: Queued resources, flush count, and the last, mean
+            and max flush latency in milliseconds.
+        """
+        with self.condition:
+            flushes = max(self.flush_count, 1)
+            return {
+                'queue_depth': (
+                    sum(map(len, self.pending.values())) + self.in_flight
+                ),
+                'flushes': self.flush_count,
+                'last_flush_ms': self.flush_seconds['last'] * 1000,
+                'mean_flush_ms': self.flush_seconds['total'] * 1000 / flushes,
+                'max_flush_ms': self.flush_seconds['max'] * 1000
+            }
+
+
+def open_storage(backend=None):
+    """
+    Open the configured storage backend.
+    Args: backend (str): 'sheets', 'sqlite' or 'memory'. Defaults to the
+        STORAGE_BACKEND environment variable, or 'sheets' if unset.
+    Returns: WriteBehindStorage: The backend, wrapped for write-behind.
+    """
+    backend = (backend or os.environ.get('STORAGE_BACKEND', 'sheets')).lower()
+    if backend == 'sheets':
+        quota = float(os.environ.get('SHEETS_QUOTA', DEFAULT_SHEETS_QUOTA))
+        storage = SheetsStorage(quota=quota)
+        ttl = float(os.environ.get('CACHE_TTL', DEFAULT_CACHE_TTL))
+        if ttl > 0:
+            cache_dir = os.environ.get('CACHE_DIR', tempfile.gettempdir())
+            storage = CachedStorage(
+                storage, os.path.join(cache_dir, CACHE_FILE_NAME), ttl
+            )
+    elif backend == 'sqlite':
+        storage = SQLiteStorage(
+            os.environ.get('STORAGE_PATH', DEFAULT_DB_PATH)
+        )
+    elif backend == 'memory':
+        storage = MemoryStorage()
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    interval = float(
+        os.environ.get('FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+    )
+    return WriteBehindStorage(storage, interval)
@@ -0,0 +1,54 @@
+"""
+Tests for the build-order planner.
+"""
+import random
+import time
+import unittest
+from engine import GameState, default_resources, parse_events, parse_zone_data
+from planner import plan
+from storage import SEED_ROWS, TABLE_COLUMNS
+
+TOLERANCE = 0.1  # Seconds a plan may overrun its budget, for a slow machine
+
+
+def catalog():
+    """
+    Returns: tuple: The zones and events of the built-in tables, compiled.
+    """
+    zones = [TABLE_COLUMNS['zones']]
+    zones += [list(row) for row in SEED_ROWS['zones']]
+    events = [
+        dict(zip(TABLE_COLUMNS['events'], row)) for row in SEED_ROWS['events']
+    ]
+    return parse_zone_data(zones), parse_events(events)
+
+
+class PlanBudgetTest(unittest.TestCase):
+    """
+    plan() must answer within its budget, however large the game.
+    """
+
+    def assert_within_budget(self, size, zones_per_day, budget):
+        zone_data, events = catalog()
+        state = GameState(
+            zone_data, events, default_resources(), size=size,
+            verbose=False, rng=random.Random(1), zones_per_day=zones_per_day
+        )
+        start = time.perf_counter()
+        found = plan(state, budget)
+        seconds = time.perf_counter() - start
+        self.assertLess(seconds, budget + TOLERANCE)
+        self.assertEqual(found.actions[-1], ('next',))
+
+    def test_large_map_with_a_high_daily_limit(self):
+        self.assert_within_budget(1000, 500, 0.1)
+
+    def test_medium_map(self):
+        self.assert_within_budget(500, 50, 0.2)
+
+    def test_small_map(self):
+        self.assert_within_budget(10, 3, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Tests for the storage backends.
+"""
+import re
+import threading
+import unittest
+from storage import (
+    SEED_ROWS, TABLE_COLUMNS, MemoryStorage, SheetsStorage, StorageError,
+    WriteBehindStorage
+)
+
+
+class BrokenStorage(MemoryStorage):
+    """
+    Fails every resource write with an error that isn't a StorageError.
+    """
+
+    def write_resources(self, batch):
+        raise KeyError('updates')
+
+
+class FakeWorksheet:
+    """
+    Holds the cells of a worksheet, answering the calls SheetsStorage
+    makes as gspread would.
+    """
+
+    def __init__(self, rows):
+        self.rows = [[str(value) for value in row] for row in rows]
+        self.append_reply = None  # Replaces the reply to appends if set
+
+    def get_all_values(self):
+        width = max(map(len, self.rows))
+        return [row + [''] * (width - len(row)) for row in self.rows]
+
+    def cell_range(self, a1):
+        first, _, last = a1.partition(':')
+        columns, rows = zip(*(
+            re.fullmatch(r'([A-Z])(\d+)', cell).groups()
+            for cell in (first, last or first)
+        ))
+        return ord(columns[0]) - ord('A'), int(rows[0]) - 1
+
+    def batch_get(self, ranges):
+        values = []
+        for a1 in ranges:
+            column, row = self.cell_range(a1)
+            values.append([self.rows[row][column:column + 3]])
+        return values
+
+    def batch_update(self, updates, raw=True):
+        for update in updates:
+            column, row = self.cell_range(update['range'])
+            cells = self.rows[row]
+            for offset, value in enumerate(update['values'][0]):
+                cells[column + offset] = str(value)
+
+    def append_rows(self, rows, value_input_option=None, table_range=None):
+        first = len(self.rows) + 1
+        self.rows.extend([str(value) for value in row] for row in rows)
+        if self.append_reply is not None:
+            return self.append_reply
+        return {'updates': {
+            'updatedRange': f"resources!A{first}:D{len(self.rows)}"
+        }}
+
+
+class FakeSheetsStorage(SheetsStorage):
+    """
+    SheetsStorage connected to a fake 'resources' worksheet.
+    """
+
+    def connect(self):
+        self.resources = FakeWorksheet(
+            [TABLE_COLUMNS['resources']] + SEED_ROWS['resources']
+        )
+        self.worksheets['resources'] = self.resources
+        self.connected.set()
+
+
+class SheetsResourcesTest(unittest.TestCase):
+    """
+    Each session's resource rows are found through the cached index, and
+    the rows of ended sessions are reused.
+    """
+
+    def setUp(self):
+        self.storage = FakeSheetsStorage()
+        self.storage.connected.wait()
+
+    def money(self, session):
+        records = self.storage.read_resources(session)
+        return {
+            record['Resource Type']: record['Current Value']
+            for record in records
+        }['Money']
+
+    def test_sessions_read_their_own_rows(self):
+        self.storage.write_resources({
+            'one': {'Money': (1, 0)}, 'two': {'Money': (2, 0)}
+        })
+        self.assertEqual(self.money('one'), '1')
+        self.assertEqual(self.money('two'), '2')
+        self.assertEqual(self.money('three'), '10000')  # The template
+
+    def test_released_rows_are_reused(self):
+        self.storage.write_resources({'one': {'Money': (1, 0)}})
+        rows = len(self.storage.resources.rows)
+        self.storage.release_resources('one')
+        self.assertEqual(self.money('one'), '10000')
+        self.storage.write_resources({'two': {'Money': (2, 0)}})
+        self.assertEqual(len(self.storage.resources.rows), rows)
+        self.assertEqual(self.money('two'), '2')
+        # The index read again from the sheet agrees
+        self.storage.resource_rows = None
+        self.assertEqual(self.money('two'), '2')
+        self.assertEqual(self.money('one'), '10000')
+
+    def test_bad_append_reply_drops_the_index(self):
+        self.storage.resources.append_reply = {'updates': {}}
+        with self.assertRaises(StorageError):
+            self.storage.write_resources({'one': {'Money': (1, 0)}})
+        self.assertIsNone(self.storage.resource_rows)
+        # The rows did land, and are found by reading the sheet again
+        self.assertEqual(self.money('one'), '1')
+
+
+class WriteBehindTest(unittest.TestCase):
+    """
+    The write-behind queue must survive any error from its backend.
+    """
+
+    def test_drain_reports_a_plain_exception(self):
+        storage = WriteBehindStorage(BrokenStorage(), interval=60)
+        storage.write_resources({'player': {'Money': (1.0, 0.0)}})
+        errors = []
+
+        def drain():
+            try:
+                storage.drain('player')
+            except StorageError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=drain, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), "drain() never returned")
+        self.assertEqual(len(errors), 1)
+        self.assertIn('KeyError', str(errors[0]))
+        # The worker is still running and takes the next write
+        storage.write_resources({'player': {'Money': (2.0, 0.0)}})
+        with self.assertRaises(StorageError):
+            storage.drain('player')
+
+
+if __name__ == '__main__':
+    unittest.main()
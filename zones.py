@@ -0,0 +1,259 @@
+"""
+Zone rules for McGee Metropolis. The rows of the zones table are compiled
+once into an immutable ZoneCatalog, which holds the cost, income, starting
+count and metric effects of each zone type in tuples indexed by zone code.
+Building a zone is then a lookup and a single add-and-clip of its metric
+deltas, with no branching on the zone type.
+
+ZONE_RULES holds the built-in cost and effects of each zone type. The
+zones table can override them with optional 'Cost' and metric columns, so
+the game can be retuned without code changes.
+"""
+import numpy as np
+
+# Zone types by zone code, code 0 is an empty cell
+ZONE_TYPES = ('-', 'Residential', 'Commercial', 'Industrial', 'School',
+              'Hospital')
+ZONE_CODES = {zone_type: code for code, zone_type in enumerate(ZONE_TYPES)}
+EMPTY = ZONE_CODES['-']
+RESIDENTIAL = ZONE_CODES['Residential']
+
+# The metrics zones change, in the order of their deltas, and their range
+METRICS = ('Employment Rate', 'Crime Rate', 'Happiness Index', 'Health')
+METRIC_RANGE = (0, 100)
+
+# Built-in rules of each zone type: its cost, the change to each metric
+# for each zone built, the share of the player's money each zone built
+# adds, and the change to each metric for each Residential zone a service
+# covers, that is each Residential zone within SERVICE_RADIUS steps of it
+ZONE_RULES = {
+    'Residential': {
+        'cost': 1250,
+        'effects': {'Employment Rate': -5}
+    },
+    'Commercial': {
+        'cost': 450,
+        'effects': {'Employment Rate': 2, 'Happiness Index': -1},
+        'money_rate': 0.05
+    },
+    'Industrial': {
+        'cost': 450,
+        'effects': {'Happiness Index': -1, 'Health': -1}
+    },
+    'School': {
+        'cost': 100,
+        'coverage': {'Employment Rate': 2, 'Happiness Index': 1}
+    },
+    'Hospital': {
+        'cost': 100,
+        'coverage': {'Health': 5}
+    }
+}
+SERVICE_RADIUS = 2
+SERVICE_EFFECTS = {
+    zone_type: rules['coverage']
+    for zone_type, rules in ZONE_RULES.items() if 'coverage' in rules
+}
+
+
+def number(value, zone_type, column, log):
+    """
+    Read a number from a cell of the zones table.
+    Args:
+        value (str): The cell.
+        zone_type (str): The zone type of the row, for messages.
+        column (str): The column, for messages.
+        log (list): Messages about invalid values are appended here.
+    Returns: float: The number, or None if the cell is empty or invalid.
+    """
+    value = str(value).replace(',', '').strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        if log is not None:
+            log.append(f"Invalid {column.lower()} for {zone_type}: {value}")
+        return None
+
+
+def metric_vector(effects):
+    """
+    Turn metric changes into a vector in the order of METRICS.
+    Args: effects (dict): Metric names mapped to their change.
+    Returns: tuple: The change to each metric, 0 for the others.
+    """
+    return tuple(effects.get(metric, 0) for metric in METRICS)
+
+
+class ZoneCatalog:
+    """
+    The compiled rules of every zone type, indexed by zone code: costs,
+    daily incomes, the counts placed on a new grid, metric deltas for
+    each zone built, the share of money each zone built adds and the
+    metric deltas of a service for each Residential zone it covers. The
+    catalog can't be changed once built.
+    """
+    __slots__ = ('zone_data', 'costs', 'incomes', 'counts', 'effects',
+                 'money_rates', 'coverage')
+
+    def __init__(self, zone_data):
+        """
+        Args: zone_data (dict): Zone types mapped to their 'count' and
+            'income', and optionally their 'cost' and metric 'effects',
+            which replace those of ZONE_RULES.
+        """
+        zone_data = {
+            zone_type: data for zone_type, data in zone_data.items()
+            if zone_type in ZONE_CODES and zone_type != ZONE_TYPES[EMPTY]
+        }
+        costs = [0] * len(ZONE_TYPES)
+        counts = [0] * len(ZONE_TYPES)
+        incomes = np.zeros(len(ZONE_TYPES))
+        effects = [metric_vector({})] * len(ZONE_TYPES)
+        money_rates = [0.0] * len(ZONE_TYPES)
+        coverage = [metric_vector({})] * len(ZONE_TYPES)
+        for zone_type, rules in ZONE_RULES.items():
+            code = ZONE_CODES[zone_type]
+            data = zone_data.get(zone_type, {})
+            costs[code] = data.get('cost', rules['cost'])
+            counts[code] = data.get('count', 0)
+            incomes[code] = data.get('income', 0.0)
+            effects[code] = metric_vector(
+                dict(rules.get('effects', {}), **data.get('effects', {}))
+            )
+            money_rates[code] = rules.get('money_rate', 0.0)
+            coverage[code] = metric_vector(rules.get('coverage', {}))
+        incomes.flags.writeable = False
+        for name, value in (
+            ('zone_data', zone_data), ('costs', tuple(costs)),
+            ('incomes', incomes), ('counts', tuple(counts)),
+            ('effects', tuple(effects)), ('money_rates', tuple(money_rates)),
+            ('coverage', tuple(coverage))
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("A ZoneCatalog can't be changed.")
+
+    def __reduce__(self):
+        return (ZoneCatalog, (self.records(),))
+
+    def __len__(self):
+        """
+        The zone types read from the zones table, none if it couldn't be.
+        """
+        return len(self.zone_data)
+
+    @classmethod
+    def compile(cls, data, log=None):
+        """
+        Compile the rows of the zones table.
+        Args: data (list): Rows of cell strings, including the header row.
+            The 'Cost' column and a column for each metric are optional.
+            log (list): Messages about invalid values are appended here.
+        Returns: ZoneCatalog: The compiled zones.
+        """
+        header = [column.strip() for column in data[0]] if data else []
+        optional = {
+            column: header.index(column) for column in ('Cost',) + METRICS
+            if column in header
+        }
+        zone_data = {}
+        for row in data[1:]:  # Skip header row
+            zone_type = row[0]
+            count = row[1].strip()
+            income = row[2].strip()
+            if count.isdigit():  # Validate and convert count and income
+                count = int(count)
+            else:
+                if log is not None:
+                    log.append(f"Invalid count for {zone_type}: {count}")
+                count = 0
+            try:
+                income = float(income) if income else 0.0
+            except ValueError:
+                if log is not None:
+                    log.append(f"Invalid income for {zone_type}: {income}")
+                income = 0.0
+            zone = {'count': count, 'income': income}
+            for column, index in optional.items():
+                value = number(
+                    row[index] if index < len(row) else '', zone_type,
+                    column, log
+                )
+                if value is None:
+                    continue
+                if column == 'Cost':
+                    zone['cost'] = value
+                else:
+                    zone.setdefault('effects', {})[column] = value
+            zone_data[zone_type] = zone
+        return cls(zone_data)
+
+    def records(self):
+        """
+        Turn the catalog back into zone data, which builds the same
+        catalog, for journals.
+        Returns: dict: Zone types mapped to their count, income, cost and
+            metric effects.
+        """
+        return {
+            zone_type: {
+                'count': self.counts[ZONE_CODES[zone_type]],
+                'income': float(self.incomes[ZONE_CODES[zone_type]]),
+                'cost': self.costs[ZONE_CODES[zone_type]],
+                'effects': {
+                    metric: delta for metric, delta in zip(
+                        METRICS, self.effects[ZONE_CODES[zone_type]]
+                    )
+                    if delta
+                }
+            }
+            for zone_type in self.zone_data
+        }
+
+    def cost(self, zone_type):
+        """
+        Args: zone_type (str): The zone type.
+        Returns: float: The cost of building a zone of the type.
+        """
+        return self.costs[ZONE_CODES[zone_type]]
+
+    def apply(self, metrics, player_resources, code, amount=1,
+              newly_covered=None):
+        """
+        Apply the effects of building zones: their share of the player's
+        money, then their metric deltas and those of the Residential zones
+        newly covered by services, added and clipped to METRIC_RANGE in a
+        single pass.
+        Args:
+            metrics (dict): The current metrics.
+            player_resources (dict): A dictionary containing the resources.
+            code (int): The zone code built.
+            amount (int): The number of zones built.
+            newly_covered (dict): Residential zones newly covered by each
+                type of service.
+        """
+        rate = self.money_rates[code]
+        if rate:
+            money = player_resources['Money']
+            for _ in range(amount):
+                money['Current Value'] += money['Current Value'] * rate
+        deltas = self.effects[code]
+        if amount != 1:
+            deltas = [delta * amount for delta in deltas]
+        for service, covered in (newly_covered or {}).items():
+            deltas = [
+                delta + covered * points for delta, points in
+                zip(deltas, self.coverage[ZONE_CODES[service]])
+            ]
+        low, high = METRIC_RANGE
+        for metric, delta in zip(METRICS, deltas):
+            value = metrics[metric] + delta
+            metrics[metric] = low if value < low else (
+                high if value > high else value
+            )
+
+
+DEFAULT_ZONES = ZoneCatalog({})  # The built-in rules, with no zones placed